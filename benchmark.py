@@ -0,0 +1,303 @@
+"""Benchmarks for the codecs and the GIF decoder.
+
+Every codec is run over a corpus of synthetic text, random, repetitive
+and binary data at a range of sizes, plus test.dat, and the GIF
+decoder's LZW path is timed on macallan.gif. Codecs that end in
+entropy coding are run once with each coder, as bzip+range and so on,
+to compare them with Huffman coding. For each run we report
+encode and decode throughput in MB/s (best of several), the
+compression ratio and the peak memory allocated by Python while
+encoding and decoding, as measured by tracemalloc.
+
+    python benchmark.py
+    python benchmark.py --sizes 1K,1M,100M --codecs lzwv,bzip
+    python benchmark.py --json results.json --compare baseline.json
+
+The pure-Python codecs run at well under 1 MB/s, so the default sizes
+stop at 100K; larger ones take minutes or hours per codec.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tracemalloc
+from timeit import repeat
+
+from container import CODECS, ENTROPY_CODECS
+from entropy import CODERS, DEFAULT_CODER
+from gif_decoder import decode_gif, decode_lzw, read_gif
+
+DEFAULT_SIZES = '1K,10K,100K'
+DEFAULT_REPEATS = 3
+CORPUS_FILE = 'test.dat'
+GIF_FILE = 'macallan.gif'
+SEED = 1234
+
+# Fraction a throughput may drop by before --compare reports it
+REGRESSION_TOLERANCE = 0.10
+
+
+###############################################################################
+
+WORDS = ('the of and to in is was that for it with as his on be at by had '
+         'are but from or have an they which one you were her all she there '
+         'would their we him been has when who will more no if out so said '
+         'what up its about into than them can only other new some could '
+         'time these two may then do first any my now such like our over '
+         'man me even most made after also did many before must through').split()
+
+
+def make_text(size, rng):
+    """English-looking text: common words, sentences and paragraphs."""
+    out = []
+    length = 0
+    while length < size:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 16)))
+        sentence = sentence.capitalize() + rng.choice('...!?,;') + ' '
+        if rng.random() < 0.1:
+            sentence += '\n\n'
+        out.append(sentence)
+        length += len(sentence)
+    return ''.join(out).encode('ascii')[:size]
+
+
+def make_random(size, rng):
+    return rng.randbytes(size)
+
+
+def make_repetitive(size, rng):
+    """A short pattern repeated, with the odd byte changed."""
+    pattern = rng.randbytes(rng.randint(16, 64))
+    data = bytearray((pattern * (size // len(pattern) + 1))[:size])
+    for _ in range(size // 1000):
+        data[rng.randrange(size)] = rng.randrange(256)
+    return bytes(data)
+
+
+def make_binary(size, rng):
+    """Fixed-size records of small integers, counters and floats, like
+    a typical binary file format."""
+    out = bytearray()
+    i = 0
+    while len(out) < size:
+        out += i.to_bytes(4, 'little')
+        out += rng.randrange(1000).to_bytes(2, 'little')
+        out += bytes([rng.choice((0, 0, 0, 1, 2, 255))] * 2)
+        out += int(rng.gauss(2**31, 2**20)).to_bytes(8, 'little')
+        i += 1
+    return bytes(out[:size])
+
+
+CORPUS_KINDS = {
+    'text': make_text,
+    'random': make_random,
+    'repetitive': make_repetitive,
+    'binary': make_binary,
+}
+
+
+def parse_size(text):
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30}
+    text = text.strip().upper()
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def make_corpus(sizes, kinds=CORPUS_KINDS, corpus_file=CORPUS_FILE):
+    """Return a list of (name, data) pairs."""
+    corpus = []
+    for kind, make in kinds.items():
+        for size in sizes:
+            corpus.append((f'{kind}-{size}', make(size, random.Random(SEED))))
+    if corpus_file and os.path.exists(corpus_file):
+        with open(corpus_file, 'rb') as f:
+            corpus.append((os.path.basename(corpus_file), f.read()))
+    return corpus
+
+
+###############################################################################
+
+def best_time(fn, repeats):
+    return min(repeat(fn, number=1, repeat=repeats))
+
+
+def peak_memory(fn):
+    """Peak bytes allocated by Python while running fn."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def mb_per_sec(size, seconds):
+    return size / seconds / 1e6 if seconds > 0 else float('inf')
+
+
+def benchmark_codec(codec, data, repeats=DEFAULT_REPEATS, measure_memory=True, coder=DEFAULT_CODER):
+    encode, decode, params = CODECS[codec]
+    options = dict(params)
+    name = codec
+    if coder != DEFAULT_CODER:
+        options['coder'] = coder
+        name = f'{codec}+{coder}'
+    result = {'codec': name, 'size': len(data)}
+    try:
+        encoded = encode(data, **options)
+        decoded = decode(encoded, **params)
+    except Exception as e:
+        # Some codecs have limits, like bzip's 16-bit block sizes on
+        # incompressible data; record them rather than give up
+        result['error'] = f'{type(e).__name__}: {e}'
+        return result
+
+    result['ok'] = decoded == data
+    result['encoded_size'] = len(encoded)
+    result['ratio'] = len(encoded) / len(data) if data else 0.0
+    encode_seconds = best_time(lambda: encode(data, **options), repeats)
+    decode_seconds = best_time(lambda: decode(encoded, **params), repeats)
+    result['encode_seconds'] = encode_seconds
+    result['decode_seconds'] = decode_seconds
+    result['encode_mb_per_sec'] = mb_per_sec(len(data), encode_seconds)
+    result['decode_mb_per_sec'] = mb_per_sec(len(data), decode_seconds)
+    if measure_memory:
+        result['encode_peak_bytes'] = peak_memory(lambda: encode(data, **options))
+        result['decode_peak_bytes'] = peak_memory(lambda: decode(encoded, **params))
+    return result
+
+
+def benchmark_gif(filename=GIF_FILE, repeats=5):
+    """Time decode_gif() as a whole, and its LZW path on its own."""
+    screen, _, _ = decode_gif(filename)
+    pixels = screen['width'] * screen['height']
+    best = best_time(lambda: decode_gif(filename), repeats)
+    result = {'file': filename, 'pixels': pixels, 'seconds': best,
+              'mpixels_per_sec': pixels / best / 1e6}
+
+    _, _, images = read_gif(filename)
+    rasters = [(raster, image['width'] * image['height']) for image, raster in images]
+    lzw_seconds = best_time(lambda: [decode_lzw(r, n) for r, n in rasters], repeats)
+    result['lzw_seconds'] = lzw_seconds
+    result['lzw_mb_per_sec'] = mb_per_sec(pixels, lzw_seconds)
+    result['lzw_peak_bytes'] = peak_memory(lambda: [decode_lzw(r, n) for r, n in rasters])
+    return result
+
+
+def run_benchmarks(codecs=None, sizes=None, repeats=DEFAULT_REPEATS, measure_memory=True,
+                   gif_file=GIF_FILE, coders=CODERS, log=None):
+    codecs = codecs or list(CODECS)
+    sizes = sizes or [parse_size(s) for s in DEFAULT_SIZES.split(',')]
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeats': repeats,
+        'codecs': [],
+    }
+    for name, data in make_corpus(sizes):
+        for codec in codecs:
+            for coder in coders if codec in ENTROPY_CODECS else [DEFAULT_CODER]:
+                result = benchmark_codec(codec, data, repeats, measure_memory, coder)
+                result['corpus'] = name
+                results['codecs'].append(result)
+                if log:
+                    log(format_result(result))
+    if gif_file and os.path.exists(gif_file):
+        results['gif'] = benchmark_gif(gif_file, repeats)
+        if log:
+            log(format_gif_result(results['gif']))
+    return results
+
+
+###############################################################################
+
+def format_result(r):
+    line = f"{r['codec']:>23} {r['corpus']:>18} "
+    if 'error' in r:
+        return line + r['error']
+    line += (f"ratio {r['ratio']:6.3f}  enc {r['encode_mb_per_sec']:7.3f} MB/s  "
+             f"dec {r['decode_mb_per_sec']:7.3f} MB/s")
+    if 'encode_peak_bytes' in r:
+        line += (f"  peak {r['encode_peak_bytes'] / 2**20:7.2f} / "
+                 f"{r['decode_peak_bytes'] / 2**20:7.2f} MiB")
+    if not r['ok']:
+        line += '  MISMATCH'
+    return line
+
+
+def format_gif_result(r):
+    return (f"Decoded {r['file']} ({r['pixels']} pixels) in {r['seconds']:.4f}s, "
+            f"{r['mpixels_per_sec']:.2f} Mpixels/s; LZW alone {r['lzw_mb_per_sec']:.2f} MB/s")
+
+
+def compare(baseline, results, tolerance=REGRESSION_TOLERANCE):
+    """List the ways results are worse than baseline.
+
+    Throughput that drops by more than tolerance, a ratio that gets
+    worse, a round trip that stops matching or a new error all count.
+    """
+    old = {(r['codec'], r['corpus']): r for r in baseline['codecs']}
+    regressions = []
+    for r in results['codecs']:
+        key = (r['codec'], r['corpus'])
+        if key not in old:
+            continue
+        o = old[key]
+        name = f'{key[0]} on {key[1]}'
+        if 'error' in r:
+            if 'error' not in o:
+                regressions.append(f"{name}: {r['error']}")
+            continue
+        if 'error' in o:
+            continue
+        if o['ok'] and not r['ok']:
+            regressions.append(f'{name}: round trip no longer matches')
+        if r['ratio'] > o['ratio']:
+            regressions.append(f"{name}: ratio {o['ratio']:.4f} -> {r['ratio']:.4f}")
+        for field in ('encode_mb_per_sec', 'decode_mb_per_sec'):
+            if r[field] < o[field] * (1 - tolerance):
+                regressions.append(f'{name}: {field} {o[field]:.3f} -> {r[field]:.3f}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the codecs.')
+    parser.add_argument('--codecs', help=f"comma-separated, from {', '.join(CODECS)}")
+    parser.add_argument('--coders', default=','.join(CODERS),
+                        help=f"entropy coders for {', '.join(ENTROPY_CODECS)}, from {', '.join(CODERS)}")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma-separated, e.g. 1K,1M,100M')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='report regressions against earlier JSON results')
+    args = parser.parse_args(argv)
+
+    codecs = args.codecs.split(',') if args.codecs else None
+    for codec in codecs or []:
+        if codec not in CODECS:
+            parser.error(f'Unknown codec: {codec}')
+    coders = args.coders.split(',')
+    for coder in coders:
+        if coder not in CODERS:
+            parser.error(f'Unknown coder: {coder}')
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    results = run_benchmarks(codecs, sizes, args.repeats, not args.no_memory, coders=coders, log=print)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""MSB-first bit writer and reader built on plain integers.
+
+Bits are packed into an integer accumulator and moved to or from bytes
+a word at a time, so writing a field is a shift and an or rather than
+a new object. The layout matches bitstring's: the first bit written is
+the most significant bit of the first byte, and the last byte is
+padded with zeros.
+"""
+
+
+FLUSH_BITS = 64
+
+
+class ReadError(Exception):
+    pass
+
+
+class FieldOverflowError(ValueError):
+    """A value too big for the field it's being written to."""
+
+
+def byte_view(data):
+    """View any buffer (bytes, memoryview, mmap, ...) as a flat sequence
+    of ints, without copying it.
+
+    Iterating over an mmap gives one-byte bytes objects rather than
+    ints, so codecs that loop over their input go through this first.
+    """
+    return memoryview(data).cast('B')
+
+
+class BitWriter:
+    def __init__(self):
+        self.out = bytearray()
+        self.acc = 0
+        self.acc_bits = 0
+
+    def write(self, value, nbits):
+        if value >> nbits:
+            raise FieldOverflowError(f'{value} does not fit in {nbits} bits')
+        self.acc = (self.acc << nbits) | value
+        self.acc_bits += nbits
+        if self.acc_bits >= FLUSH_BITS:
+            self.flush()
+
+    def write_bool(self, value):
+        self.write(1 if value else 0, 1)
+
+    def write_ue(self, value):
+        """Write an unsigned exponential-Golomb code."""
+        value += 1
+        self.write(value, 2 * value.bit_length() - 1)
+
+    def write_bytes(self, data):
+        if self.acc_bits % 8 == 0:
+            self.flush()
+            self.out += data
+        else:
+            self.write(int.from_bytes(data, 'big'), 8 * len(data))
+
+    def flush(self):
+        """Move all of the whole bytes in the accumulator to the output."""
+        nbytes = self.acc_bits // 8
+        if nbytes > 0:
+            self.acc_bits -= 8 * nbytes
+            self.out += (self.acc >> self.acc_bits).to_bytes(nbytes, 'big')
+            self.acc &= (1 << self.acc_bits) - 1
+
+    def take_bytes(self):
+        """Return the whole bytes written so far and drop them from the output."""
+        self.flush()
+        out = bytes(self.out)
+        self.out.clear()
+        return out
+
+    def __len__(self):
+        """Number of bits written so far."""
+        return 8 * len(self.out) + self.acc_bits
+
+    def tobytes(self):
+        self.flush()
+        if self.acc_bits == 0:
+            return bytes(self.out)
+        return bytes(self.out) + bytes([(self.acc << (8 - self.acc_bits)) & 0xff])
+
+
+class BitReader:
+    def __init__(self, data):
+        self.data = memoryview(data).cast('B')
+        self.byte_pos = 0
+        self.acc = 0
+        self.acc_bits = 0
+
+    def fill(self, nbits):
+        """Make sure at least nbits are in the accumulator."""
+        needed = nbits - self.acc_bits
+        word = self.data[self.byte_pos:self.byte_pos+max(8, (needed + 7) // 8)]
+        if 8 * len(word) < needed:
+            raise ReadError(f'Tried to read {nbits} bits with {self.bits_left()} left')
+        self.acc = (self.acc << (8 * len(word))) | int.from_bytes(word, 'big')
+        self.acc_bits += 8 * len(word)
+        self.byte_pos += len(word)
+
+    def read(self, nbits):
+        if self.acc_bits < nbits:
+            self.fill(nbits)
+        self.acc_bits -= nbits
+        value = self.acc >> self.acc_bits
+        self.acc &= (1 << self.acc_bits) - 1
+        return value
+
+    def peek(self, nbits):
+        if self.acc_bits < nbits:
+            self.fill(nbits)
+        return self.acc >> (self.acc_bits - nbits)
+
+    def read_bool(self):
+        return self.read(1) == 1
+
+    def read_ue(self):
+        """Read an unsigned exponential-Golomb code."""
+        leading_zeros = 0
+        while self.read(1) == 0:
+            leading_zeros += 1
+        return (1 << leading_zeros | self.read(leading_zeros)) - 1
+
+    def read_bytes(self, nbytes):
+        if self.acc_bits == 0:
+            data = self.data[self.byte_pos:self.byte_pos+nbytes]
+            if len(data) < nbytes:
+                raise ReadError(f'Tried to read {nbytes} bytes with {len(data)} left')
+            self.byte_pos += nbytes
+            return bytes(data)
+        return self.read(8 * nbytes).to_bytes(nbytes, 'big')
+
+    @property
+    def pos(self):
+        """Number of bits read so far."""
+        return 8 * self.byte_pos - self.acc_bits
+
+    def bits_left(self):
+        return 8 * (len(self.data) - self.byte_pos) + self.acc_bits
+
+
+class BitInputBuffer:
+    """Holds input for a streaming decoder between calls.
+
+    feed() adds a chunk and returns a BitReader positioned at the first
+    unconsumed bit. Once the decoder has read as many whole units as it
+    can, it passes the reader's position to consume(), and anything
+    after that is kept for the next call.
+    """
+    def __init__(self):
+        self.unused = bytearray()
+        self.bit_offset = 0
+
+    def feed(self, data):
+        self.unused += data
+        reader = BitReader(bytes(self.unused))
+        reader.read(self.bit_offset)
+        return reader
+
+    def consume(self, bit_pos):
+        del self.unused[:bit_pos // 8]
+        self.bit_offset = bit_pos % 8
+
+
+class LsbBitReader:
+    """LSB-first bit reader, as used by GIF's LZW data.
+
+    Each new byte goes above the bits already in the accumulator, and
+    fields are taken from the bottom.
+    """
+    def __init__(self, data):
+        self.data = memoryview(data).cast('B')
+        self.byte_pos = 0
+        self.acc = 0
+        self.acc_bits = 0
+
+    def read(self, nbits):
+        if self.acc_bits < nbits:
+            word = self.data[self.byte_pos:self.byte_pos+8]
+            if 8 * len(word) + self.acc_bits < nbits:
+                raise ReadError(f'Tried to read {nbits} bits with {8 * len(word) + self.acc_bits} left')
+            self.acc |= int.from_bytes(word, 'little') << self.acc_bits
+            self.acc_bits += 8 * len(word)
+            self.byte_pos += len(word)
+        value = self.acc & ((1 << nbits) - 1)
+        self.acc >>= nbits
+        self.acc_bits -= nbits
+        return value
@@ -0,0 +1,338 @@
+"""Command-line front end for the codecs.
+
+    python -m cli compress -a bzip test.dat
+    python -m cli decompress test.dat.bzip
+    python -m cli decompress --range 1000:2000 test.dat.bzip part.dat
+    python -m cli test test.dat.bzip
+    python -m cli test -a lzss test.dat
+    python -m cli test -a lz77huff test.dat
+    python -m cli compress -a bzip --coder range test.dat
+    python -m cli compress -a lz77deflate --level 9 test.dat
+
+Files are compressed into containers (see container.py), which record
+the codec and its parameters, so decompressing doesn't need to be told
+them. With --raw the codec's bare stream is written instead, and
+decompressing that does need -a.
+
+Input files are memory-mapped and fed to the codecs a chunk or block
+at a time, with the output written out as it comes. Neither the input
+nor the output is ever held in memory all at once.
+"""
+
+import argparse
+import mmap
+import os
+import sys
+import traceback
+from contextlib import closing, contextmanager
+
+import container
+from container import (ContainerError, ContainerReader, ContainerWriter, ENTROPY_CODECS, LEVEL_CODECS,
+                       is_container)
+from bitio import ReadError
+from entropy import CODERS, DEFAULT_CODER
+from huffman import (AdaptiveHuffmanCompressor, AdaptiveHuffmanDecompressor,
+                     HuffmanCompressor, HuffmanDecompressor)
+from lz77 import Lz77Compressor, Lz77Decompressor
+from lzss import LzssCompressor, LzssDecompressor, LzssbCompressor, LzssbDecompressor
+from lzw_fixed import LzwfCompressor, LzwfDecompressor
+from lzw_variable import LzwvCompressor, LzwvDecompressor
+from shitty_bzip import Bzip0Compressor, Bzip0Decompressor
+
+
+# Codecs with incremental compressor and decompressor objects, which
+# are the ones that can write a raw stream
+STREAM_CODECS = {
+    'lz77': (Lz77Compressor, Lz77Decompressor),
+    'lzss': (LzssCompressor, LzssDecompressor),
+    'lzssb': (LzssbCompressor, LzssbDecompressor),
+    'huffman': (HuffmanCompressor, HuffmanDecompressor),
+    'ahuffman': (AdaptiveHuffmanCompressor, AdaptiveHuffmanDecompressor),
+    'lzwf': (LzwfCompressor, LzwfDecompressor),
+    'lzwv': (LzwvCompressor, LzwvDecompressor),
+    'bzip': (Bzip0Compressor, Bzip0Decompressor),
+}
+
+DEFAULT_CODEC = 'bzip'
+CHUNK_SIZE = 2**20
+
+
+@contextmanager
+def mapped(path):
+    """Memory-map a file for reading.
+
+    Empty files can't be mapped, so they come back as b''.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                yield data
+            except BaseException as e:
+                # Views of data left in the traceback's frames would stop
+                # the mmap closing, and hide e behind a BufferError
+                traceback.clear_frames(e.__traceback__)
+                raise
+
+
+@contextmanager
+def output_file(path):
+    """Open path for writing, deleting it again if anything fails
+    before it's finished, so no partial output is left behind."""
+    try:
+        with open(path, 'wb') as f:
+            yield f
+    except BaseException:
+        os.remove(path)
+        raise
+
+
+def chunks(data):
+    """Yield views of data a chunk at a time.
+
+    Each view is released once the next one is asked for, and all of
+    them when the generator is closed.
+    """
+    view = memoryview(data)
+    try:
+        for start in range(0, len(view), CHUNK_SIZE):
+            with view[start:start+CHUNK_SIZE] as chunk:
+                yield chunk
+            drop_pages(data, start, CHUNK_SIZE)
+    finally:
+        view.release()
+
+
+def run(codec_obj, process, data, out_file):
+    """Feed data through process (compress or decompress) and then
+    codec_obj.flush(), writing the output to out_file."""
+    with closing(chunks(data)) as pieces:
+        for chunk in pieces:
+            out_file.write(process(chunk))
+    out_file.write(codec_obj.flush())
+
+
+def write_container(writer, data):
+    """Feed data to a ContainerWriter a chunk at a time and finish it."""
+    with closing(chunks(data)) as pieces:
+        for chunk in pieces:
+            writer.write(chunk)
+    writer.close()
+
+
+def drop_pages(data, start, length):
+    """Let the kernel drop the pages of a mapped file we're done with.
+
+    They're backed by the file, so this is free, and it keeps resident
+    memory to about a chunk rather than the whole input.
+    """
+    if isinstance(data, mmap.mmap) and hasattr(mmap, 'MADV_DONTNEED'):
+        data.madvise(mmap.MADV_DONTNEED, start, min(length, len(data) - start))
+
+
+def codec_options(codec, coder=DEFAULT_CODER, level=None):
+    """The encoder options that apply to codec."""
+    options = {}
+    if codec in ENTROPY_CODECS:
+        options['coder'] = coder
+    if codec in LEVEL_CODECS and level is not None:
+        options['level'] = level
+    return options
+
+
+def compress_file(in_path, out_path, codec=DEFAULT_CODEC, raw=False, coder=DEFAULT_CODER, level=None):
+    options = codec_options(codec, coder, level)
+    with mapped(in_path) as data, output_file(out_path) as out_file:
+        if raw:
+            compressor = STREAM_CODECS[codec][0](**options)
+            run(compressor, compressor.compress, data, out_file)
+        else:
+            write_container(ContainerWriter(out_file, codec, **options), data)
+
+
+def decompress_file(in_path, out_path, codec=DEFAULT_CODEC, start=0, end=None):
+    """Decompress in_path, a container or else a raw stream from codec.
+
+    For containers, start and end pick out part of the original data,
+    and only the blocks covering it are decoded.
+    """
+    with mapped(in_path) as data, output_file(out_path) as out_file:
+        if is_container(data):
+            with ContainerReader(data) as reader:
+                if start != 0 or end is not None:
+                    out_file.write(reader.read(start, end))
+                else:
+                    for block in reader:
+                        out_file.write(block)
+        else:
+            decompressor = STREAM_CODECS[codec][1]()
+            run(decompressor, decompressor.decompress, data, out_file)
+
+
+class RoundTripChecker:
+    """File-like object that decompresses whatever is written to it and
+    checks the result against the original data as it goes.
+
+    With no decompressor, what's written is only counted, and the
+    decoded data is passed to check() directly instead.
+    """
+    def __init__(self, decompressor, original):
+        self.decompressor = decompressor
+        self.original = original
+        self.compressed_len = 0
+        self.decoded_len = 0
+        self.matches = True
+
+    def check(self, decoded):
+        end = self.decoded_len + len(decoded)
+        if self.original[self.decoded_len:end] != decoded:
+            self.matches = False
+        self.decoded_len = end
+
+    def write(self, data):
+        self.compressed_len += len(data)
+        if self.decompressor is not None:
+            self.check(self.decompressor.decompress(data))
+        return len(data)
+
+    def close(self):
+        if self.decompressor is not None:
+            self.check(self.decompressor.flush())
+        if self.decoded_len != len(self.original):
+            self.matches = False
+
+
+class CheckingContainerWriter(ContainerWriter):
+    """ContainerWriter that decodes each block straight back after
+    encoding it and hands the result to a RoundTripChecker, which the
+    container itself is written to.
+
+    This tests the codecs with no raw stream a block at a time.
+    """
+    def __init__(self, checker, codec, **options):
+        super().__init__(checker, codec, **options)
+        self.checker = checker
+        self.codec = codec
+
+    def encode_block(self, block):
+        payload = super().encode_block(block)
+        self.checker.check(container.decode_block(self.codec, payload, len(block), self.params))
+        return payload
+
+
+def test_file(in_path, codec=DEFAULT_CODEC, coder=DEFAULT_CODER, level=None):
+    """Compress and decompress in_path without writing anything, using
+    the codec's raw stream, or for codecs without one, a container.
+
+    Returns (matches, original size, compressed size).
+    """
+    options = codec_options(codec, coder, level)
+    with mapped(in_path) as data:
+        if codec in STREAM_CODECS:
+            compressor_class, decompressor_class = STREAM_CODECS[codec]
+            compressor = compressor_class(**options)
+            checker = RoundTripChecker(decompressor_class(), data)
+            run(compressor, compressor.compress, data, checker)
+        else:
+            checker = RoundTripChecker(None, data)
+            write_container(CheckingContainerWriter(checker, codec, **options), data)
+        checker.close()
+    return checker.matches, checker.decoded_len, checker.compressed_len
+
+
+def test_container(in_path):
+    """Decode every block of a container, checking its CRCs.
+
+    Returns the numbers of the bad blocks, the original size and the
+    compressed size.
+    """
+    bad_blocks = []
+    with mapped(in_path) as data, ContainerReader(data) as reader:
+        for i in range(reader.num_blocks):
+            try:
+                reader.read_block(i)
+            except ContainerError:
+                bad_blocks.append(i)
+        return bad_blocks, len(reader), len(data)
+
+
+def container_codec(in_path):
+    """The codec a container was written with, or None if in_path isn't
+    a container."""
+    with mapped(in_path) as data:
+        if not is_container(data):
+            return None
+        with ContainerReader(data) as reader:
+            return reader.codec
+
+
+def default_output_path(in_path, command, codec):
+    suffix = '.' + codec
+    if command == 'compress':
+        return in_path + suffix
+    if in_path.endswith(suffix):
+        return in_path[:-len(suffix)]
+    return in_path + '.out'
+
+
+def run_command(args):
+    """Carry out the command parsed into args, returning the exit status."""
+    if args.command == 'test':
+        with open(args.input, 'rb') as f:
+            compressed = is_container(f.read(len(container.MAGIC)))
+        if compressed:
+            bad_blocks, original_len, compressed_len = test_container(args.input)
+            matches = not bad_blocks
+            if bad_blocks:
+                print(f'Bad blocks: {bad_blocks}')
+        else:
+            matches, original_len, compressed_len = test_file(args.input, args.algorithm, args.coder, args.level)
+        print(f'Decoded data matches original: {matches}')
+        print(f'Original size: {original_len}')
+        print(f'Compressed size: {compressed_len}')
+        if original_len > 0:
+            print(f'Compression ratio: {compressed_len / original_len}')
+        return 0 if matches else 1
+
+    suffix_codec = args.algorithm
+    if args.command == 'decompress':
+        # Containers say what they hold, whatever -a is
+        suffix_codec = container_codec(args.input) or args.algorithm
+    out_path = args.output or default_output_path(args.input, args.command, suffix_codec)
+    if args.command == 'compress':
+        compress_file(args.input, out_path, args.algorithm, raw=args.raw, coder=args.coder,
+                      level=args.level)
+    else:
+        start, end = 0, None
+        if args.range:
+            start, end = (int(x) if x else None for x in args.range.split(':'))
+            start = start or 0
+        decompress_file(args.input, out_path, args.algorithm, start, end)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cli', description='Compress, decompress or test files.')
+    parser.add_argument('command', choices=['compress', 'decompress', 'test'])
+    parser.add_argument('input')
+    parser.add_argument('output', nargs='?', help='default: input with the codec name added or removed')
+    parser.add_argument('-a', '--algorithm', choices=sorted(container.CODECS), default=DEFAULT_CODEC)
+    parser.add_argument('--coder', choices=CODERS, default=DEFAULT_CODER,
+                        help=f"entropy coder for {', '.join(ENTROPY_CODECS)}")
+    parser.add_argument('--level', type=int, choices=range(1, 10), metavar='1-9',
+                        help=f"compression level for {', '.join(LEVEL_CODECS)}; default: their original greedy parse")
+    parser.add_argument('--raw', action='store_true', help='use the bare stream rather than a container')
+    parser.add_argument('--range', help='START:END of the original data to decompress, for containers')
+    args = parser.parse_args(argv)
+    if args.raw and args.algorithm not in STREAM_CODECS:
+        parser.error(f'{args.algorithm} has no raw stream format')
+    try:
+        return run_command(args)
+    except (ContainerError, ReadError, ValueError) as e:
+        parser.exit(1, f'{parser.prog}: error: {e}\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,364 @@
+"""A self-describing container for any of the codecs.
+
+The input is cut into blocks that are compressed independently, so any
+block can be decoded, or checked, on its own. Everything is big-endian:
+
+    header   magic 'FWCZ', version (1 byte), codec name (length byte
+             then ASCII), parameter count (1 byte), each parameter
+             (1 byte), block size (4 bytes)
+    blocks   for each block: payload length (4), original length (4),
+             CRC32 of the payload (4), CRC32 of the original (4), payload
+    index    for each block: offset of the block from the start (8),
+             original length (4)
+    trailer  offset of the index (8), block count (4), magic 'FWCI'
+
+A block the codec can't make any smaller, or can't encode at all
+because it overflows one of the codec's fields, is stored as it is.
+Those are the blocks whose payload is as long as the original. Version
+1 containers had no stored blocks, and still read.
+
+Only the parameters the decoder needs (window_bits and so on) go in
+the header. Encoder-only options such as match_finder are passed
+through to the encoder when packing and not recorded. Parameters added
+to a codec later go at the end, and a header with fewer of them gets
+the defaults for the rest, so older containers still read.
+"""
+
+import io
+import struct
+import zlib
+from bisect import bisect_right
+from math import lcm
+
+from bitio import FieldOverflowError
+
+from huffman import adaptive_huffman_decode, adaptive_huffman_encode, huffman_encode, huffman_decode
+from lz77 import lz77_encode, lz77_decode, DEFAULT_WINDOW_BITS, REFERENCE_SIZE_BITS
+from lz77_huffman import lz77deflate_encode, lz77deflate_decode, lz77huff_encode, lz77huff_decode
+from lzss import lzss_encode, lzss_decode, lzssb_encode, lzssb_decode, DEFAULT_MIN_MATCH
+from lzw_fixed import lzwf_encode, lzwf_decode, DEFAULT_CODE_LEN
+from lzw_fixed_huffman import lzw_huff_encode, lzw_huff_decode, DEFAULT_SYMBOL_LEN
+from lzw_variable import lzwv_encode, lzwv_decode
+from shitty_bzip import bzip0_encode, bzip0_decode
+
+
+MAGIC = b'FWCZ'
+INDEX_MAGIC = b'FWCI'
+VERSION = 2
+# Versions from which blocks can be stored
+STORED_BLOCKS_VERSION = 2
+DEFAULT_BLOCK_SIZE = 2**18
+
+BLOCK_HEADER = struct.Struct('>IIII')
+INDEX_ENTRY = struct.Struct('>QI')
+TRAILER = struct.Struct('>QI4s')
+
+
+class ContainerError(Exception):
+    pass
+
+
+def pack_huffman_payload(encoded):
+    """Flatten a (data, num_symbols, serialized_tree) tuple into bytes."""
+    data, num_symbols, serialized_tree = encoded
+    return struct.pack('>II', num_symbols, len(serialized_tree)) + serialized_tree + data
+
+
+def unpack_huffman_payload(payload):
+    num_symbols, tree_len = struct.unpack_from('>II', payload)
+    tree_end = 8 + tree_len
+    return bytes(payload[tree_end:]), num_symbols, bytes(payload[8:tree_end])
+
+
+def pad_to_symbols(block, symbol_bits):
+    """Pad block with zero bytes to a whole number of symbols, which the
+    Huffman codecs would otherwise drop the leftover bits of."""
+    unit = lcm(symbol_bits, 8) // 8
+    if len(block) % unit == 0:
+        return block
+    return bytes(block) + bytes(-len(block) % unit)
+
+
+def huffman_block_encode(block, symbol_bits=8, **options):
+    block = pad_to_symbols(block, symbol_bits)
+    return pack_huffman_payload(huffman_encode(block, symbol_bits=symbol_bits, **options))
+
+
+def huffman_block_decode(payload, symbol_bits=8):
+    data, num_symbols, serialized_tree = unpack_huffman_payload(payload)
+    return huffman_decode(data, num_symbols, serialized_tree, symbol_bits=symbol_bits)
+
+
+def adaptive_huffman_block_encode(block, symbol_bits=8, **options):
+    return adaptive_huffman_encode(pad_to_symbols(block, symbol_bits), symbol_bits=symbol_bits, **options)
+
+
+def lz77huff_block_encode(block, window_bits=DEFAULT_WINDOW_BITS, **options):
+    return pack_huffman_payload(lz77huff_encode(block, window_bits=window_bits, **options))
+
+
+def lz77huff_block_decode(payload, window_bits=DEFAULT_WINDOW_BITS):
+    data, num_symbols, serialized_tree = unpack_huffman_payload(payload)
+    return lz77huff_decode(data, num_symbols, serialized_tree, window_bits=window_bits)
+
+
+def lzw_huff_block_encode(block, symbol_len=DEFAULT_SYMBOL_LEN, **options):
+    return pack_huffman_payload(lzw_huff_encode(block, symbol_len=symbol_len, **options))
+
+
+def lzw_huff_block_decode(payload, symbol_len=DEFAULT_SYMBOL_LEN):
+    data, num_symbols, serialized_tree = unpack_huffman_payload(payload)
+    return lzw_huff_decode(data, num_symbols, serialized_tree, symbol_len=symbol_len)
+
+
+# name: (encode, decode, {parameter the decoder needs: default})
+CODECS = {
+    'lz77': (lz77_encode, lz77_decode, {'window_bits': DEFAULT_WINDOW_BITS,
+                                        'reference_bits': REFERENCE_SIZE_BITS}),
+    'lzss': (lzss_encode, lzss_decode, {'window_bits': DEFAULT_WINDOW_BITS,
+                                        'reference_bits': REFERENCE_SIZE_BITS}),
+    'lzssb': (lzssb_encode, lzssb_decode, {'window_bits': DEFAULT_WINDOW_BITS,
+                                           'reference_bits': REFERENCE_SIZE_BITS,
+                                           'min_match': DEFAULT_MIN_MATCH}),
+    'lz77huff': (lz77huff_block_encode, lz77huff_block_decode, {'window_bits': DEFAULT_WINDOW_BITS}),
+    'lz77deflate': (lz77deflate_encode, lz77deflate_decode, {}),
+    'huffman': (huffman_block_encode, huffman_block_decode, {'symbol_bits': 8}),
+    'ahuffman': (adaptive_huffman_block_encode, adaptive_huffman_decode, {'symbol_bits': 8}),
+    'lzwf': (lzwf_encode, lzwf_decode, {'code_len': DEFAULT_CODE_LEN}),
+    'lzwv': (lzwv_encode, lzwv_decode, {}),
+    'lzwhuff': (lzw_huff_block_encode, lzw_huff_block_decode, {'symbol_len': DEFAULT_SYMBOL_LEN}),
+    'bzip': (bzip0_encode, bzip0_decode, {}),
+}
+
+DEFAULT_CODEC = 'bzip'
+
+# Codecs that take a coder option choosing their entropy coder
+ENTROPY_CODECS = ('lz77huff', 'lzwhuff', 'bzip')
+
+# Codecs that take a compression level from 1 to 9
+LEVEL_CODECS = ('lz77', 'lzss', 'lzssb', 'lz77huff', 'lz77deflate')
+
+# Codecs that pad blocks to whole symbols, and so decode to more than
+# the block
+PADDED_CODECS = ('huffman', 'ahuffman')
+
+
+def is_container(data):
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def decode_block(codec, payload, length, params, version=VERSION):
+    """Decode a block's payload, given the block's original length."""
+    if version >= STORED_BLOCKS_VERSION and len(payload) == length:
+        return bytes(payload)
+    block = CODECS[codec][1](payload, **params)
+    if codec in PADDED_CODECS:
+        block = block[:length]
+    return block
+
+
+class ContainerWriter:
+    """Writes a container to a binary file object a block at a time.
+
+    Call write() as often as needed, then close() to write out the
+    last block and the index. Only one block of input is held at once.
+    The file object itself isn't closed.
+    """
+    def __init__(self, out_file, codec=DEFAULT_CODEC, block_size=DEFAULT_BLOCK_SIZE, **options):
+        if codec not in CODECS:
+            raise ValueError(f'Unknown codec: {codec}')
+        self.out_file = out_file
+        self.encode, _, defaults = CODECS[codec]
+        self.params = {name: options.get(name, default) for name, default in defaults.items()}
+        self.options = {**options, **self.params}
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.index = []
+
+        name = codec.encode('ascii')
+        header = bytearray(MAGIC)
+        header += bytes([VERSION, len(name)]) + name
+        header += bytes([len(self.params)]) + bytes(self.params.values())
+        header += block_size.to_bytes(4, 'big')
+        self.offset = self.out_file.write(header)
+
+    def encode_block(self, block):
+        """Encode block, or return it as it is if the codec can't make
+        it any smaller."""
+        try:
+            payload = self.encode(block, **self.options)
+        except FieldOverflowError:
+            return block
+        return block if len(payload) >= len(block) else payload
+
+    def write_block(self, block):
+        payload = self.encode_block(block)
+        header = BLOCK_HEADER.pack(len(payload), len(block),
+                                   zlib.crc32(payload), zlib.crc32(block))
+        self.index.append((self.offset, len(block)))
+        self.offset += self.out_file.write(header)
+        self.offset += self.out_file.write(payload)
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        start = 0
+        if self.buffer:
+            start = min(len(data), self.block_size - len(self.buffer))
+            self.buffer += data[:start]
+            if len(self.buffer) < self.block_size:
+                return
+            self.write_block(bytes(self.buffer))
+            self.buffer.clear()
+        # Whole blocks are encoded straight from the caller's buffer
+        while len(data) - start >= self.block_size:
+            self.write_block(data[start:start+self.block_size])
+            start += self.block_size
+        self.buffer += data[start:]
+
+    def close(self):
+        if self.buffer:
+            self.write_block(bytes(self.buffer))
+            self.buffer.clear()
+        index_offset = self.offset
+        for entry in self.index:
+            self.offset += self.out_file.write(INDEX_ENTRY.pack(*entry))
+        self.offset += self.out_file.write(TRAILER.pack(index_offset, len(self.index), INDEX_MAGIC))
+
+
+class ContainerReader:
+    """Random access to the blocks of a container held in any buffer.
+
+    Only the header, trailer and index are read up front. read() decodes
+    just the blocks covering the range asked for, and verify() checks
+    every block's payload against its CRC without decoding anything.
+    """
+    def __init__(self, data):
+        self.data = memoryview(data).cast('B')
+        if not is_container(self.data):
+            raise ContainerError('Not a container')
+        try:
+            self.version = self.data[4]
+            if not 1 <= self.version <= VERSION:
+                raise ContainerError(f'Unsupported container version {self.version}')
+            name_len = self.data[5]
+            self.codec = bytes(self.data[6:6+name_len]).decode('ascii')
+            pos = 6 + name_len
+            num_params = self.data[pos]
+            param_values = list(self.data[pos+1:pos+1+num_params])
+            pos += 1 + num_params
+            self.block_size = int.from_bytes(self.data[pos:pos+4], 'big')
+
+            index_offset, num_blocks, index_magic = TRAILER.unpack_from(self.data, len(self.data) - TRAILER.size)
+        except (IndexError, struct.error):
+            raise ContainerError('Container is truncated')
+        if index_magic != INDEX_MAGIC:
+            raise ContainerError('Container is truncated or has no index')
+        if self.codec not in CODECS:
+            raise ContainerError(f'Unknown codec: {self.codec}')
+        defaults = CODECS[self.codec][2]
+        if len(param_values) > len(defaults):
+            raise ContainerError(f'Expected at most {len(defaults)} parameters for {self.codec}')
+        self.params = {**defaults, **dict(zip(defaults, param_values))}
+
+        self.offsets = []
+        self.starts = []  # where each block starts in the decoded data
+        total = 0
+        try:
+            for i in range(num_blocks):
+                offset, length = INDEX_ENTRY.unpack_from(self.data, index_offset + i * INDEX_ENTRY.size)
+                self.offsets.append(offset)
+                self.starts.append(total)
+                total += length
+        except struct.error:
+            raise ContainerError('Index is truncated')
+        self.size = total
+
+    def __len__(self):
+        """Size of the decoded data."""
+        return self.size
+
+    def close(self):
+        """Let go of the underlying buffer, so that an mmap can be closed."""
+        self.data.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def num_blocks(self):
+        return len(self.offsets)
+
+    def block_payload(self, i):
+        offset = self.offsets[i]
+        try:
+            payload_len, length, payload_crc, crc = BLOCK_HEADER.unpack_from(self.data, offset)
+        except struct.error:
+            raise ContainerError(f'Block {i} is truncated')
+        start = offset + BLOCK_HEADER.size
+        payload = self.data[start:start+payload_len]
+        if len(payload) != payload_len:
+            raise ContainerError(f'Block {i} is truncated')
+        return payload, payload_crc, length, crc
+
+    def check_block(self, i):
+        payload, payload_crc, _, _ = self.block_payload(i)
+        return zlib.crc32(payload) == payload_crc
+
+    def verify(self):
+        """Return the numbers of the blocks whose payload is corrupt."""
+        return [i for i in range(self.num_blocks) if not self.check_block(i)]
+
+    def read_block(self, i):
+        payload, payload_crc, length, crc = self.block_payload(i)
+        if zlib.crc32(payload) != payload_crc:
+            raise ContainerError(f'Block {i} is corrupt')
+        block = decode_block(self.codec, payload, length, self.params, self.version)
+        if len(block) != length or zlib.crc32(block) != crc:
+            raise ContainerError(f'Block {i} decoded wrongly')
+        return block
+
+    def __iter__(self):
+        for i in range(self.num_blocks):
+            yield self.read_block(i)
+
+    def read(self, start=0, end=None):
+        """Decode bytes start to end of the original data."""
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return b''
+        first = bisect_right(self.starts, start) - 1
+        last = bisect_right(self.starts, end - 1) - 1
+        out = bytearray()
+        for i in range(first, last + 1):
+            out += self.read_block(i)
+        skip = start - self.starts[first]
+        return bytes(out[skip:skip + end - start])
+
+
+def pack(data, codec=DEFAULT_CODEC, block_size=DEFAULT_BLOCK_SIZE, **options):
+    """Compress data into a container."""
+    out = io.BytesIO()
+    writer = ContainerWriter(out, codec, block_size, **options)
+    writer.write(data)
+    writer.close()
+    return out.getvalue()
+
+
+def unpack(data):
+    """Decompress a whole container."""
+    with ContainerReader(data) as reader:
+        return b''.join(reader)
+
+
+if __name__ == '__main__':
+    with open('test.dat', 'rb') as f:
+        input_data = f.read()
+
+    for codec in CODECS:
+        enc = pack(input_data, codec)
+        dec = unpack(enc)
+        print(f'{codec}: matches original: {input_data == dec}, '
+              f'compression ratio: {len(enc) / len(input_data)}')
@@ -0,0 +1,47 @@
+"""The last stage of the codecs that end in entropy coding.
+
+Codecs that used to call huffman_encode() call entropy_encode() with a
+coder of 'huffman', 'range' or 'adaptive_range', and get back the same
+(data, num_symbols, serialized_model) tuple whichever is used. The
+decoder tells the coders apart from the serialized model, so nothing
+else has to be stored.
+"""
+
+from huffman import (huffman_decode_symbols, huffman_encode_symbols, huffman_iter_symbols, pack_symbols,
+                     unpack_symbols)
+from range_coder import is_range_model, range_decode_symbols, range_encode_symbols, range_iter_symbols
+
+
+CODERS = ('huffman', 'range', 'adaptive_range')
+DEFAULT_CODER = 'huffman'
+
+
+def entropy_encode(data, symbol_bits=8, coder=DEFAULT_CODER, stats=None):
+    return entropy_encode_symbols(unpack_symbols(data, symbol_bits), symbol_bits, coder, stats)
+
+
+def entropy_encode_symbols(symbols, symbol_bits=8, coder=DEFAULT_CODER, stats=None):
+    if coder == 'huffman':
+        return huffman_encode_symbols(symbols, symbol_bits, stats=stats)
+    if coder in ('range', 'adaptive_range'):
+        return range_encode_symbols(symbols, symbol_bits, adaptive=coder == 'adaptive_range', stats=stats)
+    raise ValueError(f'Unknown entropy coder: {coder}')
+
+
+def entropy_decode(data, decoded_len, serialized_model, symbol_bits=8, stats=None):
+    symbols = entropy_decode_symbols(data, decoded_len, serialized_model, symbol_bits, stats)
+    return pack_symbols(symbols, symbol_bits)
+
+
+def entropy_decode_symbols(data, decoded_len, serialized_model, symbol_bits=8, stats=None):
+    if is_range_model(serialized_model):
+        return range_decode_symbols(data, decoded_len, serialized_model, symbol_bits, stats)
+    return huffman_decode_symbols(data, decoded_len, serialized_model, symbol_bits, stats=stats)
+
+
+def entropy_iter_symbols(data, decoded_len, serialized_model, symbol_bits=8):
+    """Like entropy_decode_symbols(), but yields the symbols as they're
+    decoded, for callers that use them one at a time."""
+    if is_range_model(serialized_model):
+        return range_iter_symbols(data, decoded_len, serialized_model, symbol_bits)
+    return huffman_iter_symbols(data, decoded_len, serialized_model, symbol_bits)
@@ -1,79 +1,48 @@
-"""A very slow GIF decoder."""
+"""A simple GIF decoder."""
 
-from bitstring import Bits, BitArray, ConstBitStream, ReadError
-
-CLEAR_CODE = -1
-END_CODE = -2
+from bitstring import ConstBitStream
+from bitio import LsbBitReader, ReadError
+from lzw import count_lzw, LzwDecoder
+from stats import timed
 
 MAX_CODE_LEN = 12
 MAX_DICT_ENTRIES = 2**MAX_CODE_LEN
 
 
-def decode_lzw(raster_data):
-    dictionary = init_dictionary(2**raster_data['code_size'])
-    code_len = raster_data['code_size'] + 1
-    encoded = GifDataStream(raster_data['encoded_data'])
-    decoded = bytes()
+def decode_lzw(raster_data, num_pixels=0, stats=None):
+    return timed(stats, 'gif.lzw', read_codes, raster_data['encoded_data'],
+                 raster_data['code_size'], num_pixels, stats)
+
+
+def read_codes(encoded_data, code_size, num_pixels=0, stats=None):
+    clear_code = 2**code_size
+    end_code = clear_code + 1
+    decoder = LzwDecoder(num_literals=clear_code, first_code=clear_code + 2,
+                         max_entries=MAX_DICT_ENTRIES, out_size=num_pixels)
+    encoded = LsbBitReader(encoded_data)
+    codes = 0
+    resets = 0
     while True:
+        # Codes widen as soon as the next code to be added needs it
+        if decoder.prev_code < 0:
+            code_len = code_size + 1
+        else:
+            code_len = min(MAX_CODE_LEN, max(code_size + 1, decoder.next_code.bit_length()))
         try:
-            # Read a code
-            k = encoded.read_uint(code_len)
-
-            # Look up code and emit value
-            v = dictionary[k]
-            if v == CLEAR_CODE:
-                dictionary = init_dictionary(2**raster_data['code_size'])
-                code_len = raster_data['code_size'] + 1
-                continue
-            if v == END_CODE:
-                break
-            decoded = decoded + v
-
-            # Add v + v_next[0] to dictionary
-            c = len(dictionary)
-            if c < MAX_DICT_ENTRIES:
-                if c == 2**code_len:
-                    code_len = min(MAX_CODE_LEN, code_len + 1)
-                k_next = encoded.peek_uint(code_len)
-                if k_next < c:
-                    v_next = dictionary[k_next]
-                    if isinstance(v_next, bytes):
-                        dictionary[c] = v + v_next[:1]
-                else:
-                    dictionary[c] = v + v[:1]
+            k = encoded.read(code_len)
         except ReadError:
             break
-    return decoded
-
-
-def init_dictionary(n):
-    dictionary = {i: bytes([i]) for i in range(n)}
-    dictionary[n] = CLEAR_CODE
-    dictionary[n + 1] = END_CODE
-    return dictionary
-
-
-class GifDataStream:
-    def __init__(self, bytez):
-        self.bytez = bytearray(bytez)
-        self.remainder = BitArray()
-
-    def read_uint(self, n):
-        while len(self.remainder) < n:
-            self.remainder.prepend(Bits(bytearray([self.bytez.pop(0)])))
-        uint = self.remainder.uint & (2**n - 1)
-        self.remainder >>= n
-        del self.remainder[0:n]
-        return uint
-
-    def peek_uint(self, n):
-        s = self.remainder.copy()
-        i = 0
-        while len(s) < n:
-            s.prepend(Bits(bytearray(self.bytez[i:i+1])))
-            i += 1
-        bits = Bits(s)
-        return bits.uint & (2**n - 1)
+        codes += 1
+        if k == clear_code:
+            decoder.reset()
+            resets += 1
+        elif k == end_code:
+            break
+        else:
+            decoder.decode(k)
+    if stats is not None:
+        count_lzw(stats, codes, decoder.next_code, decoder.max_entries, resets)
+    return decoder.result()
 
 ###############################################################################
 
@@ -119,11 +88,12 @@ def read_image_descriptor(stream):
 def read_raster_data(stream):
     data = {}
     data['code_size'] = stream.read('uint:8')
-    data['encoded_data'] = b''
+    sub_blocks = []
     block_size = stream.read('uint:8')
     while block_size > 0:
-        data['encoded_data'] += stream.read('bytes:{}'.format(block_size))
+        sub_blocks.append(stream.read('bytes:{}'.format(block_size)))
         block_size = stream.read('uint:8')
+    data['encoded_data'] = b''.join(sub_blocks)
     return data
 
 
@@ -151,8 +121,12 @@ def peek_next(stream):
 
 ################################################################################
 
-def decode_gif(filename):
-    """Decode a GIF into a flat buffer."""
+def read_gif(filename):
+    """Read a GIF without decoding its images.
+
+    Returns the screen descriptor, the palette and a list of
+    (image descriptor, raster data) pairs.
+    """
     with open(filename, 'rb') as f:
         bitstream = ConstBitStream(f.read())
 
@@ -161,7 +135,7 @@ def decode_gif(filename):
         raise ValueError
 
     screen = read_screen_descriptor(bitstream)
-    buffer = bytearray()
+    images = []
 
     if screen['has_palette']:
         palette = read_palette(bitstream, screen['bits_per_pixel'])
@@ -173,13 +147,21 @@ def decode_gif(filename):
             if image_info['has_palette']:
                 # We'll just use the local palette if it's present
                 palette = read_palette(bitstream, image_info['bits_per_pixel'])
-            raster_data = read_raster_data(bitstream)
-            buffer += bytearray(decode_lzw(raster_data))
+            images.append((image_info, read_raster_data(bitstream)))
         elif block_type == 'EXTENSION_BLOCK':
             skip_extension_block(bitstream)
         else:
             raise ValueError
         block_type = peek_next(bitstream)
+    return screen, palette, images
+
+
+def decode_gif(filename, stats=None):
+    """Decode a GIF into a flat buffer."""
+    screen, palette, images = read_gif(filename)
+    buffer = bytearray()
+    for image_info, raster_data in images:
+        buffer += decode_lzw(raster_data, image_info['width'] * image_info['height'], stats)
     return screen, palette, buffer
 
 ################################################################################
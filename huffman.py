@@ -1,52 +1,98 @@
 """Huffman coding in Python."""
 
-from functools import total_ordering
-from heapq import heapify, heappop, heappush
-from bitstring import Bits, BitArray, ConstBitStream, ReadError
+from collections import Counter, deque
+from heapq import merge
+from itertools import repeat
+from math import lcm
+from struct import unpack
+from bitio import BitInputBuffer, BitReader, BitWriter, ReadError, byte_view
+from stats import timed
+
+
+DEFAULT_TABLE_BITS = 9
+DEFAULT_MAX_CODE_LEN = 15
+DEFAULT_STREAM_BLOCK_SIZE = 2**16
+EMIT_CHUNK_SYMBOLS = 2**16
+
+# Serialized trees from serialize_huffman_tree always start with a 0
+# bit, since the root of a tree that can be serialized is never a leaf.
+# Headers with the top bit set carry a version number in the low bits.
+# Versions 2 and 3 are range_coder.py's models.
+VERSIONED_HEADER = 0b10000000
+CANONICAL_VERSION = 1
+CODE_LEN_BITS = 5
+
+# Adaptive mode. Two extra symbols sit alongside the real ones: ESCAPE
+# is followed by a symbol that hasn't been seen yet, sent as it is, and
+# END marks the end of the stream. Codes are rebuilt after
+# ADAPTIVE_FIRST_REBUILD symbols, then after twice as many each time up
+# to ADAPTIVE_MAX_REBUILD, and counts are halved once they add up to
+# more than ADAPTIVE_MAX_TOTAL so that the codes follow changes in the
+# data.
+ADAPTIVE_ESCAPE = -1
+ADAPTIVE_END = -2
+ADAPTIVE_FIRST_REBUILD = 64
+ADAPTIVE_MAX_REBUILD = 2**13
+ADAPTIVE_MAX_TOTAL = 2**16
 
 
-@total_ordering
 class Symbol:
+    """A node of a Huffman tree: a leaf with a symbol, or an internal
+    node with left and right children."""
+    __slots__ = ('symbol', 'count', 'left', 'right')
+
     def __init__(self, symbol, count=1, left=None, right=None):
         self.symbol = symbol
         self.count = count
         self.left = left
         self.right = right
+
     def __lt__(self, other):
         return self.count < other.count
 
 
 def count_symbols(seq):
-    symbols = {}
-    for s in seq:
-        if s in symbols:
-            symbols[s].count += 1
-        else:
-            symbols[s] = Symbol(s)
-    return [v for v in symbols.values()]
+    # Counter keeps symbols in the order they were first seen, as the
+    # tree builder's tie-breaking expects
+    return [Symbol(s, count) for s, count in Counter(seq).items()]
 
 
 def make_huffman_tree(symbols):
-    pq = symbols.copy()
-    heapify(pq)
-    while len(pq) > 1:
-        s1 = heappop(pq)
-        s2 = heappop(pq)
-        new = Symbol(None, count=(s1.count + s2.count), left=s1, right=s2)
-        heappush(pq, new)
-    return pq[0]
+    """Build a tree with the two-queue method.
+
+    Once the leaves are sorted, the nodes made by merging come out in
+    order of count too, so the two smallest are always at the fronts of
+    the two queues. Ties go to leaves, which keeps the tree shallow.
+    """
+    leaves = deque(sorted(symbols, key=lambda s: s.count))
+    nodes = deque()
+
+    def pop_smallest():
+        if not nodes or (leaves and leaves[0].count <= nodes[0].count):
+            return leaves.popleft()
+        return nodes.popleft()
+
+    while len(leaves) + len(nodes) > 1:
+        s1 = pop_smallest()
+        s2 = pop_smallest()
+        nodes.append(Symbol(None, count=(s1.count + s2.count), left=s1, right=s2))
+    return (nodes or leaves)[0]
+
+
+def is_leaf(node):
+    return node.left is None and node.right is None
 
 
 def make_encoding_dictionary(tree):
-    def encode_node(node, code):
-        if node.left is None and node.right is None:
-            return {node.symbol: code}
+    enc_dict = {}
+    stack = [(tree, '')]
+    while stack:
+        node, code = stack.pop()
+        if is_leaf(node):
+            enc_dict[node.symbol] = code
         else:
-            merged = {}
-            merged.update(encode_node(node.left, code + '0'))
-            merged.update(encode_node(node.right, code + '1'))
-            return merged
-    enc_dict = encode_node(tree, '')
+            stack.append((node.right, code + '1'))
+            stack.append((node.left, code + '0'))
     min_len = min([len(c) for c in enc_dict.values()])
     return enc_dict, min_len
 
@@ -56,77 +102,637 @@ def make_decoding_dictionary(tree):
     return {v: k for k, v in d.items()}, L
 
 
-def serialize_huffman_tree(node, symbol_bits, bit_array=None):
-    out = BitArray() if bit_array is None else bit_array
-    if node.left is None and node.right is None:
-        out.append(Bits(bin='0b1'))
-        out.append(Bits(uint=node.symbol, length=symbol_bits))
-        return bit_array.tobytes()
-    else:
-        out.append(Bits(bin='0b0'))
-        serialize_huffman_tree(node.left, symbol_bits, bit_array=out)
-        serialize_huffman_tree(node.right, symbol_bits, bit_array=out)
-        return out.tobytes()
+def serialize_huffman_tree(tree, symbol_bits, bit_array=None):
+    """Write the tree in preorder, 0 for an internal node and 1 then
+    the symbol for a leaf."""
+    if is_leaf(tree):
+        raise ValueError('A tree with a single symbol has no codes to serialize')
+    out = BitWriter() if bit_array is None else bit_array
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if is_leaf(node):
+            out.write(1, 1)
+            out.write(node.symbol, symbol_bits)
+        else:
+            out.write(0, 1)
+            stack.append(node.right)
+            stack.append(node.left)
+    return out.tobytes()
 
 
 def deserialize_huffman_tree(serialized, symbol_bits):
-    bits = serialized if isinstance(serialized, ConstBitStream) else ConstBitStream(serialized)
-    is_leaf = bits.read('bool')
-    if is_leaf:
-        symbol = bits.read(f'uint:{symbol_bits}')
-        return Symbol(symbol)
-    else:
-        left = deserialize_huffman_tree(bits, symbol_bits)
-        right = deserialize_huffman_tree(bits, symbol_bits)
-        return Symbol(None, left=left, right=right)
-
-
-def huffman_encode(data, symbol_bits=8):
-    bits = ConstBitStream(data)
-    symbols = []
-    try:
-        while True:
-            s = bits.read(f'uint:{symbol_bits}')
-            symbols.append(s)
-    except ReadError:
-        pass
+    bits = serialized if isinstance(serialized, BitReader) else BitReader(serialized)
+    root = None
+    waiting = []  # internal nodes still missing a child
+    while root is None or waiting:
+        if bits.read_bool():
+            node = Symbol(bits.read(symbol_bits))
+        else:
+            node = Symbol(None)
+        if waiting:
+            parent = waiting[-1]
+            if parent.left is None:
+                parent.left = node
+            else:
+                parent.right = node
+                waiting.pop()
+        else:
+            root = node
+        if node.symbol is None:
+            waiting.append(node)
+    return root
 
-    counted_symbols = count_symbols(symbols)
-    tree = make_huffman_tree(counted_symbols)
+
+def make_code_lengths(counts, max_code_len=DEFAULT_MAX_CODE_LEN):
+    """Find length-limited Huffman code lengths with package-merge.
+
+    counts maps symbols to their counts. Returns a dict mapping each
+    symbol to its code length, none of which exceed max_code_len, or
+    the smallest limit that can fit all of the symbols.
+    """
+    if len(counts) == 1:
+        return {s: 1 for s in counts}
+    max_code_len = max(max_code_len, (len(counts) - 1).bit_length())
+
+    # Items are (weight, tiebreak, symbol or pair of items)
+    leaves = sorted((c, i, s) for i, (s, c) in enumerate(sorted(counts.items())))
+    items = leaves
+    for _ in range(max_code_len - 1):
+        packages = [(items[i][0] + items[i+1][0], len(leaves) + i, (items[i], items[i+1]))
+                    for i in range(0, len(items) - 1, 2)]
+        items = list(merge(leaves, packages))
+
+    lengths = dict.fromkeys(counts, 0)
+    stack = items[:2 * len(leaves) - 2]
+    while stack:
+        _, _, payload = stack.pop()
+        if isinstance(payload, tuple):
+            stack.extend(payload)
+        else:
+            lengths[payload] += 1
+    return lengths
+
+
+def make_canonical_codes(lengths):
+    """Assign canonical codes, as {symbol: code}, from code lengths."""
+    codes = {}
+    code = 0
+    prev_len = 0
+    for length, symbol in sorted((L, s) for s, L in lengths.items() if L > 0):
+        code <<= length - prev_len
+        codes[symbol] = format(code, f'0{length}b')
+        code += 1
+        prev_len = length
+    return codes
+
+
+def code_length_runs(lengths, num_symbols):
+    """Return [length, count] runs of equal code lengths over symbols 0
+    to num_symbols - 1.
+
+    Only the symbols with codes are visited, and the gaps between them
+    become runs of zeros, so the time taken doesn't grow with the size
+    of the alphabet.
+    """
+    runs = []
+
+    def add(length, count):
+        if runs and runs[-1][0] == length:
+            runs[-1][1] += count
+        elif count:
+            runs.append([length, count])
+
+    next_symbol = 0
+    for symbol in sorted(s for s, L in lengths.items() if L > 0):
+        add(0, symbol - next_symbol)
+        add(lengths[symbol], 1)
+        next_symbol = symbol + 1
+    add(0, num_symbols - next_symbol)
+    return runs
+
+
+def serialize_code_lengths(lengths, symbol_bits, bit_array=None):
+    """Serialize the code length of every symbol as runs of equal lengths.
+
+    Each run is the length in CODE_LEN_BITS bits followed by the run
+    count as an exponential-Golomb code, after a versioned header byte.
+    Given a BitWriter as bit_array, writes to that instead of returning
+    bytes.
+    """
+    out = BitWriter() if bit_array is None else bit_array
+    out.write(VERSIONED_HEADER | CANONICAL_VERSION, 8)
+    for length, count in code_length_runs(lengths, 2**symbol_bits):
+        out.write(length, CODE_LEN_BITS)
+        out.write_ue(count - 1)
+    if bit_array is None:
+        return out.tobytes()
+
+
+def deserialize_code_lengths(serialized, symbol_bits):
+    bits = serialized if isinstance(serialized, BitReader) else BitReader(serialized)
+    header = bits.read(8)
+    if header != VERSIONED_HEADER | CANONICAL_VERSION:
+        raise ValueError(f'Unknown Huffman table header: {header:#x}')
+    lengths = {}
+    symbol = 0
+    while symbol < 2**symbol_bits:
+        length = bits.read(CODE_LEN_BITS)
+        run = bits.read_ue() + 1
+        if length > 0:
+            for s in range(symbol, symbol + run):
+                lengths[s] = length
+        symbol += run
+    return lengths
+
+
+def deserialize_codes(serialized, symbol_bits):
+    """Get the {symbol: code} dictionary from either header format."""
+    bits = BitReader(serialized)
+    if bits.peek(1):
+        return make_canonical_codes(deserialize_code_lengths(bits, symbol_bits))
+    tree = deserialize_huffman_tree(bits, symbol_bits)
     dictionary, _ = make_encoding_dictionary(tree)
+    return dictionary
+
+
+def unpack_symbols(data, symbol_bits):
+    """Split data into symbol_bits-bit symbols, dropping any bits left over.
+
+    Symbols repeat their alignment every lcm(symbol_bits, 8) bits, a
+    group, so the nth symbol of every group comes from the same bytes of
+    the group at the same shift. Each of those columns is unpacked at
+    once by unpack_column(), leaving only the last partial group to be
+    read symbol by symbol.
+    """
+    if symbol_bits == 8:
+        return byte_view(data)
+    data = bytes(data)
+    group_bits = lcm(symbol_bits, 8)
+    group_bytes = group_bits // 8
+    per_group = group_bits // symbol_bits
+    whole = data[:len(data) - len(data) % group_bytes]
+    symbols = [0] * (len(whole) // group_bytes * per_group)
+    for k in range(per_group):
+        symbols[k::per_group] = unpack_column(whole, group_bytes, k * symbol_bits, symbol_bits)
+    bits = BitReader(data[len(whole):])
+    symbols += [bits.read(symbol_bits) for _ in range(bits.bits_left() // symbol_bits)]
+    return symbols
+
+
+def unpack_column(whole, group_bytes, start_bit, symbol_bits):
+    """Unpack the symbol at start_bit of every group.
 
-    out = BitArray()
+    The bytes each symbol spans are copied into 32-bit lanes of one big
+    integer, so a single shift and mask works on every lane at once. For
+    symbols of up to 24 bits, bits shifted in from the lane above land
+    clear of the mask. Longer ones are put together a symbol at a time.
+    """
+    first_byte, end_bit = start_bit // 8, start_bit + symbol_bits
+    last_byte = (end_bit - 1) // 8
+    shift = 8 * (last_byte + 1) - end_bit
+    mask = 2**symbol_bits - 1
+    if symbol_bits > 24:
+        column = whole[first_byte::group_bytes]
+        for j in range(first_byte + 1, last_byte + 1):
+            column = [x << 8 | y for x, y in zip(column, whole[j::group_bytes])]
+        return [(x >> shift) & mask for x in column]
+    n = len(whole) // group_bytes
+    lanes = bytearray(4 * n)
+    for j in range(first_byte, last_byte + 1):
+        lanes[3 - (last_byte - j)::4] = whole[j::group_bytes]
+    value = int.from_bytes(lanes, 'big') >> shift & int.from_bytes(mask.to_bytes(4, 'big') * n, 'big')
+    return list(unpack(f'>{n}I', value.to_bytes(4 * n, 'big')))
+
+
+def pack_symbols(symbols, symbol_bits):
+    if symbol_bits == 8:
+        return bytes(symbols)
+    out = BitWriter()
     for s in symbols:
-        code = dictionary[s]
-        out.append(Bits(f'0b{code}'))
-    
-    serialized_tree = serialize_huffman_tree(tree, symbol_bits)
-
-    return out.tobytes(), len(data), serialized_tree
-
-
-def huffman_decode(data, decoded_len, serialized_tree, symbol_bits=8):
-    tree = deserialize_huffman_tree(serialized_tree, symbol_bits)
-    dictionary, min_code_len = make_decoding_dictionary(tree)
-
-    bits = ConstBitStream(data)
-    out = BitArray()
-    symbols_decoded = 0
-    try:
-        while symbols_decoded < decoded_len:
-            num_bits = min_code_len
-            code = bits.peek(f'bin:{num_bits}')
-            while code not in dictionary:
-                num_bits += 1
-                code = bits.peek(f'bin:{num_bits}')
-            out.append(Bits(uint=dictionary[code], length=symbol_bits))
-            symbols_decoded += 1
-            bits.read(f'bin:{num_bits}')
-    except ReadError:
-        pass
+        out.write(s, symbol_bits)
     return out.tobytes()
 
 
+def huffman_encode(data, symbol_bits=8, canonical=True, max_code_len=DEFAULT_MAX_CODE_LEN, stats=None):
+    symbols = unpack_symbols(data, symbol_bits)
+    return huffman_encode_symbols(symbols, symbol_bits, canonical, max_code_len, stats)
+
+
+def make_codes(counted_symbols, symbol_bits, canonical=True, max_code_len=DEFAULT_MAX_CODE_LEN):
+    """Return the {symbol: code} dictionary and its serialized form."""
+    if canonical:
+        counts = {s.symbol: s.count for s in counted_symbols}
+        lengths = make_code_lengths(counts, max_code_len) if counts else {}
+        return make_canonical_codes(lengths), serialize_code_lengths(lengths, symbol_bits)
+    tree = make_huffman_tree(counted_symbols)
+    dictionary, _ = make_encoding_dictionary(tree)
+    return dictionary, serialize_huffman_tree(tree, symbol_bits)
+
+
+def write_codes(symbols, dictionary):
+    """Write the code for each symbol, padding the last byte with zeros.
+
+    Rather than a write per symbol, the codes for EMIT_CHUNK_SYMBOLS
+    symbols at a time are joined as a string of '0's and '1's and
+    converted to bytes in one go, with the bits past the last whole
+    byte carried over to the next chunk.
+    """
+    code = dictionary.__getitem__
+    out = bytearray()
+    pending = ''
+    for start in range(0, len(symbols), EMIT_CHUNK_SYMBOLS):
+        bits = pending + ''.join(map(code, symbols[start:start+EMIT_CHUNK_SYMBOLS]))
+        whole = len(bits) - len(bits) % 8
+        if whole:
+            out += int(bits[:whole], 2).to_bytes(whole // 8, 'big')
+        pending = bits[whole:]
+    if pending:
+        out.append(int(pending.ljust(8, '0'), 2))
+    return bytes(out)
+
+
+def huffman_encode_symbols(symbols, symbol_bits=8, canonical=True, max_code_len=DEFAULT_MAX_CODE_LEN,
+                           stats=None):
+    """Like huffman_encode(), but takes a list of symbols rather than bytes."""
+    counted_symbols = timed(stats, 'huffman.count', count_symbols, symbols)
+    dictionary, serialized_tree = timed(stats, 'huffman.make_codes', make_codes,
+                                        counted_symbols, symbol_bits, canonical, max_code_len)
+    if stats is not None:
+        for code in dictionary.values():
+            stats.add_to_histogram('huffman.code_lengths', len(code))
+    data = timed(stats, 'huffman.emit', write_codes, symbols, dictionary)
+    return data, len(symbols), serialized_tree
+
+
+def make_decoding_table(enc_dict, table_bits=DEFAULT_TABLE_BITS):
+    """Build a multi-level lookup table from a {symbol: code} dictionary.
+
+    Returns (bits, entries). Indexing entries with the next `bits` bits
+    of input gives (symbol, length, None) for a code of that length, or
+    (None, bits, subtable) when the code is longer and the following
+    bits have to be looked up in subtable.
+    """
+    max_len = max(len(c) for c in enc_dict.values())
+    bits = min(table_bits, max_len)
+    entries = [None] * 2**bits
+    long_codes = {}
+    for symbol, code in enc_dict.items():
+        if len(code) <= bits:
+            first = int(code, 2) << (bits - len(code)) if code else 0
+            for k in range(first, first + 2**(bits - len(code))):
+                entries[k] = (symbol, len(code), None)
+        else:
+            long_codes.setdefault(int(code[:bits], 2), {})[symbol] = code[bits:]
+    for prefix, sub_dict in long_codes.items():
+        entries[prefix] = (None, bits, make_decoding_table(sub_dict, table_bits))
+    return bits, entries
+
+
+def iter_decode_symbols(data, decoded_len, table):
+    table_bits, entries = table
+    if table_bits == 0:
+        # Only one symbol, which has an empty code
+        yield from repeat(entries[0][0], decoded_len)
+        return
+
+    total_bits = len(data) * 8
+    bit_pos = 0
+    byte_pos = 0
+    acc = 0
+    acc_bits = 0
+    for _ in range(decoded_len):
+        bits, level = table_bits, entries
+        while True:
+            if acc_bits < bits:
+                # Pull in a 32-bit word, zero-padded past the end of data
+                word = data[byte_pos:byte_pos+4]
+                acc = (acc << 32) | int.from_bytes(word, 'big') << (8 * (4 - len(word)))
+                acc_bits += 32
+                byte_pos += 4
+            symbol, length, subtable = level[(acc >> (acc_bits - bits)) & ((1 << bits) - 1)]
+            acc_bits -= length
+            bit_pos += length
+            if subtable is None:
+                break
+            bits, level = subtable
+        if bit_pos > total_bits:
+            return
+        acc &= (1 << acc_bits) - 1
+        yield symbol
+
+
+def decode_symbols(data, decoded_len, table):
+    return list(iter_decode_symbols(data, decoded_len, table))
+
+
+def huffman_decode(data, decoded_len, serialized_tree, symbol_bits=8, table_bits=DEFAULT_TABLE_BITS,
+                   stats=None):
+    symbols = huffman_decode_symbols(data, decoded_len, serialized_tree, symbol_bits, table_bits, stats)
+    return pack_symbols(symbols, symbol_bits)
+
+
+def huffman_decode_symbols(data, decoded_len, serialized_tree, symbol_bits=8, table_bits=DEFAULT_TABLE_BITS,
+                           stats=None):
+    """Like huffman_decode(), but returns a list of symbols rather than bytes."""
+    dictionary = deserialize_codes(serialized_tree, symbol_bits)
+    if not dictionary:
+        return []
+    table = timed(stats, 'huffman.make_table', make_decoding_table, dictionary, table_bits)
+    return timed(stats, 'huffman.decode', decode_symbols, data, decoded_len, table)
+
+
+def huffman_iter_symbols(data, decoded_len, serialized_tree, symbol_bits=8, table_bits=DEFAULT_TABLE_BITS):
+    """Like huffman_decode_symbols(), but yields the symbols as they're
+    decoded rather than making a list of them."""
+    dictionary = deserialize_codes(serialized_tree, symbol_bits)
+    if not dictionary:
+        return iter(())
+    return iter_decode_symbols(data, decoded_len, make_decoding_table(dictionary, table_bits))
+
+
+class AdaptiveModel:
+    """Symbol counts and codes shared by the adaptive encoder and decoder.
+
+    Both sides start knowing only ESCAPE and END, update the counts
+    after every symbol and rebuild their codes at the same points, so
+    no table is ever sent. Memory is bounded by the size of the
+    alphabet. Subclasses turn each new {symbol: code} dictionary into
+    whatever they need in use_codes().
+    """
+    def __init__(self, max_code_len=DEFAULT_MAX_CODE_LEN):
+        self.max_code_len = max_code_len
+        self.counts = {ADAPTIVE_END: 1, ADAPTIVE_ESCAPE: 1}
+        self.interval = ADAPTIVE_FIRST_REBUILD // 2
+        self.rebuilds = 0
+        self.rebuild()
+
+    def rebuild(self):
+        counts = self.counts
+        if sum(counts.values()) > ADAPTIVE_MAX_TOTAL:
+            # In place, as the coding loops hold on to counts
+            for s, c in counts.items():
+                counts[s] = (c + 1) // 2
+        self.use_codes(make_canonical_codes(make_code_lengths(counts, self.max_code_len)))
+        self.interval = min(2 * self.interval, ADAPTIVE_MAX_REBUILD)
+        self.until_rebuild = self.interval
+        self.rebuilds += 1
+
+    def use_codes(self, codes):
+        raise NotImplementedError
+
+
+class AdaptiveHuffmanEncoder(AdaptiveModel):
+    def __init__(self, symbol_bits=8, max_code_len=DEFAULT_MAX_CODE_LEN):
+        self.symbol_bits = symbol_bits
+        self.out = BitWriter()
+        super().__init__(max_code_len)
+
+    def use_codes(self, codes):
+        self.codes = {s: (int(code, 2), len(code)) for s, code in codes.items()}
+
+    def encode(self, symbols):
+        """Code symbols, returning the whole bytes of output so far."""
+        write = self.out.write
+        counts = self.counts
+        codes = self.codes
+        symbol_bits = self.symbol_bits
+        left = self.until_rebuild
+        for s in symbols:
+            code = codes.get(s)
+            if code is None:
+                write(*codes[ADAPTIVE_ESCAPE])
+                write(s, symbol_bits)
+                counts[ADAPTIVE_ESCAPE] += 1
+                counts[s] = 1
+            else:
+                write(*code)
+                counts[s] += 1
+            left -= 1
+            if left == 0:
+                self.rebuild()
+                codes = self.codes
+                left = self.until_rebuild
+        self.until_rebuild = left
+        return self.out.take_bytes()
+
+    def finish(self):
+        """Write the END symbol and return the rest of the output."""
+        self.out.write(*self.codes[ADAPTIVE_END])
+        out = self.out.tobytes()
+        self.out = BitWriter()
+        return out
+
+
+class AdaptiveHuffmanDecoder(AdaptiveModel):
+    def __init__(self, symbol_bits=8, max_code_len=DEFAULT_MAX_CODE_LEN, table_bits=DEFAULT_TABLE_BITS):
+        self.symbol_bits = symbol_bits
+        self.table_bits = table_bits
+        self.finished = False
+        super().__init__(max_code_len)
+
+    def use_codes(self, codes):
+        self.table = make_decoding_table(codes, self.table_bits)
+
+    def decode(self, reader, symbols):
+        """Decode from a BitReader, appending to symbols, until END or
+        the input runs out. Returns the reader's position after the last
+        whole symbol, which is where decoding has to pick up again.
+        """
+        counts = self.counts
+        symbol_bits = self.symbol_bits
+        left = self.until_rebuild
+        pos = reader.pos
+        try:
+            while True:
+                bits, level = self.table
+                while True:
+                    # Codes at the very end can be shorter than the table
+                    available = reader.bits_left()
+                    if available >= bits:
+                        index = reader.peek(bits)
+                    else:
+                        index = reader.peek(available) << (bits - available)
+                    s, length, subtable = level[index]
+                    if length > available:
+                        raise ReadError('Ran out of input in the middle of a code')
+                    reader.read(length)
+                    if subtable is None:
+                        break
+                    bits, level = subtable
+                if s == ADAPTIVE_END:
+                    self.finished = True
+                    return reader.pos
+                if s == ADAPTIVE_ESCAPE:
+                    s = reader.read(symbol_bits)
+                    counts[ADAPTIVE_ESCAPE] += 1
+                    counts[s] = 1
+                else:
+                    counts[s] += 1
+                symbols.append(s)
+                pos = reader.pos
+                left -= 1
+                if left == 0:
+                    self.rebuild()
+                    left = self.until_rebuild
+        except ReadError:
+            return pos
+        finally:
+            self.until_rebuild = left
+
+
+def encode_adaptive(symbols, encoder):
+    return encoder.encode(symbols) + encoder.finish()
+
+
+def decode_adaptive(data, decoder):
+    symbols = []
+    decoder.decode(BitReader(data), symbols)
+    if not decoder.finished:
+        raise ReadError('Adaptive Huffman stream has no END symbol')
+    return symbols
+
+
+def adaptive_huffman_encode(data, symbol_bits=8, max_code_len=DEFAULT_MAX_CODE_LEN, stats=None):
+    """Huffman code data in a single pass, with codes that adapt as it
+    goes. Nothing else needs to be sent: the output ends itself."""
+    encoder = AdaptiveHuffmanEncoder(symbol_bits, max_code_len)
+    out = timed(stats, 'huffman.adaptive_encode', encode_adaptive,
+                unpack_symbols(data, symbol_bits), encoder)
+    if stats is not None:
+        stats.count('huffman.rebuilds', encoder.rebuilds)
+    return out
+
+
+def adaptive_huffman_decode(data, symbol_bits=8, max_code_len=DEFAULT_MAX_CODE_LEN,
+                            table_bits=DEFAULT_TABLE_BITS, stats=None):
+    decoder = AdaptiveHuffmanDecoder(symbol_bits, max_code_len, table_bits)
+    symbols = timed(stats, 'huffman.adaptive_decode', decode_adaptive, data, decoder)
+    if stats is not None:
+        stats.count('huffman.rebuilds', decoder.rebuilds)
+    return pack_symbols(symbols, symbol_bits)
+
+
+class HuffmanCompressor:
+    """Incremental Huffman encoder, in the style of zlib.compressobj().
+
+    Input is coded in blocks of up to block_size bytes, each with its
+    own table, so only one block is held in memory. Each block is
+    written as its symbol count, table and coded data, the last two
+    preceded by their lengths in bytes, all as 32-bit fields.
+    """
+    def __init__(self, symbol_bits=8, block_size=DEFAULT_STREAM_BLOCK_SIZE,
+                 canonical=True, max_code_len=DEFAULT_MAX_CODE_LEN):
+        self.symbol_bits = symbol_bits
+        # Blocks have to hold a whole number of symbols
+        self.block_size = block_size - block_size % symbol_bits
+        self.canonical = canonical
+        self.max_code_len = max_code_len
+        self.buffer = bytearray()
+
+    def encode_block(self, block):
+        data, num_symbols, serialized_tree = huffman_encode(
+            block, symbol_bits=self.symbol_bits,
+            canonical=self.canonical, max_code_len=self.max_code_len)
+        out = BitWriter()
+        out.write(num_symbols, 32)
+        out.write(len(serialized_tree), 32)
+        out.write_bytes(serialized_tree)
+        out.write(len(data), 32)
+        out.write_bytes(data)
+        return out.tobytes()
+
+    def compress(self, data):
+        self.buffer += data
+        out = bytearray()
+        while len(self.buffer) >= self.block_size:
+            out += self.encode_block(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return bytes(out)
+
+    def flush(self):
+        out = self.encode_block(bytes(self.buffer)) if self.buffer else b''
+        self.buffer.clear()
+        return out
+
+
+class HuffmanDecompressor:
+    """Incremental decoder for HuffmanCompressor's output."""
+    def __init__(self, symbol_bits=8, table_bits=DEFAULT_TABLE_BITS):
+        self.symbol_bits = symbol_bits
+        self.table_bits = table_bits
+        self.input = BitInputBuffer()
+
+    def decompress(self, data):
+        bits = self.input.feed(data)
+        consumed = bits.pos
+        out = bytearray()
+        try:
+            while True:
+                num_symbols = bits.read(32)
+                serialized_tree = bits.read_bytes(bits.read(32))
+                block = bits.read_bytes(bits.read(32))
+                consumed = bits.pos
+                out += huffman_decode(block, num_symbols, serialized_tree,
+                                      symbol_bits=self.symbol_bits, table_bits=self.table_bits)
+        except ReadError:
+            pass
+        self.input.consume(consumed)
+        return bytes(out)
+
+    def flush(self):
+        return b''
+
+
+class AdaptiveHuffmanCompressor:
+    """Incremental adaptive Huffman encoder.
+
+    Unlike HuffmanCompressor, there are no blocks or tables: symbols
+    are coded as soon as they arrive, with codes that adapt as they go,
+    and the output is a single stream ended by flush().
+    """
+    def __init__(self, symbol_bits=8, max_code_len=DEFAULT_MAX_CODE_LEN):
+        self.symbol_bits = symbol_bits
+        self.encoder = AdaptiveHuffmanEncoder(symbol_bits, max_code_len)
+        self.buffer = bytearray()
+
+    def compress(self, data):
+        # Whole multiples of symbol_bits bytes hold a whole number of symbols
+        self.buffer += data
+        whole = len(self.buffer) - len(self.buffer) % self.symbol_bits
+        symbols = unpack_symbols(bytes(self.buffer[:whole]), self.symbol_bits)
+        del self.buffer[:whole]
+        return self.encoder.encode(symbols)
+
+    def flush(self):
+        out = self.encoder.encode(unpack_symbols(bytes(self.buffer), self.symbol_bits))
+        self.buffer.clear()
+        return out + self.encoder.finish()
+
+
+class AdaptiveHuffmanDecompressor:
+    """Incremental decoder for AdaptiveHuffmanCompressor's output."""
+    def __init__(self, symbol_bits=8, max_code_len=DEFAULT_MAX_CODE_LEN, table_bits=DEFAULT_TABLE_BITS):
+        self.symbol_bits = symbol_bits
+        self.decoder = AdaptiveHuffmanDecoder(symbol_bits, max_code_len, table_bits)
+        self.input = BitInputBuffer()
+        self.output = BitWriter()
+
+    def decompress(self, data):
+        if self.decoder.finished:
+            return b''
+        symbols = []
+        self.input.consume(self.decoder.decode(self.input.feed(data), symbols))
+        if self.symbol_bits == 8:
+            return bytes(symbols)
+        for s in symbols:
+            self.output.write(s, self.symbol_bits)
+        return self.output.tobytes() if self.decoder.finished else self.output.take_bytes()
+
+    def flush(self):
+        return b''
+
+
 if __name__ == '__main__':
     # input_data = b'A MAN A PLAN A CANAL PANAMA'
     with open('test.dat', 'rb') as f:
@@ -143,4 +749,10 @@ if __name__ == '__main__':
     print(f'Compressed size: {len(enc) + len(serialized_tree)}')
     print(f'Compression ratio: {(len(enc) + len(serialized_tree)) / len(input_data)}')
 
+    print('Adaptive...')
+    enc = adaptive_huffman_encode(input_data)
+    assert adaptive_huffman_decode(enc) == input_data
+    print(f'Compressed size: {len(enc)}')
+    print(f'Compression ratio: {len(enc) / len(input_data)}')
+
     pass
@@ -1,79 +1,431 @@
-"""LZ77 encoding and decoding."""
+"""LZ77 encoding and decoding.
 
-from bitstring import Bits, BitArray, ConstBitStream, ReadError
+Tokens are (distance, length, next_ch) triples. How the input is cut
+into tokens depends on the compression level, 1 to 9 as in zlib:
+
+    1-3  greedy: take the longest match at each position, with a
+         short search
+    4-7  lazy: if the next position has a longer match, and it's worth
+         it under a cost model, send this byte as a literal and take
+         that match instead. Where every token costs the same, these
+         are greedy with deeper searches, as lazy parsing can't help
+    8-9  optimal: find the cheapest tokens for each block of
+         OPTIMAL_BLOCK_LEN bytes under a cost model, by dynamic
+         programming over every length of the longest match at every
+         position
+
+Higher levels also follow longer hash chains and stop at longer "nice"
+matches, which are taken without looking any further. level=None keeps
+the original greedy parse with whatever max_chain is given.
+
+Match lengths are sent in reference_bits bits, so the longest match is
+2**reference_bits - 2 bytes, 14 by default. Decoders have to be given
+the same reference_bits.
+
+With workers other than 1, the input is parsed in PARALLEL_CHUNK_LEN
+chunks across a pool of processes, like pigz. Each chunk comes with the
+window before it, so matches still reach back across chunk boundaries,
+and the tokens join up into one ordinary stream. Tokens can't run on
+from one chunk into the next, so the output differs a little from
+workers=1, but it's the same for any number of workers.
+"""
+
+from functools import partial
+
+from bitio import BitInputBuffer, BitReader, BitWriter, ReadError
+from match_finder import make_match_finder, DEFAULT_MATCH_FINDER
+from parallel import ordered_map
+from stats import timed
 
 
 DEFAULT_WINDOW_BITS = 12  # 4K window
 REFERENCE_SIZE_BITS = 4   # 16 character max
 
 
-def get_longest_prefix(input_data, input_idx, window, max_window_len):
-    win_start = window[0]
-    win_end = window[1]
-    prefix_dist = 0
-    prefix_len = 0
-    next_ch = input_data[input_idx]
-    max_prefix_len = min(2**REFERENCE_SIZE_BITS - 1, len(input_data) - input_idx)
-    for candidate_pfx_len in range(2, max_prefix_len):
-        candidate_pfx = input_data[input_idx:input_idx+candidate_pfx_len]
-        idx = input_data.find(candidate_pfx, win_start)
-        if win_start <= idx and idx < win_end:
-            prefix_dist = input_idx - idx
-            prefix_len = candidate_pfx_len
-            next_ch = input_data[input_idx + candidate_pfx_len]
-    return prefix_dist, prefix_len, next_ch
-
-
-def lz77_encode_to_tokens(input_data, window_bits):
-    max_window_len = 2**window_bits - 1
-    output = []
-    input_idx = 0
-    while input_idx < len(input_data):
-        win_start = max(0, input_idx - max_window_len)
-        prefix_dist, prefix_len, next_ch = get_longest_prefix(
-                input_data, input_idx, (win_start, input_idx), max_window_len)
-        output.append((prefix_dist, prefix_len, next_ch))
+def max_match_len(reference_bits):
+    return 2**reference_bits - 2  # leaves room for next_ch
+
+
+MAX_MATCH_LEN = max_match_len(REFERENCE_SIZE_BITS)
+
+# level: (parser, max_chain, nice_len)
+LEVELS = {
+    1: ('greedy', 4, 8),
+    2: ('greedy', 8, 16),
+    3: ('greedy', 32, 32),
+    4: ('lazy', 16, 16),
+    5: ('lazy', 32, 32),
+    6: ('lazy', 128, 128),
+    7: ('lazy', 1024, 258),
+    8: ('optimal', 256, 128),
+    9: ('optimal', 4096, 258),
+}
+
+# The deepest search of the greedy levels
+GREEDY_MAX_CHAIN = max(chain for parser, chain, _ in LEVELS.values() if parser == 'greedy')
+GREEDY_NICE_LEN = max(nice for parser, _, nice in LEVELS.values() if parser == 'greedy')
+
+OPTIMAL_BLOCK_LEN = 2**14
+PARALLEL_CHUNK_LEN = 2**17
+
+
+def lz77_tokens(input_data, finder, start, end):
+    """Yield greedy tokens for input_data, starting at start and stopping
+    at the first token that starts at or after end."""
+    input_idx = start
+    while input_idx < end:
+        prefix_dist, prefix_len = finder.find(input_idx)
+        next_ch = input_data[input_idx + prefix_len]
+        yield prefix_dist, prefix_len, next_ch
         input_idx += prefix_len + 1
-    return output
 
 
-def lz77_encode(input_data, window_bits=DEFAULT_WINDOW_BITS):
-    tokens = lz77_encode_to_tokens(input_data, window_bits)
-    out = BitArray()
+def fixed_token_cost(dist, length):
+    """Cost model for formats where every token is the same size."""
+    return 1
+
+
+def lazy_tokens(input_data, finder, start, end, token_cost=fixed_token_cost):
+    """Like lz77_tokens(), but a match is put off by a byte if the next
+    position has a longer one that makes up for the extra literal token,
+    under token_cost(dist, length). Looks one byte further ahead."""
+    literal_cost = token_cost(0, 0)
+    input_idx = start
+    match = finder.find(input_idx) if input_idx < end else None
+    while input_idx < end:
+        prefix_dist, prefix_len = match
+        if prefix_len > 0:
+            next_match = finder.find(input_idx + 1)
+            # Compare costs per byte covered, this token's next_ch included
+            if (next_match[1] > prefix_len and
+                    (literal_cost + token_cost(*next_match)) * (prefix_len + 1) <
+                    token_cost(prefix_dist, prefix_len) * (next_match[1] + 2)):
+                yield 0, 0, input_data[input_idx]
+                input_idx += 1
+                match = next_match
+                continue
+        yield prefix_dist, prefix_len, input_data[input_idx + prefix_len]
+        input_idx += prefix_len + 1
+        if input_idx < end:
+            match = finder.find(input_idx)
+
+
+def optimal_tokens(input_data, finder, start, end, token_cost=fixed_token_cost, nice_len=None):
+    """Yield the cheapest tokens under token_cost(dist, length), a
+    block of OPTIMAL_BLOCK_LEN bytes at a time.
+
+    Blocks run on from each other from start, and one is only parsed
+    once all of it is before end or it runs to the end of input_data,
+    so the tokens don't depend on how the input arrives. Tokens never
+    cross from one block into the next.
+    """
+    block_start = start
+    while True:
+        block_end = min(block_start + OPTIMAL_BLOCK_LEN, len(input_data))
+        if block_end <= block_start or block_end > end:
+            return
+        yield from optimal_block_tokens(input_data, finder, block_start, block_end, token_cost, nice_len)
+        block_start = block_end
+
+
+def optimal_block_tokens(input_data, finder, start, end, token_cost, nice_len=None):
+    n = end - start
+    nice_len = nice_len or n
+    literal_cost = token_cost(0, 0)
+    cost = [0] + [float('inf')] * n
+    choice = [None] * (n + 1)  # (dist, length) of the cheapest token ending here
+    i = 0
+    while i < n:
+        c = cost[i]
+        if c + literal_cost < cost[i+1]:
+            cost[i+1] = c + literal_cost
+            choice[i+1] = (0, 0)
+        dist, longest = finder.find(start + i)
+        longest = min(longest, n - i - 1)
+        if longest >= nice_len:
+            # Take a nice match whole, and don't parse inside it
+            j = i + longest + 1
+            if c + token_cost(dist, longest) < cost[j]:
+                cost[j] = c + token_cost(dist, longest)
+                choice[j] = (dist, longest)
+            i = j
+            continue
+        for length in range(2, longest + 1):
+            j = i + length + 1
+            match_cost = c + token_cost(dist, length)
+            if match_cost < cost[j]:
+                cost[j] = match_cost
+                choice[j] = (dist, length)
+        i += 1
+
+    tokens = []
+    j = n
+    while j > 0:
+        dist, length = choice[j]
+        j -= length + 1
+        tokens.append((dist, length, input_data[start + j + length]))
+    return reversed(tokens)
+
+
+PARSERS = {
+    'greedy': lz77_tokens,
+    'lazy': lazy_tokens,
+    'optimal': optimal_tokens,
+}
+
+
+def level_settings(level, max_chain=None):
+    """Return (parser name, max_chain, nice_len) for a compression level.
+    An explicit max_chain wins over the level's."""
+    if level is None:
+        return 'greedy', max_chain, None
+    if level not in LEVELS:
+        raise ValueError(f'Compression levels go from {min(LEVELS)} to {max(LEVELS)}')
+    parser, level_chain, nice_len = LEVELS[level]
+    return parser, level_chain if max_chain is None else max_chain, nice_len
+
+
+def make_parser(level=None, max_chain=None, token_cost=fixed_token_cost):
+    """Return (parse, max_chain, nice_len) for a compression level,
+    where parse is called like lz77_tokens(). An explicit max_chain
+    wins over the level's.
+
+    When every token costs the same, putting a match off can't win: the
+    longer match from the next byte is still there, a byte shorter,
+    after the greedy token, so the literal is wasted. The lazy levels
+    parse greedily for fixed_token_cost instead, searching at least as
+    hard as the greedy levels.
+    """
+    parser, level_chain, nice_len = level_settings(level, max_chain)
+    if parser == 'lazy' and token_cost is fixed_token_cost:
+        parser = 'greedy'
+        if max_chain is None:
+            level_chain = max(level_chain, GREEDY_MAX_CHAIN)
+        nice_len = max(nice_len, GREEDY_NICE_LEN)
+    if parser == 'greedy':
+        parse = lz77_tokens
+    elif parser == 'lazy':
+        parse = partial(lazy_tokens, token_cost=token_cost)
+    else:
+        parse = partial(optimal_tokens, token_cost=token_cost, nice_len=nice_len)
+    return parse, level_chain, nice_len
+
+
+def find_tokens(input_data, finder, parse=lz77_tokens):
+    return list(parse(input_data, finder, 0, len(input_data)))
+
+
+def find_chunk_tokens(job):
+    """Parse one chunk for find_tokens_parallel(), in a worker process.
+    Returns (tokens, match finder probes)."""
+    data, start, parse, finder_options = job
+    finder = make_match_finder(data, **finder_options)
+    return list(parse(data, finder, start, len(data))), finder.probes
+
+
+def find_tokens_parallel(input_data, parse, finder_options, workers=None, chunk_len=PARALLEL_CHUNK_LEN):
+    """Like find_tokens(), but a chunk at a time in a pool of worker
+    processes. Returns (tokens, match finder probes).
+
+    The parsers never look past the end of the data they're given, so
+    the last token of each chunk ends with the chunk.
+    """
+    history_len = 2**finder_options['window_bits'] - 1
+    jobs = ((bytes(input_data[max(0, start - history_len):start + chunk_len]), min(start, history_len),
+             parse, finder_options)
+            for start in range(0, len(input_data), chunk_len))
+    tokens = []
+    probes = 0
+    for chunk_tokens, chunk_probes in ordered_map(find_chunk_tokens, jobs, workers=workers):
+        tokens += chunk_tokens
+        probes += chunk_probes
+    return tokens, probes
+
+
+def parse_tokens(input_data, parse, finder_options, workers=1, stats=None, stage='lz77.match_finding'):
+    """Parse all of input_data with parse and a match finder made from
+    finder_options, in this process or across workers, timed as stage.
+    Returns (tokens, match finder probes)."""
+    if workers == 1:
+        finder = make_match_finder(input_data, **finder_options)
+        tokens = timed(stats, stage, find_tokens, input_data, finder, parse)
+        return tokens, finder.probes
+    return timed(stats, stage, find_tokens_parallel, input_data, parse, finder_options, workers)
+
+
+def lz77_encode_to_tokens(input_data, window_bits,
+                          match_finder=DEFAULT_MATCH_FINDER, max_chain=None, stats=None,
+                          max_len=MAX_MATCH_LEN, level=None, token_cost=fixed_token_cost, workers=1):
+    parse, max_chain, nice_len = make_parser(level, max_chain, token_cost)
+    finder_options = {'window_bits': window_bits, 'max_len': max_len, 'match_finder': match_finder,
+                      'max_chain': max_chain, 'nice_len': nice_len}
+    tokens, probes = parse_tokens(input_data, parse, finder_options, workers, stats, 'lz77.match_finding')
+    if stats is not None:
+        match_lens = [t[1] for t in tokens if t[1] > 0]
+        stats.count('lz77.tokens', len(tokens))
+        stats.count('lz77.matches', len(match_lens))
+        stats.count('lz77.match_bytes', sum(match_lens))
+        stats.count('match_finder.probes', probes)
+    return tokens
+
+
+def write_lz77_token(out, t, window_bits, reference_bits=REFERENCE_SIZE_BITS):
+    out.write(t[0], window_bits)
+    out.write(t[1], reference_bits)
+    out.write(t[2], 8)
+
+
+def read_lz77_token(encoded, window_bits, reference_bits=REFERENCE_SIZE_BITS):
+    pfx_dist = encoded.read(window_bits)
+    pfx_len = encoded.read(reference_bits)
+    next_ch = encoded.read(8)
+    return pfx_dist, pfx_len, next_ch
+
+
+def write_tokens(tokens, window_bits, write_token=write_lz77_token, reference_bits=REFERENCE_SIZE_BITS):
+    out = BitWriter()
     for t in tokens:
-        out.append(Bits(uint=t[0], length=window_bits))
-        out.append(Bits(uint=t[1], length=REFERENCE_SIZE_BITS))
-        out.append(Bits(uint=t[2], length=8))
+        write_token(out, t, window_bits, reference_bits)
     return out.tobytes()
 
 
+def lz77_encode(input_data, window_bits=DEFAULT_WINDOW_BITS,
+                match_finder=DEFAULT_MATCH_FINDER, max_chain=None, stats=None,
+                level=None, reference_bits=REFERENCE_SIZE_BITS, workers=1):
+    tokens = lz77_encode_to_tokens(input_data, window_bits,
+                                   match_finder=match_finder, max_chain=max_chain, stats=stats,
+                                   max_len=max_match_len(reference_bits), level=level, workers=workers)
+    return timed(stats, 'lz77.emit', write_tokens, tokens, window_bits, write_lz77_token, reference_bits)
+
+
+def copy_match(decoded, dist, length):
+    """Append length bytes starting dist back from the end of decoded.
+
+    A match longer than its distance overlaps itself, repeating the last
+    dist bytes, so that chunk is doubled until it's long enough rather
+    than being copied a byte at a time. Raises ReadError for a distance
+    that doesn't point into decoded.
+    """
+    if not 0 < dist <= len(decoded):
+        raise ReadError(f'Match distance {dist} with {len(decoded)} bytes decoded')
+    start = len(decoded) - dist
+    if length <= dist:
+        decoded += decoded[start:start+length]
+    else:
+        chunk = decoded[start:]
+        while len(chunk) < length:
+            chunk *= 2
+        decoded += chunk[:length]
+
+
 def lz77_decode_from_tokens(tokens):
     decoded = bytearray()
-    cur_idx = 0
-    for t in tokens:
-        pfx_dist = t[0]
-        pfx_len = t[1]
-        next_ch = t[2]
-        pfx_idx = cur_idx - pfx_dist
-        for i in range(pfx_idx, pfx_idx + pfx_len):
-            decoded.append(decoded[i])
+    for pfx_dist, pfx_len, next_ch in tokens:
+        if pfx_len:
+            copy_match(decoded, pfx_dist, pfx_len)
         decoded.append(next_ch)
-        cur_idx += pfx_len + 1
     return bytes(decoded)
 
 
-def lz77_decode(encoded_data, window_bits=DEFAULT_WINDOW_BITS):
-    encoded = ConstBitStream(encoded_data)
-    tokens = []
-    try:
-        while True:
-            pfx_dist = encoded.read(f'uint:{window_bits}')
-            pfx_len = encoded.read(f'uint:{REFERENCE_SIZE_BITS}')
-            next_ch = encoded.read('uint:8')
-            tokens.append((pfx_dist, pfx_len, next_ch))
-    except ReadError:
-        pass
-    return lz77_decode_from_tokens(tokens)
+def decode_tokens_into(decoded, encoded, read_token):
+    """Decode tokens from read_token(encoded) onto the end of decoded as
+    they're read, until the input runs out, with no list of tokens in
+    between. Returns the bit position after the last whole token."""
+    while True:
+        consumed = encoded.pos
+        # Running out of input ends the tokens, but a bad match in a
+        # whole token is an error
+        try:
+            pfx_dist, pfx_len, next_ch = read_token(encoded)
+        except ReadError:
+            return consumed
+        if pfx_len:
+            copy_match(decoded, pfx_dist, pfx_len)
+        decoded.append(next_ch)
+
+
+def lz77_decode(encoded_data, window_bits=DEFAULT_WINDOW_BITS, reference_bits=REFERENCE_SIZE_BITS):
+    decoded = bytearray()
+    decode_tokens_into(decoded, BitReader(encoded_data),
+                       lambda encoded: read_lz77_token(encoded, window_bits, reference_bits))
+    return bytes(decoded)
+
+
+class Lz77Compressor:
+    """Incremental LZ77 encoder, in the style of zlib.compressobj().
+
+    Only the window and enough lookahead for the longest match are kept
+    between calls, and the concatenated output of compress() and
+    flush() is the same as lz77_encode() on the concatenated input.
+    """
+    token_cost = staticmethod(fixed_token_cost)
+
+    def __init__(self, window_bits=DEFAULT_WINDOW_BITS,
+                 match_finder=DEFAULT_MATCH_FINDER, max_chain=None,
+                 level=None, reference_bits=REFERENCE_SIZE_BITS):
+        self.window_bits = window_bits
+        self.match_finder = match_finder
+        self.reference_bits = reference_bits
+        self.max_len = max_match_len(reference_bits)
+        self.parse, self.max_chain, self.nice_len = make_parser(level, max_chain, self.token_cost)
+        self.buffer = bytearray()  # window, then input not yet encoded
+        self.pos = 0
+        self.out = BitWriter()
+
+    def write_token(self, t):
+        write_lz77_token(self.out, t, self.window_bits, self.reference_bits)
+
+    @staticmethod
+    def token_len(t):
+        """How many bytes of input a token covers."""
+        return t[1] + 1
+
+    def encode_buffer(self, end):
+        if self.pos < end:
+            finder = make_match_finder(self.buffer, self.window_bits, self.max_len,
+                                       match_finder=self.match_finder, max_chain=self.max_chain,
+                                       nice_len=self.nice_len)
+            for t in self.parse(self.buffer, finder, self.pos, end):
+                self.write_token(t)
+                self.pos += self.token_len(t)
+        history_start = max(0, self.pos - (2**self.window_bits - 1))
+        del self.buffer[:history_start]
+        self.pos -= history_start
+
+    def compress(self, data):
+        self.buffer += data
+        # A token can only be final once its longest possible match and
+        # next_ch are both in the buffer, along with the same for the
+        # next position for lazy matching
+        self.encode_buffer(len(self.buffer) - self.max_len - 2)
+        return self.out.take_bytes()
+
+    def flush(self):
+        self.encode_buffer(len(self.buffer))
+        return self.out.tobytes()
+
+
+class Lz77Decompressor:
+    """Incremental LZ77 decoder, in the style of zlib.decompressobj()."""
+    def __init__(self, window_bits=DEFAULT_WINDOW_BITS, reference_bits=REFERENCE_SIZE_BITS):
+        self.window_bits = window_bits
+        self.reference_bits = reference_bits
+        self.input = BitInputBuffer()
+        self.history = bytearray()
+
+    def read_token(self, encoded):
+        return read_lz77_token(encoded, self.window_bits, self.reference_bits)
+
+    def decompress(self, data):
+        decoded = self.history
+        start = len(decoded)
+        self.input.consume(decode_tokens_into(decoded, self.input.feed(data), self.read_token))
+        out = bytes(decoded[start:])
+        del decoded[:max(0, len(decoded) - (2**self.window_bits - 1))]
+        return out
+
+    def flush(self):
+        return b''
 
 
 if __name__ == '__main__':
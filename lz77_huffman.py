@@ -1,38 +1,224 @@
 """Huffman-coded LZ77 encoding and decoding.
 
-Uses one Huffman table for all of the LZ77 symbols, which is not what
-DEFLATE does.
+lz77huff_encode() uses one Huffman table for all of the LZ77 symbols,
+which is not what DEFLATE does, and widens every field of every token
+to window_bits bits. coder='range' or 'adaptive_range' range codes the
+symbols instead (see entropy.py).
+
+lz77deflate_encode() works more like DEFLATE. Literals, match lengths
+and an end of block marker share one alphabet, and distances have
+another. Lengths and distances are sent as a bucket code plus extra
+bits, and the tables are rebuilt for every block of block_tokens
+tokens. Each block is:
+
+    final block flag (1 bit)
+    literal/length code lengths (see huffman.serialize_code_lengths)
+    distance code lengths
+    codes, then END_OF_BLOCK
+
+where a match is its length code, length extra bits, distance code and
+distance extra bits, and every token ends with a literal.
 """
 
-from bitstring import Bits, BitArray, ConstBitStream, ReadError
-from huffman import huffman_encode, huffman_decode
-from lz77 import lz77_encode_to_tokens, lz77_decode_from_tokens, DEFAULT_WINDOW_BITS
+from collections import Counter
+
+from bitio import BitReader, BitWriter, ReadError
+from entropy import DEFAULT_CODER, entropy_encode, entropy_iter_symbols
+from huffman import (deserialize_code_lengths, make_canonical_codes, make_code_lengths,
+                     make_decoding_table, serialize_code_lengths)
+from lz77 import copy_match, lz77_encode_to_tokens, lz77_decode_from_tokens, DEFAULT_WINDOW_BITS, MAX_MATCH_LEN
+from match_finder import DEFAULT_MATCH_FINDER
+from stats import timed
+
 
+END_OF_BLOCK = 256
+FIRST_LENGTH_SYMBOL = 257
+LITLEN_SYMBOL_BITS = 9
+DISTANCE_SYMBOL_BITS = 5
+MAX_DEFLATE_WINDOW_BITS = 16
+DEFAULT_BLOCK_TOKENS = 2**14
 
-def lz77huff_encode(input_data, window_bits=DEFAULT_WINDOW_BITS):
-    tokens = lz77_encode_to_tokens(input_data, window_bits)
+
+def lz77huff_encode(input_data, window_bits=DEFAULT_WINDOW_BITS,
+                    match_finder=DEFAULT_MATCH_FINDER, max_chain=None, coder=DEFAULT_CODER, stats=None,
+                    level=None, max_len=MAX_MATCH_LEN, workers=1):
+    if max_len >= 2**window_bits:
+        raise ValueError('Match lengths have to fit in window_bits bits')
+    tokens = lz77_encode_to_tokens(input_data, window_bits,
+                                   match_finder=match_finder, max_chain=max_chain, stats=stats,
+                                   max_len=max_len, level=level, workers=workers)
     symbols = [s for tok in tokens for s in tok]
-    bits = BitArray()
+    bits = BitWriter()
     for s in symbols:
-        bits.append(Bits(uint=s, length=window_bits))
-    encoded_data, num_symbols, serialized_tree = huffman_encode(bits.tobytes(),
-                                                                symbol_bits=window_bits)
+        bits.write(s, window_bits)
+    encoded_data, num_symbols, serialized_tree = entropy_encode(bits.tobytes(), symbol_bits=window_bits,
+                                                                coder=coder, stats=stats)
     return encoded_data, num_symbols, serialized_tree
 
 
 def lz77huff_decode(encoded_data, num_symbols, serialized_tree, window_bits=DEFAULT_WINDOW_BITS):
-    bytestream = huffman_decode(encoded_data, num_symbols, serialized_tree, symbol_bits=window_bits)
-    bits = ConstBitStream(bytestream)
-    tokens = []
-    try:
-        while True:
-            t = (bits.read(f'uint:{window_bits}'),
-                 bits.read(f'uint:{window_bits}'),
-                 bits.read(f'uint:{window_bits}'))
-            tokens.append(t)
-    except ReadError:
-        pass
-    return lz77_decode_from_tokens(tokens)
+    symbols = entropy_iter_symbols(encoded_data, num_symbols, serialized_tree, symbol_bits=window_bits)
+    # Every three symbols are a token, decoded as soon as the entropy
+    # decoder yields them, with no list of symbols or tokens in between
+    return lz77_decode_from_tokens(zip(symbols, symbols, symbols))
+
+
+def bucket(value):
+    """Split value into (code, extra bits, extra) as DEFLATE does for
+    distances: 0 to 3 have codes of their own, then each power of two
+    is split between two codes."""
+    if value < 4:
+        return value, 0, 0
+    extra_bits = value.bit_length() - 2
+    return 2 * extra_bits + 2 + ((value >> extra_bits) & 1), extra_bits, value & ((1 << extra_bits) - 1)
+
+
+def bucket_base(code):
+    """Return (smallest value, extra bits) for a bucket code."""
+    if code < 4:
+        return code, 0
+    extra_bits = code // 2 - 1
+    return (2 + (code & 1)) << extra_bits, extra_bits
+
+
+BUCKETS = [bucket_base(code) for code in range(2**LITLEN_SYMBOL_BITS - FIRST_LENGTH_SYMBOL)]
+
+
+def is_match(t):
+    return t[0] > 0 and t[1] > 0
+
+
+def write_deflate_block(out, tokens, final):
+    litlen_counts = Counter({END_OF_BLOCK: 1})
+    dist_counts = Counter()
+    for t in tokens:
+        if is_match(t):
+            litlen_counts[FIRST_LENGTH_SYMBOL + bucket(t[1] - 1)[0]] += 1
+            dist_counts[bucket(t[0] - 1)[0]] += 1
+        litlen_counts[t[2]] += 1
+    litlen_lengths = make_code_lengths(litlen_counts)
+    dist_lengths = make_code_lengths(dist_counts) if dist_counts else {}
+    litlen_codes = {s: (int(c, 2), len(c)) for s, c in make_canonical_codes(litlen_lengths).items()}
+    dist_codes = {s: (int(c, 2), len(c)) for s, c in make_canonical_codes(dist_lengths).items()}
+
+    out.write_bool(final)
+    serialize_code_lengths(litlen_lengths, LITLEN_SYMBOL_BITS, bit_array=out)
+    serialize_code_lengths(dist_lengths, DISTANCE_SYMBOL_BITS, bit_array=out)
+    write = out.write
+    for t in tokens:
+        if is_match(t):
+            code, extra_bits, extra = bucket(t[1] - 1)
+            write(*litlen_codes[FIRST_LENGTH_SYMBOL + code])
+            write(extra, extra_bits)
+            code, extra_bits, extra = bucket(t[0] - 1)
+            write(*dist_codes[code])
+            write(extra, extra_bits)
+        write(*litlen_codes[t[2]])
+    write(*litlen_codes[END_OF_BLOCK])
+
+
+def write_deflate_blocks(tokens, block_tokens=DEFAULT_BLOCK_TOKENS):
+    out = BitWriter()
+    # Even no tokens at all need a block, to say that it's the last
+    for start in range(0, max(len(tokens), 1), block_tokens):
+        write_deflate_block(out, tokens[start:start+block_tokens], start + block_tokens >= len(tokens))
+    return out.tobytes()
+
+
+def deflate_token_cost(dist, length):
+    """Rough cost in bits for the optimal parse, guessing 8 bits for a
+    literal and 6 and 5 for length and distance codes."""
+    if length == 0:
+        return 8
+    return 8 + 6 + bucket(length - 1)[1] + 5 + bucket(dist - 1)[1]
+
+
+def lz77deflate_encode(input_data, window_bits=DEFAULT_WINDOW_BITS, match_finder=DEFAULT_MATCH_FINDER,
+                       max_chain=None, block_tokens=DEFAULT_BLOCK_TOKENS, stats=None,
+                       level=None, max_len=MAX_MATCH_LEN, workers=1):
+    if window_bits > MAX_DEFLATE_WINDOW_BITS:
+        raise ValueError(f'Distance codes only go up to {MAX_DEFLATE_WINDOW_BITS}-bit windows')
+    tokens = lz77_encode_to_tokens(input_data, window_bits,
+                                   match_finder=match_finder, max_chain=max_chain, stats=stats,
+                                   max_len=max_len, level=level, token_cost=deflate_token_cost,
+                                   workers=workers)
+    return timed(stats, 'lz77deflate.emit', write_deflate_blocks, tokens, block_tokens)
+
+
+def read_bits(data, pos, nbits):
+    """Read nbits at bit position pos. data must be padded so that
+    there are four bytes from pos onwards, and nbits + 7 <= 32."""
+    word = int.from_bytes(data[pos >> 3:(pos >> 3) + 4], 'big')
+    return (word >> (32 - (pos & 7) - nbits)) & ((1 << nbits) - 1)
+
+
+def read_code(data, pos, table):
+    """Decode one symbol with a table from make_decoding_table().
+    Returns (symbol, bit position after it)."""
+    bits, level = table
+    while True:
+        symbol, length, subtable = level[read_bits(data, pos, bits)]
+        pos += length
+        if subtable is None:
+            return symbol, pos
+        bits, level = subtable
+
+
+def read_deflate_header(data, pos):
+    """Read a block's flag and tables. Returns (final, literal/length
+    table, distance table or None, bit position of the first code)."""
+    reader = BitReader(memoryview(data)[pos >> 3:])
+    reader.read(pos & 7)
+    final = reader.read_bool()
+    litlen_codes = make_canonical_codes(deserialize_code_lengths(reader, LITLEN_SYMBOL_BITS))
+    dist_codes = make_canonical_codes(deserialize_code_lengths(reader, DISTANCE_SYMBOL_BITS))
+    litlen = make_decoding_table(litlen_codes)
+    dist = make_decoding_table(dist_codes) if dist_codes else None
+    return final, litlen, dist, (pos & ~7) + reader.pos
+
+
+def read_deflate_block(data, pos, end_pos, litlen, dist, out):
+    """Decode codes into out up to END_OF_BLOCK, returning the bit
+    position after it."""
+    lit_bits, lit_entries = litlen
+    lit_mask = (1 << lit_bits) - 1
+    while True:
+        # read_code(), inlined for the first level, which almost every
+        # literal is decoded from
+        word = int.from_bytes(data[pos >> 3:(pos >> 3) + 4], 'big')
+        symbol, length, subtable = lit_entries[(word >> (32 - (pos & 7) - lit_bits)) & lit_mask]
+        pos += length
+        if subtable is not None:
+            symbol, pos = read_code(data, pos, subtable)
+        if pos > end_pos:
+            raise ReadError('Block runs past the end of the data')
+        if symbol < END_OF_BLOCK:
+            out.append(symbol)
+            continue
+        if symbol == END_OF_BLOCK:
+            return pos
+
+        base, extra_bits = BUCKETS[symbol - FIRST_LENGTH_SYMBOL]
+        match_len = base + 1 + read_bits(data, pos, extra_bits)
+        pos += extra_bits
+        code, pos = read_code(data, pos, dist)
+        base, extra_bits = BUCKETS[code]
+        match_dist = base + 1 + read_bits(data, pos, extra_bits)
+        pos += extra_bits
+
+        copy_match(out, match_dist, match_len)
+
+
+def lz77deflate_decode(encoded_data):
+    end_pos = 8 * len(encoded_data)
+    data = bytes(encoded_data) + bytes(4)
+    out = bytearray()
+    pos = 0
+    final = False
+    while not final:
+        final, litlen, dist, pos = read_deflate_header(data, pos)
+        pos = read_deflate_block(data, pos, end_pos, litlen, dist, out)
+    return bytes(out)
 
 
 if __name__ == '__main__':
@@ -49,3 +235,9 @@ if __name__ == '__main__':
     print(f'Original size: {len(input_data)}')
     print(f'Compressed size: {len(enc) + len(serialized_tree)}')
     print(f'Compression ratio: {(len(enc) + len(serialized_tree)) / len(input_data)}')
+
+    print('DEFLATE-style...')
+    enc = lz77deflate_encode(input_data)
+    assert lz77deflate_decode(enc) == input_data
+    print(f'Compressed size: {len(enc)}')
+    print(f'Compression ratio: {len(enc) / len(input_data)}')
@@ -1,43 +1,306 @@
-"""LZSS (LZ77 variant) encoding and decoding."""
+"""LZSS (LZ77 variant) encoding and decoding.
 
-from bitstring import Bits, BitArray, ConstBitStream, ReadError
-from lz77 import lz77_encode_to_tokens, lz77_decode_from_tokens, DEFAULT_WINDOW_BITS, REFERENCE_SIZE_BITS
+There are two formats. lzss_encode() writes LZ77's tokens with a flag
+bit in front, so a literal loses its empty reference but a reference
+still carries next_ch.
+
+lzssb_encode() writes LZSS proper, byte-aligned. Tokens are either a
+literal byte or a reference of distance and length, with no next_ch,
+and matches shorter than min_match are sent as literals. Tokens come
+in groups of eight behind a flag byte, most significant bit first, 1
+for a reference. A reference is distance << reference_bits | (length -
+min_match), big-endian in as few whole bytes as hold window_bits +
+reference_bits, so two bytes by default. The last group's flag byte is
+padded with zeros.
+"""
+
+from functools import partial
+
+from bitio import BitReader
+from lz77 import (copy_match, decode_tokens_into, level_settings, lz77_encode_to_tokens, max_match_len,
+                  parse_tokens, write_tokens, Lz77Compressor, Lz77Decompressor,
+                  DEFAULT_WINDOW_BITS, REFERENCE_SIZE_BITS)
+from match_finder import DEFAULT_MATCH_FINDER
+from stats import timed
 
 
 LITERAL = 0
 REFERENCE = 1
 
+DEFAULT_MIN_MATCH = 3
 
-def lzss_encode(input_data, window_bits=DEFAULT_WINDOW_BITS):
-    tokens = lz77_encode_to_tokens(input_data, window_bits)
-    out = BitArray()
-    for t in tokens:
-        if t[0] == 0 or t[1] == 0:
-            out.append(Bits(uint=LITERAL, length=1))
-            out.append(Bits(uint=t[2], length=8))
+
+def lzss_token_bits(match_bits, dist, length):
+    return 9 if length == 0 else match_bits
+
+
+def lzss_token_cost(window_bits, reference_bits=REFERENCE_SIZE_BITS):
+    """Cost model, in bits, for the optimal parse. A partial rather than
+    a closure, so that it can be sent to worker processes."""
+    return partial(lzss_token_bits, 1 + window_bits + reference_bits + 8)
+
+
+def lzss_encode(input_data, window_bits=DEFAULT_WINDOW_BITS,
+                match_finder=DEFAULT_MATCH_FINDER, max_chain=None, stats=None,
+                level=None, reference_bits=REFERENCE_SIZE_BITS, workers=1):
+    tokens = lz77_encode_to_tokens(input_data, window_bits,
+                                   match_finder=match_finder, max_chain=max_chain, stats=stats,
+                                   max_len=max_match_len(reference_bits), level=level,
+                                   token_cost=lzss_token_cost(window_bits, reference_bits), workers=workers)
+    return timed(stats, 'lzss.emit', write_tokens, tokens, window_bits, write_lzss_token, reference_bits)
+
+
+def write_lzss_token(out, t, window_bits, reference_bits=REFERENCE_SIZE_BITS):
+    if t[0] == 0 or t[1] == 0:
+        out.write(LITERAL, 1)
+        out.write(t[2], 8)
+    else:
+        out.write(REFERENCE, 1)
+        out.write(t[0], window_bits)
+        out.write(t[1], reference_bits)
+        out.write(t[2], 8)
+
+
+def read_lzss_token(encoded, window_bits, reference_bits=REFERENCE_SIZE_BITS):
+    if encoded.read(1) == LITERAL:
+        return 0, 0, encoded.read(8)
+    pfx_dist = encoded.read(window_bits)
+    pfx_len = encoded.read(reference_bits)
+    next_ch = encoded.read(8)
+    return pfx_dist, pfx_len, next_ch
+
+
+def lzss_decode(encoded_data, window_bits=DEFAULT_WINDOW_BITS, reference_bits=REFERENCE_SIZE_BITS):
+    decoded = bytearray()
+    decode_tokens_into(decoded, BitReader(encoded_data),
+                       lambda encoded: read_lzss_token(encoded, window_bits, reference_bits))
+    return bytes(decoded)
+
+
+class LzssCompressor(Lz77Compressor):
+    """Incremental LZSS encoder; see lz77.Lz77Compressor."""
+    def __init__(self, window_bits=DEFAULT_WINDOW_BITS, match_finder=DEFAULT_MATCH_FINDER, max_chain=None,
+                 level=None, reference_bits=REFERENCE_SIZE_BITS):
+        self.token_cost = lzss_token_cost(window_bits, reference_bits)
+        super().__init__(window_bits, match_finder, max_chain, level, reference_bits)
+
+    def write_token(self, t):
+        write_lzss_token(self.out, t, self.window_bits, self.reference_bits)
+
+
+class LzssDecompressor(Lz77Decompressor):
+    """Incremental LZSS decoder; see lz77.Lz77Decompressor."""
+    def read_token(self, encoded):
+        return read_lzss_token(encoded, self.window_bits, self.reference_bits)
+
+
+def lzssb_max_len(reference_bits=REFERENCE_SIZE_BITS, min_match=DEFAULT_MIN_MATCH):
+    return min_match + 2**reference_bits - 1
+
+
+def reference_size(window_bits, reference_bits):
+    """Bytes in a reference."""
+    return (window_bits + reference_bits + 7) // 8
+
+
+def lzssb_tokens(input_data, finder, start, end, min_match=DEFAULT_MIN_MATCH):
+    """Yield greedy tokens, (distance, length) for a reference or
+    (0, byte) for a literal, stopping at the first token that starts at
+    or after end."""
+    input_idx = start
+    while input_idx < end:
+        dist, length = finder.find(input_idx)
+        if length >= min_match:
+            yield dist, length
+            input_idx += length
         else:
-            out.append(Bits(uint=REFERENCE, length=1))
-            out.append(Bits(uint=t[0], length=window_bits))
-            out.append(Bits(uint=t[1], length=REFERENCE_SIZE_BITS))
-            out.append(Bits(uint=t[2], length=8))
-    return out.tobytes()
-
-
-def lzss_decode(encoded_data, window_bits=DEFAULT_WINDOW_BITS):
-    encoded = ConstBitStream(encoded_data)
-    tokens = []
-    try:
-        while True:
-            if encoded.read('uint:1') == LITERAL:
-                tokens.append((0, 0, encoded.read('uint:8')))
+            yield 0, input_data[input_idx]
+            input_idx += 1
+
+
+def lzssb_lazy_tokens(input_data, finder, start, end, min_match=DEFAULT_MIN_MATCH, reference_bytes=2):
+    """Like lzssb_tokens(), but a match is put off by a byte if the next
+    position has a longer one that makes up for the extra literal."""
+    literal_cost = 9
+    reference_cost = 8 * reference_bytes + 1
+    input_idx = start
+    match = finder.find(input_idx) if input_idx < end else None
+    while input_idx < end:
+        dist, length = match
+        if length >= min_match:
+            next_match = finder.find(input_idx + 1)
+            # Compare costs per byte covered
+            if (next_match[1] > length and
+                    (literal_cost + reference_cost) * length < reference_cost * (next_match[1] + 1)):
+                yield 0, input_data[input_idx]
+                input_idx += 1
+                match = next_match
+                continue
+            yield dist, length
+            input_idx += length
+        else:
+            yield 0, input_data[input_idx]
+            input_idx += 1
+        if input_idx < end:
+            match = finder.find(input_idx)
+
+
+def make_lzssb_parser(level=None, max_chain=None, min_match=DEFAULT_MIN_MATCH, reference_bytes=2):
+    """Return (parse, max_chain, nice_len) like lz77.make_parser(). The
+    optimal levels parse lazily here, with their deeper searches."""
+    parser, max_chain, nice_len = level_settings(level, max_chain)
+    if parser == 'greedy':
+        parse = partial(lzssb_tokens, min_match=min_match)
+    else:
+        parse = partial(lzssb_lazy_tokens, min_match=min_match, reference_bytes=reference_bytes)
+    return parse, max_chain, nice_len
+
+
+class LzssbWriter:
+    """Packs tokens into groups of eight behind a flag byte, with the
+    same take_bytes() and tobytes() as a BitWriter."""
+    def __init__(self, window_bits=DEFAULT_WINDOW_BITS, reference_bits=REFERENCE_SIZE_BITS,
+                 min_match=DEFAULT_MIN_MATCH):
+        self.reference_bits = reference_bits
+        self.reference_bytes = reference_size(window_bits, reference_bits)
+        self.min_match = min_match
+        self.out = bytearray()
+        self.group = bytearray()
+        self.flags = 0
+        self.count = 0
+
+    def write(self, t):
+        dist, length = t
+        self.flags <<= 1
+        if dist:
+            self.flags |= 1
+            reference = dist << self.reference_bits | (length - self.min_match)
+            self.group += reference.to_bytes(self.reference_bytes, 'big')
+        else:
+            self.group.append(length)
+        self.count += 1
+        if self.count == 8:
+            self.end_group()
+
+    def end_group(self):
+        self.out.append(self.flags << (8 - self.count))
+        self.out += self.group
+        self.group.clear()
+        self.flags = 0
+        self.count = 0
+
+    def take_bytes(self):
+        out = bytes(self.out)
+        self.out.clear()
+        return out
+
+    def tobytes(self):
+        if self.count:
+            self.end_group()
+        return self.take_bytes()
+
+
+def lzssb_encode(input_data, window_bits=DEFAULT_WINDOW_BITS,
+                 match_finder=DEFAULT_MATCH_FINDER, max_chain=None, stats=None,
+                 level=None, reference_bits=REFERENCE_SIZE_BITS, min_match=DEFAULT_MIN_MATCH, workers=1):
+    parse, max_chain, nice_len = make_lzssb_parser(level, max_chain, min_match,
+                                                   reference_size(window_bits, reference_bits))
+    finder_options = {'window_bits': window_bits, 'max_len': lzssb_max_len(reference_bits, min_match),
+                      'match_finder': match_finder, 'max_chain': max_chain, 'nice_len': nice_len}
+    tokens, probes = parse_tokens(input_data, parse, finder_options, workers, stats, 'lzssb.match_finding')
+    if stats is not None:
+        stats.count('lzssb.tokens', len(tokens))
+        stats.count('lzssb.matches', sum(1 for t in tokens if t[0]))
+        stats.count('match_finder.probes', probes)
+    writer = LzssbWriter(window_bits, reference_bits, min_match)
+    for t in tokens:
+        writer.write(t)
+    return writer.tobytes()
+
+
+def decode_lzssb_groups(data, decoded, window_bits, reference_bits, min_match, final=True):
+    """Decode the groups in data onto the end of decoded, returning how
+    many bytes of data were used. Unless final, a group is only decoded
+    once all of it is there."""
+    reference_bytes = reference_size(window_bits, reference_bits)
+    length_mask = 2**reference_bits - 1
+    n = len(data)
+    pos = 0
+    while pos < n:
+        flags = data[pos]
+        if not final:
+            num_references = bin(flags).count('1')
+            if pos + 9 + num_references * (reference_bytes - 1) > n:
+                break
+        pos += 1
+        for bit in (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+            if flags & bit:
+                if pos + reference_bytes > n:
+                    return n
+                reference = int.from_bytes(data[pos:pos+reference_bytes], 'big')
+                pos += reference_bytes
+                copy_match(decoded, reference >> reference_bits, (reference & length_mask) + min_match)
             else:
-                pfx_dist = encoded.read(f'uint:{window_bits}')
-                pfx_len = encoded.read(f'uint:{REFERENCE_SIZE_BITS}')
-                next_ch = encoded.read('uint:8')
-                tokens.append((pfx_dist, pfx_len, next_ch))
-    except ReadError:
-        pass
-    return lz77_decode_from_tokens(tokens)
+                if pos >= n:
+                    return n
+                decoded.append(data[pos])
+                pos += 1
+    return pos
+
+
+def lzssb_decode(encoded_data, window_bits=DEFAULT_WINDOW_BITS, reference_bits=REFERENCE_SIZE_BITS,
+                 min_match=DEFAULT_MIN_MATCH):
+    decoded = bytearray()
+    decode_lzssb_groups(encoded_data, decoded, window_bits, reference_bits, min_match)
+    return bytes(decoded)
+
+
+class LzssbCompressor(Lz77Compressor):
+    """Incremental encoder for the byte-aligned format; see
+    lz77.Lz77Compressor."""
+    def __init__(self, window_bits=DEFAULT_WINDOW_BITS, match_finder=DEFAULT_MATCH_FINDER, max_chain=None,
+                 level=None, reference_bits=REFERENCE_SIZE_BITS, min_match=DEFAULT_MIN_MATCH):
+        super().__init__(window_bits, match_finder, max_chain, None, reference_bits)
+        self.max_len = lzssb_max_len(reference_bits, min_match)
+        self.parse, self.max_chain, self.nice_len = make_lzssb_parser(
+            level, max_chain, min_match, reference_size(window_bits, reference_bits))
+        self.out = LzssbWriter(window_bits, reference_bits, min_match)
+
+    def write_token(self, t):
+        self.out.write(t)
+
+    @staticmethod
+    def token_len(t):
+        return t[1] if t[0] else 1
+
+
+class LzssbDecompressor:
+    """Incremental decoder for the byte-aligned format, in the style of
+    zlib.decompressobj()."""
+    def __init__(self, window_bits=DEFAULT_WINDOW_BITS, reference_bits=REFERENCE_SIZE_BITS,
+                 min_match=DEFAULT_MIN_MATCH):
+        self.window_bits = window_bits
+        self.reference_bits = reference_bits
+        self.min_match = min_match
+        self.input = bytearray()
+        self.history = bytearray()
+
+    def decode(self, final):
+        decoded = self.history
+        start = len(decoded)
+        used = decode_lzssb_groups(self.input, decoded, self.window_bits, self.reference_bits,
+                                   self.min_match, final)
+        del self.input[:used]
+        out = bytes(decoded[start:])
+        del decoded[:max(0, len(decoded) - (2**self.window_bits - 1))]
+        return out
+
+    def decompress(self, data):
+        self.input += data
+        return self.decode(final=False)
+
+    def flush(self):
+        return self.decode(final=True)
 
 
 if __name__ == '__main__':
@@ -56,3 +319,8 @@ if __name__ == '__main__':
     print(f'Original size: {len(input_data)}')
     print(f'Compressed size: {len(enc)}')
     print(f'Compression ratio: {len(enc) / len(input_data)}')
+
+    enc = lzssb_encode(input_data, window_bits=window_bits)
+    dec = lzssb_decode(enc, window_bits=window_bits)
+    print(f'Byte-aligned format matches original: {input_data == dec}, '
+          f'compressed size: {len(enc)}, ratio: {len(enc) / len(input_data)}')
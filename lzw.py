@@ -0,0 +1,171 @@
+"""LZW dictionary engines shared by the LZW codecs and the GIF decoder.
+
+On the encoding side the dictionary is a trie stored as a dict mapping
+(parent code << 8 | next byte) to a code, so extending a match by one
+byte is one lookup instead of hashing an ever-longer bytes key. On the
+decoding side each code is stored as its prefix code, last byte and
+length, and strings are expanded straight into the output buffer.
+"""
+
+from array import array
+from bitio import byte_view
+
+
+class LzwEncoder:
+    """Incremental LZW encoder producing (code, dictionary size) pairs.
+
+    The dictionary size is the number of entries when the code is
+    emitted, which is what decides the width of a variable-width code.
+    encode() yields codes for as much input as it can, and finish()
+    yields the rest. The match in progress is kept between calls.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.children = {}
+        self.next_code = 256
+        self.code = -1    # the match in progress
+        self.parent = -1  # the match in progress, less its last byte
+        self.last = 0     # the last byte of input
+
+    def encode(self, in_bytes):
+        in_bytes = byte_view(in_bytes)
+        children = self.children
+        code = self.code
+        parent = self.parent
+        for byte in in_bytes:
+            if code < 0:
+                code = byte
+                continue
+            child = children.get(code << 8 | byte)
+            if child is not None:
+                parent = code
+                code = child
+                continue
+
+            yield code, self.next_code
+
+            # If there's room in the dictionary, add the match plus one byte
+            if self.next_code < self.max_entries:
+                children[code << 8 | byte] = self.next_code
+                self.next_code += 1
+            code = byte
+            parent = -1
+        self.code = code
+        self.parent = parent
+        if len(in_bytes) > 0:
+            self.last = in_bytes[-1]
+
+    def finish(self):
+        if self.code < 0:
+            return
+        if self.parent >= 0:
+            # Like the original encoders, emit the last byte on its own,
+            # counting a dictionary entry for the match plus that byte
+            yield self.parent, self.next_code
+            if self.next_code < self.max_entries:
+                self.next_code += 1
+        yield self.last, self.next_code
+        self.code = -1
+        self.parent = -1
+
+
+def lzw_encode_codes(in_bytes, max_entries, encoder=None):
+    """Yield (code, dictionary size) for each code emitted for in_bytes.
+
+    Pass an encoder to look at its dictionary afterwards.
+    """
+    if encoder is None:
+        encoder = LzwEncoder(max_entries)
+    yield from encoder.encode(in_bytes)
+    yield from encoder.finish()
+
+
+def count_lzw(stats, codes, dict_size, max_entries, resets=0):
+    """Record the counters for one run of an LZW encoder or decoder."""
+    stats.count('lzw.codes', codes)
+    stats.count('lzw.dictionary_entries', dict_size)
+    if dict_size >= max_entries:
+        stats.count('lzw.dictionary_full')
+    if resets:
+        stats.count('lzw.resets', resets)
+
+
+class LzwDecoder:
+    """Expands LZW codes into a growing output buffer.
+
+    Codes below num_literals are single bytes. Codes between
+    num_literals and first_code are reserved for the caller (GIF's clear
+    and end codes) and must not be passed to decode(). The table is
+    three flat arrays indexed by code, so it never holds more than
+    max_entries entries whatever the size of the output.
+    """
+    def __init__(self, num_literals=256, first_code=256, max_entries=4096, out_size=0):
+        self.num_literals = num_literals
+        self.first_code = first_code
+        self.max_entries = max_entries
+        self.prefix = array('I', bytes(4 * max_entries))
+        self.last_byte = array('B', bytes(max_entries))
+        self.length = array('I', bytes(4 * max_entries))
+        for i in range(num_literals):
+            self.last_byte[i] = i
+            self.length[i] = 1
+        self.out = bytearray(out_size)
+        self.out_len = 0
+        self.reset()
+
+    def reset(self):
+        """Forget every code added since the start (or the last reset)."""
+        self.next_code = self.first_code
+        self.prev_code = -1
+        self.prev_first = 0
+
+    def add(self, prefix_code, byte):
+        c = self.next_code
+        self.prefix[c] = prefix_code
+        self.last_byte[c] = byte
+        self.length[c] = self.length[prefix_code] + 1
+        self.next_code = c + 1
+
+    def decode(self, code):
+        prev_code = self.prev_code
+        can_add = prev_code >= 0 and self.next_code < self.max_entries
+        if code >= self.next_code or self.length[code] == 0:
+            if not (can_add and code == self.next_code):
+                raise ValueError(f'Invalid LZW code {code}')
+            # The code being defined right now, which has to be the
+            # previous string plus its own first byte
+            self.add(prev_code, self.prev_first)
+            can_add = False
+
+        # Write the string backwards, following the prefix links
+        out = self.out
+        pos = self.out_len
+        end = pos + self.length[code]
+        if end > len(out):
+            out.extend(bytes(max(len(out), end - len(out))))
+        prefix = self.prefix
+        last_byte = self.last_byte
+        k = code
+        for i in range(end - 1, pos, -1):
+            out[i] = last_byte[k]
+            k = prefix[k]
+        out[pos] = k
+
+        if can_add:
+            self.add(prev_code, out[pos])
+        self.prev_code = code
+        self.prev_first = out[pos]
+        self.out_len = end
+
+    def result(self):
+        return bytes(self.out[:self.out_len])
+
+    def take_output(self):
+        """Return the output so far and start a new output buffer.
+
+        The dictionary doesn't refer back to earlier output, so a
+        streaming decoder only needs to hold one call's worth of it.
+        """
+        out = self.result()
+        self.out_len = 0
+        return out
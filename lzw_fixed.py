@@ -1,60 +1,83 @@
 """Fixed-width LZW encoding and decoding."""
 
-from bitstring import Bits, BitArray, ConstBitStream, ReadError
+from bitio import BitInputBuffer, BitReader, BitWriter, ReadError
+from lzw import count_lzw, lzw_encode_codes, LzwDecoder, LzwEncoder
+from stats import timed
 
 
 DEFAULT_CODE_LEN = 12
 
 
-def lzwf_encode(in_bytes, code_len=DEFAULT_CODE_LEN):
-    max_entries = 2**code_len
-    in_array = bytearray(in_bytes)
-    dictionary = {bytes([i]): i for i in range(256)}
-    out_array = BitArray()
-    while len(in_array) > 1:
-        # Find string s that's not in the dictionary
-        s = b''
-        while (s in dictionary or s == b'') and len(in_array) > 0:
-            s = s + bytes([in_array.pop(0)])
-        in_array.insert(0, s[-1])
-
-        # Emit code for the s[:-1], which is in the dictionary
-        out_array.append(Bits(uint=dictionary[s[:-1]], length=code_len))
-
-        # If there's room in the dictionary, add s
-        if len(dictionary) < max_entries:
-            dictionary[s] = len(dictionary)
-    # Emit code for final value
-    out_array.append(Bits(uint=dictionary[bytes([in_array.pop(0)])], length=code_len))
+def write_codes(in_bytes, encoder, code_len):
+    out_array = BitWriter()
+    for code, _ in lzw_encode_codes(in_bytes, encoder.max_entries, encoder):
+        out_array.write(code, code_len)
     return out_array.tobytes()
 
 
-def lzwf_decode(in_array, code_len=DEFAULT_CODE_LEN):
-    max_entries = 2**code_len
-    in_stream = ConstBitStream(in_array)
-    dictionary = {i: bytes([i]) for i in range(256)}
-    out_array = bytes()
+def lzwf_encode(in_bytes, code_len=DEFAULT_CODE_LEN, stats=None):
+    encoder = LzwEncoder(2**code_len)
+    out = timed(stats, 'lzwf.encode', write_codes, in_bytes, encoder, code_len)
+    if stats is not None:
+        count_lzw(stats, 8 * len(out) // code_len, encoder.next_code, encoder.max_entries)
+    return out
+
+
+def read_codes(in_array, decoder, code_len):
+    in_stream = BitReader(in_array)
     while True:
         try:
-            # Read a code
-            k = in_stream.read(f'uint:{code_len}')
-
-            # Look up code and emit value
-            v = dictionary[k]
-            out_array = out_array + v
-
-            # Add v + v_next[0] to dictionary
-            c = len(dictionary)
-            if c < max_entries:
-                k_next = in_stream.peek(f'uint:{code_len}')
-                if k_next < c:
-                    v_next = dictionary[k_next]
-                    dictionary[c] = v + v_next[:1]
-                else:
-                    dictionary[c] = v + v[:1]
+            decoder.decode(in_stream.read(code_len))
         except ReadError:
             break
-    return bytes(out_array)
+    return decoder.result()
+
+
+def lzwf_decode(in_array, code_len=DEFAULT_CODE_LEN, stats=None):
+    decoder = LzwDecoder(max_entries=2**code_len)
+    out = timed(stats, 'lzwf.decode', read_codes, in_array, decoder, code_len)
+    if stats is not None:
+        count_lzw(stats, 8 * len(in_array) // code_len, decoder.next_code, decoder.max_entries)
+    return out
+
+
+class LzwfCompressor:
+    """Incremental fixed-width LZW encoder, like zlib.compressobj()."""
+    def __init__(self, code_len=DEFAULT_CODE_LEN):
+        self.code_len = code_len
+        self.encoder = LzwEncoder(2**code_len)
+        self.out = BitWriter()
+
+    def compress(self, data):
+        for code, _ in self.encoder.encode(data):
+            self.out.write(code, self.code_len)
+        return self.out.take_bytes()
+
+    def flush(self):
+        for code, _ in self.encoder.finish():
+            self.out.write(code, self.code_len)
+        return self.out.tobytes()
+
+
+class LzwfDecompressor:
+    """Incremental fixed-width LZW decoder, like zlib.decompressobj()."""
+    def __init__(self, code_len=DEFAULT_CODE_LEN):
+        self.code_len = code_len
+        self.decoder = LzwDecoder(max_entries=2**code_len)
+        self.input = BitInputBuffer()
+
+    def decompress(self, data):
+        in_stream = self.input.feed(data)
+        while True:
+            try:
+                self.decoder.decode(in_stream.read(self.code_len))
+            except ReadError:
+                break
+        self.input.consume(in_stream.pos)
+        return self.decoder.take_output()
+
+    def flush(self):
+        return b''
 
 
 if __name__ == '__main__':
@@ -1,21 +1,20 @@
-"""Huffman-coded fixed-width LZW encoding and decoding."""
+"""Huffman-coded (or range-coded) fixed-width LZW encoding and decoding."""
 
-from bitstring import Bits, BitArray, ConstBitStream, ReadError
-from huffman import huffman_encode, huffman_decode
+from entropy import DEFAULT_CODER, entropy_encode, entropy_decode
 from lzw_fixed import lzwf_encode, lzwf_decode
 
 
 DEFAULT_SYMBOL_LEN = 12
 
 
-def lzw_huff_encode(in_bytes, symbol_len=DEFAULT_SYMBOL_LEN):
-    lzw_bytes = lzwf_encode(input_data, code_len=symbol_len)
-    return huffman_encode(lzw_bytes, symbol_bits=symbol_len)
+def lzw_huff_encode(in_bytes, symbol_len=DEFAULT_SYMBOL_LEN, coder=DEFAULT_CODER, stats=None):
+    lzw_bytes = lzwf_encode(in_bytes, code_len=symbol_len, stats=stats)
+    return entropy_encode(lzw_bytes, symbol_bits=symbol_len, coder=coder, stats=stats)
 
 
-def lzw_huff_decode(data, num_symbols, serialized_tree, symbol_len=DEFAULT_SYMBOL_LEN):
-    lzw_data = huffman_decode(data, num_symbols, serialized_tree, symbol_bits=symbol_len)
-    return lzwf_decode(lzw_data, code_len=symbol_len)
+def lzw_huff_decode(data, num_symbols, serialized_tree, symbol_len=DEFAULT_SYMBOL_LEN, stats=None):
+    lzw_data = entropy_decode(data, num_symbols, serialized_tree, symbol_bits=symbol_len, stats=stats)
+    return lzwf_decode(lzw_data, code_len=symbol_len, stats=stats)
 
 
 if __name__ == '__main__':
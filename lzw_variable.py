@@ -1,67 +1,97 @@
 """Variable-width LZW encoding and decoding."""
 
-from bitstring import Bits, BitArray, ConstBitStream, ReadError
+from bitio import BitInputBuffer, BitReader, BitWriter, ReadError
+from lzw import count_lzw, lzw_encode_codes, LzwDecoder, LzwEncoder
+from stats import timed
 
 MAX_CODE_LEN = 12
 
 
-def lzwv_encode(in_bytes):
-    max_entries = 2**MAX_CODE_LEN
-    in_array = bytearray(in_bytes)
-    dictionary = {bytes([i]): i for i in range(256)}
-    code_len = 9
-    out_array = BitArray()
-    while len(in_array) > 1:
-        # Find string s that's not in the dictionary
-        s = b''
-        while (s in dictionary or s == b'') and len(in_array) > 0:
-            s = s + bytes([in_array.pop(0)])
-        in_array.insert(0, s[-1])
-
-        # Emit code for the s[:-1], which is in the dictionary
-        out_array.append(Bits(uint=dictionary[s[:-1]], length=code_len))
-
-        # If there's room in the dictionary, add s
-        c = len(dictionary)
-        if c < max_entries:
-            dictionary[s] = c
-            # If just added max value for code len, increment it.
-            if c == 2**code_len - 1:
-                code_len = min(MAX_CODE_LEN, code_len + 1)
-    # Emit code for final value
-    out_array.append(Bits(uint=dictionary[bytes([in_array.pop(0)])], length=code_len))
-    return out_array.tobytes()
-
-
-def lzwv_decode(in_array):
-    max_entries = 2**MAX_CODE_LEN
-    in_stream = ConstBitStream(in_array)
-    dictionary = {i: bytes([i]) for i in range(256)}
-    code_len = 9
-    out_array = bytearray()
+def encoder_code_len(dict_size):
+    # Codes widen once the dictionary has used up the current width
+    return min(MAX_CODE_LEN, max(9, dict_size.bit_length()))
+
+
+def decoder_code_len(next_code):
+    # The encoder widens codes one entry before the decoder's
+    # dictionary catches up, as the decoder adds each entry a code late
+    return min(MAX_CODE_LEN, max(9, (next_code + 1).bit_length()))
+
+
+def write_codes(in_bytes, encoder):
+    """Returns the encoded data and the number of codes."""
+    out_array = BitWriter()
+    codes = 0
+    for code, dict_size in lzw_encode_codes(in_bytes, encoder.max_entries, encoder):
+        out_array.write(code, encoder_code_len(dict_size))
+        codes += 1
+    return out_array.tobytes(), codes
+
+
+def lzwv_encode(in_bytes, stats=None):
+    encoder = LzwEncoder(2**MAX_CODE_LEN)
+    out, codes = timed(stats, 'lzwv.encode', write_codes, in_bytes, encoder)
+    if stats is not None:
+        count_lzw(stats, codes, encoder.next_code, encoder.max_entries)
+    return out
+
+
+def read_codes(in_array, decoder):
+    """Returns the decoded data and the number of codes."""
+    in_stream = BitReader(in_array)
+    codes = 0
     while True:
         try:
-            # Read a code
-            k = in_stream.read(f'uint:{code_len}')
-
-            # Look up code and emit value
-            v = dictionary[k]
-            out_array += v
-
-            # Add v + v_next[0] to dictionary
-            c = len(dictionary)
-            if c < max_entries:
-                if c == 2**code_len - 1:
-                    code_len = min(MAX_CODE_LEN, code_len + 1)
-                k_next = in_stream.peek(f'uint:{code_len}')
-                if k_next < c:
-                    v_next = dictionary[k_next]
-                    dictionary[c] = v + v_next[:1]
-                else:
-                    dictionary[c] = v + v[:1]
+            decoder.decode(in_stream.read(decoder_code_len(decoder.next_code)))
         except ReadError:
             break
-    return bytes(out_array)
+        codes += 1
+    return decoder.result(), codes
+
+
+def lzwv_decode(in_array, stats=None):
+    decoder = LzwDecoder(max_entries=2**MAX_CODE_LEN)
+    out, codes = timed(stats, 'lzwv.decode', read_codes, in_array, decoder)
+    if stats is not None:
+        count_lzw(stats, codes, decoder.next_code, decoder.max_entries)
+    return out
+
+
+class LzwvCompressor:
+    """Incremental variable-width LZW encoder, like zlib.compressobj()."""
+    def __init__(self):
+        self.encoder = LzwEncoder(2**MAX_CODE_LEN)
+        self.out = BitWriter()
+
+    def compress(self, data):
+        for code, dict_size in self.encoder.encode(data):
+            self.out.write(code, encoder_code_len(dict_size))
+        return self.out.take_bytes()
+
+    def flush(self):
+        for code, dict_size in self.encoder.finish():
+            self.out.write(code, encoder_code_len(dict_size))
+        return self.out.tobytes()
+
+
+class LzwvDecompressor:
+    """Incremental variable-width LZW decoder, like zlib.decompressobj()."""
+    def __init__(self):
+        self.decoder = LzwDecoder(max_entries=2**MAX_CODE_LEN)
+        self.input = BitInputBuffer()
+
+    def decompress(self, data):
+        in_stream = self.input.feed(data)
+        while True:
+            try:
+                self.decoder.decode(in_stream.read(decoder_code_len(self.decoder.next_code)))
+            except ReadError:
+                break
+        self.input.consume(in_stream.pos)
+        return self.decoder.take_output()
+
+    def flush(self):
+        return b''
 
 
 if __name__ == '__main__':
@@ -0,0 +1,262 @@
+"""Match finders for the LZ77 family of encoders.
+
+A match finder is built over the whole input and answers "what is the
+longest earlier match for the string starting here?" for increasing
+positions. Every finder returns the same answer as the original naive
+search with bytes.find(): the longest match that starts inside the
+window, and of those the one furthest back. Limiting max_chain, or
+giving a nice_len at which the hash chain finder stops looking for
+anything longer, trades some of that away for speed.
+"""
+
+from bisect import bisect_left
+from collections import deque
+
+
+MIN_HASH_MATCH = 3
+
+
+class NaiveMatchFinder:
+    """Repeated bytes.find() over the window, like the original encoder."""
+    def __init__(self, data, window_bits, max_len, max_chain=None, nice_len=None):
+        # Needs data.find(), which memoryviews don't have
+        self.data = data if hasattr(data, 'find') else bytes(data)
+        self.max_window_len = 2**window_bits - 1
+        self.max_len = max_len
+        self.probes = 0  # calls to find()
+
+    def find(self, pos):
+        data = self.data
+        win_start = max(0, pos - self.max_window_len)
+        best_dist = 0
+        best_len = 0
+        length = 1
+        for length in range(2, min(self.max_len, len(data) - pos - 1) + 1):
+            idx = data.find(data[pos:pos+length], win_start)
+            if not win_start <= idx < pos:
+                break
+            best_dist = pos - idx
+            best_len = length
+        self.probes += length - 1
+        return best_dist, best_len
+
+
+class HashChainMatchFinder:
+    """Hash chains keyed on 3-byte prefixes.
+
+    Matches of three or more bytes are found by walking the chain of
+    earlier positions with the same 3-byte prefix. Two-byte matches
+    only matter when there's no longer one, so they come from a queue
+    per 2-byte prefix holding the positions still in the window.
+
+    The walk stops at the first match of the longest length possible.
+    Without a max_chain, the furthest-back copy of that string is then
+    found with bytes.find(), rather than by walking the rest of the
+    chain, which on long runs holds every position in the window.
+    """
+    def __init__(self, data, window_bits, max_len, max_chain=None, nice_len=None):
+        self.data = data
+        # For finding the furthest-back copy of a whole match
+        self.searchable = data if hasattr(data, 'find') else bytes(data)
+        self.max_window_len = 2**window_bits - 1
+        self.max_len = max_len
+        self.max_chain = max_chain
+        self.nice_len = nice_len or max_len + 1
+        self.mask = 2**window_bits - 1
+        self.head = {}
+        self.prev = [-1] * 2**window_bits
+        self.pairs = {}
+        self.next_insert = 0
+        self.probes = 0  # earlier positions compared against
+
+    def insert_up_to(self, pos):
+        data = self.data
+        last_triple = len(data) - MIN_HASH_MATCH
+        max_window_len = self.max_window_len
+        head = self.head
+        prev = self.prev
+        pairs = self.pairs
+        mask = self.mask
+        for j in range(self.next_insert, pos):
+            pair = data[j] << 8 | data[j+1]
+            queue = pairs.get(pair)
+            if queue is None:
+                queue = pairs[pair] = deque()
+            else:
+                while queue and queue[0] < j + 1 - max_window_len:
+                    queue.popleft()
+            queue.append(j)
+            if j <= last_triple:
+                key = pair << 8 | data[j+2]
+                prev[j & mask] = head.get(key, -1)
+                head[key] = j
+        self.next_insert = max(self.next_insert, pos)
+
+    def find(self, pos):
+        data = self.data
+        max_len = min(self.max_len, len(data) - pos - 1)
+        if max_len < 2:
+            return 0, 0
+        self.insert_up_to(pos)
+        win_start = max(0, pos - self.max_window_len)
+
+        best_pos = -1
+        best_len = 0
+        if max_len >= MIN_HASH_MATCH:
+            key = data[pos] << 16 | data[pos+1] << 8 | data[pos+2]
+            prev = self.prev
+            mask = self.mask
+            chain_left = self.max_chain
+            nice_len = self.nice_len
+            probes = 0
+            j = self.head.get(key, -1)
+            while j >= win_start:
+                probes += 1
+                length = MIN_HASH_MATCH
+                while length < max_len and data[j+length] == data[pos+length]:
+                    length += 1
+                # Walking backwards, so ties move the match further back
+                if length >= best_len:
+                    best_pos = j
+                    best_len = length
+                    if length == max_len:
+                        if chain_left is None:
+                            best_pos = self.searchable.find(data[pos:pos+max_len], win_start, j + max_len)
+                        break
+                    if length >= nice_len:
+                        break
+                if chain_left is not None:
+                    chain_left -= 1
+                    if chain_left <= 0:
+                        break
+                j = prev[j & mask]
+            self.probes += probes
+        if best_len == 0:
+            self.probes += 1
+            queue = self.pairs.get(data[pos] << 8 | data[pos+1])
+            if queue:
+                while queue and queue[0] < win_start:
+                    queue.popleft()
+                if queue:
+                    best_pos = queue[0]
+                    best_len = 2
+        if best_len == 0:
+            return 0, 0
+        return pos - best_pos, best_len
+
+
+class SuffixArrayMatchFinder:
+    """Sorted index of the first max_len bytes at each position.
+
+    The input is indexed a window-sized chunk at a time, along with the
+    window before it, so lookups only see positions that could match.
+    Equal prefixes are grouped, with each group's positions in
+    ascending order, so the furthest-back candidate in the window is a
+    bisect away. Searching walks outwards through neighbouring groups
+    while their common prefix with the current position is still long
+    enough to matter. max_chain caps the number of groups visited.
+    """
+    def __init__(self, data, window_bits, max_len, max_chain=None, nice_len=None):
+        self.data = data
+        self.max_window_len = 2**window_bits - 1
+        self.chunk_len = 2**window_bits
+        self.max_len = max_len
+        self.max_chain = max_chain
+        self.chunk_end = 0
+        self.probes = 0  # groups looked at
+
+    def index_chunk(self, pos):
+        data = self.data
+        max_len = self.max_len
+        chunk_start = pos - pos % self.chunk_len
+        self.chunk_end = min(len(data), chunk_start + self.chunk_len)
+        self.index_start = max(0, chunk_start - self.max_window_len)
+        # bytes() so that slices of a memoryview can be compared
+        order = sorted(range(self.index_start, self.chunk_end),
+                       key=lambda j: bytes(data[j:j+max_len]))
+        self.group_of = [0] * (self.chunk_end - self.index_start)
+        self.groups = []
+        self.group_lcp = []  # common prefix length with the previous group
+        prev_key = None
+        for j in order:
+            key = bytes(data[j:j+max_len])
+            if key != prev_key:
+                self.group_lcp.append(common_prefix_len(prev_key, key) if prev_key is not None else 0)
+                self.groups.append([])
+                prev_key = key
+            self.group_of[j - self.index_start] = len(self.groups) - 1
+            self.groups[-1].append(j)
+
+    def earliest_in_window(self, group, win_start, pos):
+        positions = self.groups[group]
+        k = bisect_left(positions, win_start)
+        if k < len(positions) and positions[k] < pos:
+            return positions[k]
+        return -1
+
+    def find(self, pos):
+        max_len = min(self.max_len, len(self.data) - pos - 1)
+        if max_len < 2:
+            return 0, 0
+        if pos >= self.chunk_end:
+            self.index_chunk(pos)
+        win_start = max(0, pos - self.max_window_len)
+        group = self.group_of[pos - self.index_start]
+        groups_left = self.max_chain
+
+        best_pos = self.earliest_in_window(group, win_start, pos)
+        best_len = max_len if best_pos >= 0 else 0
+        probes = 1
+        for step in (-1, 1):
+            lcp = max_len
+            g = group
+            while True:
+                if step < 0:
+                    if g == 0:
+                        break
+                    lcp = min(lcp, self.group_lcp[g])
+                    g -= 1
+                else:
+                    if g + 1 >= len(self.groups):
+                        break
+                    g += 1
+                    lcp = min(lcp, self.group_lcp[g])
+                if lcp < max(2, best_len):
+                    break
+                if groups_left is not None:
+                    if groups_left <= 0:
+                        break
+                    groups_left -= 1
+                probes += 1
+                j = self.earliest_in_window(g, win_start, pos)
+                if j >= 0 and (lcp > best_len or j < best_pos):
+                    best_pos = j
+                    best_len = lcp
+        self.probes += probes
+        if best_len == 0:
+            return 0, 0
+        return pos - best_pos, best_len
+
+
+def common_prefix_len(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+MATCH_FINDERS = {
+    'naive': NaiveMatchFinder,
+    'hash_chain': HashChainMatchFinder,
+    'suffix_array': SuffixArrayMatchFinder,
+}
+
+DEFAULT_MATCH_FINDER = 'hash_chain'
+
+
+def make_match_finder(data, window_bits, max_len, match_finder=DEFAULT_MATCH_FINDER, max_chain=None,
+                      nice_len=None):
+    if match_finder not in MATCH_FINDERS:
+        raise ValueError(f'Unknown match finder: {match_finder}')
+    return MATCH_FINDERS[match_finder](data, window_bits, max_len, max_chain=max_chain, nice_len=nice_len)
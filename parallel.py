@@ -0,0 +1,29 @@
+"""Process-pool helpers for the block-parallel codecs."""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def ordered_map(fn, items, workers=None, max_in_flight=None):
+    """Yield fn(item) for each item, computed in a process pool.
+
+    Results come back in the order of items. At most max_in_flight
+    items (by default twice the number of workers) are submitted ahead
+    of the result being waited on, so memory stays bounded however many
+    items there are.
+    """
+    workers = workers or default_workers()
+    max_in_flight = max_in_flight or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+            pending.append(pool.submit(fn, item))
+        while pending:
+            yield pending.popleft().result()
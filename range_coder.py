@@ -0,0 +1,340 @@
+"""Range coding with order-0 models, as an alternative to Huffman coding.
+
+Huffman codes are whole numbers of bits, so a symbol that turns up 95%
+of the time, like index 0 after MTF, still costs a full bit. A range
+coder gets within a fraction of a percent of the entropy instead.
+
+This is the carry-propagating 32-bit coder from LZMA, using integers
+only. Frequencies are scaled to add up to exactly 2**PROB_BITS, so the
+range is divided with a shift.
+
+There are two models. The static one counts the symbols first and
+sends their counts, roughly, as levels. The adaptive one sends nothing and
+learns as it goes, on the same schedule as adaptive Huffman coding:
+both sides rebuild their frequency tables after ADAPTIVE_FIRST_REBUILD
+symbols and then at doubling intervals.
+
+The functions mirror huffman_encode() and huffman_decode(), returning
+and taking (data, num_symbols, serialized_model). Models start with a
+header byte from the same space as Huffman tables (see huffman.py), so
+a decoder can tell which coder was used.
+"""
+
+from bitio import BitReader, BitWriter
+from huffman import (ADAPTIVE_FIRST_REBUILD, ADAPTIVE_MAX_REBUILD, ADAPTIVE_MAX_TOTAL,
+                     VERSIONED_HEADER, pack_symbols, unpack_symbols)
+from stats import timed
+
+
+PROB_BITS = 16
+PROB_TOTAL = 2**PROB_BITS
+MAX_SYMBOL_BITS = PROB_BITS
+TOP = 2**24
+
+STATIC_MODEL = VERSIONED_HEADER | 2
+ADAPTIVE_MODEL = VERSIONED_HEADER | 3
+
+# The static model sends each symbol's count to within a quarter of a
+# bit, as a level. LEVEL_MANTISSAS are 2**(i/4) in units of 1/256, with
+# 2**1 at the end for rounding up.
+LEVEL_BITS = 7
+LEVEL_BITS_BITS = 3
+LEVEL_MANTISSAS = (256, 304, 362, 431, 512)
+
+
+def is_range_model(serialized):
+    return len(serialized) > 0 and serialized[0] in (STATIC_MODEL, ADAPTIVE_MODEL)
+
+
+def scale_counts(counts):
+    """Scale a list of counts, indexed by symbol, to frequencies that
+    add up to PROB_TOTAL, keeping every symbol that was seen."""
+    total = sum(counts)
+    seen = sum(1 for c in counts if c)
+    spare = PROB_TOTAL - seen
+    freqs = [1 + c * spare // total if c else 0 for c in counts]
+    # Rounding down leaves a little over, which goes to the commonest
+    freqs[max(range(len(freqs)), key=freqs.__getitem__)] += PROB_TOTAL - sum(freqs)
+    return freqs
+
+
+def cumulative(freqs):
+    starts = []
+    start = 0
+    for f in freqs:
+        starts.append(start)
+        start += f
+    return starts
+
+
+def make_symbol_table(freqs):
+    """A list mapping each of the PROB_TOTAL values to its symbol."""
+    table = []
+    for s, f in enumerate(freqs):
+        if f:
+            table += [s] * f
+    return table
+
+
+def count_level(count):
+    """Quantize a count to a level, 0 for none and otherwise 1 plus
+    four times its log2, rounded."""
+    if count == 0:
+        return 0
+    exponent = count.bit_length() - 1
+    # count / 2**exponent in units of 1/256, in [256, 512)
+    mantissa = (count << 8) >> exponent
+    step = min(range(5), key=lambda i: abs(LEVEL_MANTISSAS[i] - mantissa))
+    return min(1 + 4 * exponent + step, 2**LEVEL_BITS - 1)
+
+
+def level_weight(level):
+    """Roughly the count that count_level() turns into level."""
+    if level == 0:
+        return 0
+    exponent, step = divmod(level - 1, 4)
+    return (LEVEL_MANTISSAS[step] << exponent) >> 8
+
+
+def model_frequencies(levels):
+    return scale_counts([level_weight(level) for level in levels])
+
+
+def serialize_levels(levels):
+    """The header, the number of bits the largest level needs, then
+    runs of equal levels, each as the level in that many bits and the
+    run length as an exponential-Golomb code."""
+    out = BitWriter()
+    out.write(STATIC_MODEL, 8)
+    level_bits = max(levels, default=0).bit_length()
+    out.write(level_bits, LEVEL_BITS_BITS)
+    run_start = 0
+    for i in range(1, len(levels) + 1):
+        if i == len(levels) or levels[i] != levels[run_start]:
+            out.write(levels[run_start], level_bits)
+            out.write_ue(i - run_start - 1)
+            run_start = i
+    return out.tobytes()
+
+
+def deserialize_levels(serialized, symbol_bits):
+    bits = BitReader(serialized)
+    header = bits.read(8)
+    if header != STATIC_MODEL:
+        raise ValueError(f'Unknown range coder model header: {header:#x}')
+    level_bits = bits.read(LEVEL_BITS_BITS)
+    levels = []
+    while len(levels) < 2**symbol_bits:
+        level = bits.read(level_bits)
+        levels += [level] * (bits.read_ue() + 1)
+    return levels
+
+
+class RangeEncoder:
+    def __init__(self):
+        self.low = 0
+        self.range = 0xFFFFFFFF
+        self.cache = 0
+        self.cache_size = 1
+        self.out = bytearray()
+
+    def encode(self, symbols, starts, freqs):
+        low, rng, cache, cache_size = self.low, self.range, self.cache, self.cache_size
+        out = self.out
+        for s in symbols:
+            r = rng >> PROB_BITS
+            low += r * starts[s]
+            rng = r * freqs[s]
+            while rng < TOP:
+                rng <<= 8
+                # shift_low(), inlined. Bytes of 0xff are held back
+                # until we know whether a carry will ripple through them
+                if low < 0xFF000000 or low > 0xFFFFFFFF:
+                    carry = low >> 32
+                    out.append((cache + carry) & 0xFF)
+                    if cache_size > 1:
+                        out += bytes([(0xFF + carry) & 0xFF]) * (cache_size - 1)
+                    cache = (low >> 24) & 0xFF
+                    cache_size = 0
+                cache_size += 1
+                low = (low & 0xFFFFFF) << 8
+        self.low, self.range, self.cache, self.cache_size = low, rng, cache, cache_size
+
+    def shift_low(self):
+        low = self.low
+        if low < 0xFF000000 or low > 0xFFFFFFFF:
+            carry = low >> 32
+            self.out.append((self.cache + carry) & 0xFF)
+            self.out += bytes([(0xFF + carry) & 0xFF]) * (self.cache_size - 1)
+            self.cache = (low >> 24) & 0xFF
+            self.cache_size = 0
+        self.cache_size += 1
+        self.low = (low & 0xFFFFFF) << 8
+
+    def finish(self):
+        for _ in range(5):
+            self.shift_low()
+        return bytes(self.out)
+
+
+class RangeDecoder:
+    def __init__(self, data):
+        # Padded, since the coder reads a few bytes ahead
+        self.data = bytes(data) + bytes(4)
+        self.code = int.from_bytes(self.data[1:5], 'big')
+        self.pos = 5
+        self.range = 0xFFFFFFFF
+
+    def decode(self, num_symbols, starts, freqs, symbol_table):
+        return list(self.iter_decode(num_symbols, starts, freqs, symbol_table))
+
+    def iter_decode(self, num_symbols, starts, freqs, symbol_table):
+        """Yield num_symbols symbols as they're decoded. The decoder's
+        state is only brought up to date once they've all been taken."""
+        code, rng, pos = self.code, self.range, self.pos
+        data = self.data
+        for _ in range(num_symbols):
+            r = rng >> PROB_BITS
+            s = symbol_table[code // r]
+            yield s
+            code -= r * starts[s]
+            rng = r * freqs[s]
+            while rng < TOP:
+                code = (code << 8) | (data[pos] if pos < len(data) else 0)
+                pos += 1
+                rng <<= 8
+        self.code, self.range, self.pos = code, rng, pos
+
+
+def adaptive_segments(num_symbols):
+    """Yield (start, end) of the runs of symbols coded with one table."""
+    start = 0
+    interval = ADAPTIVE_FIRST_REBUILD
+    while start < num_symbols:
+        yield start, min(start + interval, num_symbols)
+        start += interval
+        interval = min(2 * interval, ADAPTIVE_MAX_REBUILD)
+
+
+def update_counts(counts, symbols):
+    for s in symbols:
+        counts[s] += 1
+    if sum(counts) > ADAPTIVE_MAX_TOTAL:
+        for s, c in enumerate(counts):
+            counts[s] = (c + 1) // 2
+
+
+def check_symbol_bits(symbol_bits):
+    if symbol_bits > MAX_SYMBOL_BITS:
+        raise ValueError(f'Range coding supports symbols of up to {MAX_SYMBOL_BITS} bits')
+
+
+def encode_static(symbols, symbol_bits):
+    counts = [0] * 2**symbol_bits
+    for s in symbols:
+        counts[s] += 1
+    levels = [count_level(c) for c in counts]
+    if not symbols:
+        return b'', serialize_levels(levels)
+    freqs = model_frequencies(levels)
+    encoder = RangeEncoder()
+    encoder.encode(symbols, cumulative(freqs), freqs)
+    return encoder.finish(), serialize_levels(levels)
+
+
+def encode_adaptive(symbols, symbol_bits, stats=None):
+    # Every symbol starts with a count of one, so nothing needs escaping
+    counts = [1] * 2**symbol_bits
+    encoder = RangeEncoder()
+    for start, end in adaptive_segments(len(symbols)):
+        freqs = scale_counts(counts)
+        segment = symbols[start:end]
+        encoder.encode(segment, cumulative(freqs), freqs)
+        update_counts(counts, segment)
+        if stats is not None:
+            stats.count('range.rebuilds')
+    return encoder.finish(), bytes([ADAPTIVE_MODEL])
+
+
+def decode_static(data, decoded_len, serialized_model, symbol_bits):
+    return list(iter_decode_static(data, decoded_len, serialized_model, symbol_bits))
+
+
+def iter_decode_static(data, decoded_len, serialized_model, symbol_bits):
+    levels = deserialize_levels(serialized_model, symbol_bits)
+    if decoded_len == 0:
+        return iter(())
+    freqs = model_frequencies(levels)
+    decoder = RangeDecoder(data)
+    return decoder.iter_decode(decoded_len, cumulative(freqs), freqs, make_symbol_table(freqs))
+
+
+def decode_adaptive(data, decoded_len, symbol_bits, stats=None):
+    return list(iter_decode_adaptive(data, decoded_len, symbol_bits, stats))
+
+
+def iter_decode_adaptive(data, decoded_len, symbol_bits, stats=None):
+    """Yield the symbols a segment at a time, as each segment's counts
+    are needed before the next one can be decoded."""
+    counts = [1] * 2**symbol_bits
+    decoder = RangeDecoder(data)
+    for start, end in adaptive_segments(decoded_len):
+        freqs = scale_counts(counts)
+        segment = decoder.decode(end - start, cumulative(freqs), freqs, make_symbol_table(freqs))
+        update_counts(counts, segment)
+        if stats is not None:
+            stats.count('range.rebuilds')
+        yield from segment
+
+
+def range_encode(data, symbol_bits=8, adaptive=False, stats=None):
+    symbols = unpack_symbols(data, symbol_bits)
+    return range_encode_symbols(symbols, symbol_bits, adaptive, stats)
+
+
+def range_encode_symbols(symbols, symbol_bits=8, adaptive=False, stats=None):
+    """Like range_encode(), but takes a list of symbols rather than bytes."""
+    check_symbol_bits(symbol_bits)
+    if adaptive:
+        data, model = timed(stats, 'range.encode', encode_adaptive, symbols, symbol_bits, stats)
+    else:
+        data, model = timed(stats, 'range.encode', encode_static, symbols, symbol_bits)
+    return data, len(symbols), model
+
+
+def range_decode(data, decoded_len, serialized_model, symbol_bits=8, stats=None):
+    symbols = range_decode_symbols(data, decoded_len, serialized_model, symbol_bits, stats)
+    return pack_symbols(symbols, symbol_bits)
+
+
+def range_decode_symbols(data, decoded_len, serialized_model, symbol_bits=8, stats=None):
+    """Like range_decode(), but returns a list of symbols rather than bytes."""
+    check_symbol_bits(symbol_bits)
+    if serialized_model[:1] == bytes([ADAPTIVE_MODEL]):
+        return timed(stats, 'range.decode', decode_adaptive, data, decoded_len, symbol_bits, stats)
+    return timed(stats, 'range.decode', decode_static, data, decoded_len, serialized_model, symbol_bits)
+
+
+def range_iter_symbols(data, decoded_len, serialized_model, symbol_bits=8):
+    """Like range_decode_symbols(), but yields the symbols as they're
+    decoded rather than making a list of them."""
+    check_symbol_bits(symbol_bits)
+    if serialized_model[:1] == bytes([ADAPTIVE_MODEL]):
+        return iter_decode_adaptive(data, decoded_len, symbol_bits)
+    return iter_decode_static(data, decoded_len, serialized_model, symbol_bits)
+
+
+if __name__ == '__main__':
+    from huffman import huffman_encode
+
+    with open('test.dat', 'rb') as f:
+        input_data = f.read()
+
+    huff_data, _, tree = huffman_encode(input_data)
+    print(f'Huffman compressed size: {len(huff_data) + len(tree)}')
+    for adaptive in (False, True):
+        enc, length, model = range_encode(input_data, adaptive=adaptive)
+        dec = range_decode(enc, length, model)
+        assert input_data == dec
+        print(f"{'Adaptive' if adaptive else 'Static'} compressed size: {len(enc) + len(model)}, "
+              f'ratio: {(len(enc) + len(model)) / len(input_data)}')
@@ -3,14 +3,64 @@
 Uses some, but not all, of bzip2's "stack":
   - Burrows-Wheeler transform
   - Move-to-front transform
-  - Run-length encoding, but a simpler implementation based on PCX
-  - Huffman coding
+  - Run-length encoding, either bzip2's RUNA/RUNB zero-run coding or a
+    simpler implementation based on PCX
+  - Huffman coding, or range coding (see entropy.py)
 """
-from bitstring import Bits, BitArray, ConstBitStream, ReadError
-from huffman import huffman_encode, huffman_decode
+from array import array
+from bitio import BitInputBuffer, BitReader, BitWriter, ReadError
+from functools import partial
+from entropy import (DEFAULT_CODER, entropy_encode, entropy_encode_symbols, entropy_decode,
+                     entropy_decode_symbols)
+from parallel import ordered_map
+from stats import Stats, timed
+
+
+def sort_rotations(in_bytes):
+    """Sort the rotations of in_bytes by prefix doubling.
+
+    Returns (order, rank): order lists rotation start positions in
+    sorted order, and rank[i] is the position in order of the first
+    rotation equal to the one starting at i. Each pass sorts on pairs of
+    ranks from the previous pass, doubling the length compared, and
+    stops as soon as every rank is distinct.
+    """
+    n = len(in_bytes)
+    order = sorted(range(n), key=in_bytes.__getitem__)
+    rank = [0] * n
+    for pos in range(1, n):
+        same = in_bytes[order[pos]] == in_bytes[order[pos - 1]]
+        rank[order[pos]] = rank[order[pos - 1]] if same else pos
+    shift = n.bit_length()
+    k = 1
+    while k < n:
+        key = [r << shift | r2 for r, r2 in zip(rank, rank[k:] + rank[:k])]
+        order.sort(key=key.__getitem__)
+        distinct = True
+        prev_key = key[order[0]]
+        rank[order[0]] = 0
+        for pos in range(1, n):
+            i = order[pos]
+            if key[i] == prev_key:
+                rank[i] = rank[order[pos - 1]]
+                distinct = False
+            else:
+                rank[i] = pos
+                prev_key = key[i]
+        if distinct:
+            break
+        k *= 2
+    return order, rank
 
 
 def burrows_wheeler_transform(in_bytes):
+    order, rank = sort_rotations(in_bytes)
+    out_bytes = bytes(in_bytes[i - 1] for i in order)
+    return out_bytes, rank[0]
+
+
+# Not used; builds and sorts every rotation, which is O(n^2) in memory
+def burrows_wheeler_transform_naive(in_bytes):
     string = in_bytes
     rotations = []
     for _ in range(len(in_bytes)):
@@ -35,17 +85,25 @@ def burrows_wheeler_reverse_transform_naive(in_bytes, orig_index):
 
 
 def burrows_wheeler_reverse_transform(in_bytes, orig_index):
-    indexes = [[] for _ in range(256)]
-    for i in range(len(in_bytes)):
-        c = in_bytes[i]
-        indexes[c].append(i)
-    flat_indexes = [i for L in indexes for i in L]
-
-    out_bytes = bytearray()
-    i = flat_indexes[orig_index]
-    while len(out_bytes) < len(in_bytes):
-        out_bytes.append(in_bytes[i])
-        i = flat_indexes[i]
+    # Where each byte value's occurrences start in the sorted first column
+    starts = [0] * 256
+    total = 0
+    for c in range(256):
+        starts[c] = total
+        total += in_bytes.count(c)
+
+    # next_index[k] is the position in the last column of the k-th byte
+    # of the first column, which is the LF mapping run backwards
+    next_index = array('I', bytes(4 * len(in_bytes)))
+    for i, c in enumerate(in_bytes):
+        next_index[starts[c]] = i
+        starts[c] += 1
+
+    out_bytes = bytearray(len(in_bytes))
+    i = next_index[orig_index]
+    for k in range(len(in_bytes)):
+        out_bytes[k] = in_bytes[i]
+        i = next_index[i]
 
     return bytes(out_bytes)
 
@@ -62,135 +120,321 @@ def move_to_front_transform(in_bytes):
 
 
 def move_to_front_reverse_transform(in_bytes):
-    symbols = [i for i in range(256)]
-    out = bytearray()
-    for i in in_bytes:
+    symbols = bytearray(range(256))
+    out = bytearray(len(in_bytes))
+    for k, i in enumerate(in_bytes):
         c = symbols[i]
-        symbols.remove(c)
-        symbols.insert(0, c)
-        out.append(c)  
+        if i:
+            del symbols[i]
+            symbols.insert(0, c)
+        out[k] = c
     return bytes(out)
 
 
 MAX_RUN_LENGTH = 127
 
 def run_length_encode(in_bytes):
-    in_data = bytearray(in_bytes)
     out_data = bytearray()
-    curr_ch = in_data.pop(0)
-    run_length = 1
-    while len(in_data) > 0:
-        ch = in_data.pop(0)
-        if ch == curr_ch and run_length < MAX_RUN_LENGTH:
-            run_length += 1
+    i = 0
+    while i < len(in_bytes):
+        ch = in_bytes[i]
+        end = min(len(in_bytes), i + MAX_RUN_LENGTH)
+        j = i + 1
+        while j < end and in_bytes[j] == ch:
+            j += 1
+        run_length = j - i
+        if run_length == 1 and ch < 128:  # First bit not 1
+            out_data.append(ch)
         else:
-            if run_length == 1 and curr_ch < 128:  # First bit not 1
-                out_data.append(curr_ch)
-            else:
-                out_data.append(run_length | 0b10000000)
-                out_data.append(curr_ch)
-            curr_ch = ch
-            run_length = 1
-    # TODO: rewrite the loop so i don't have to do this
-    if run_length == 1 and curr_ch < 128:  # First bit not 1
-        out_data.append(curr_ch)
-    else:
-        out_data.append(run_length | 0b10000000)
-        out_data.append(curr_ch)
+            out_data.append(run_length | 0b10000000)
+            out_data.append(ch)
+        i = j
     return bytes(out_data)
 
 
 def run_length_decode(in_bytes):
-    in_data = bytearray(in_bytes)
     out_data = bytearray()
-    while len(in_data) > 0:
-        ch = in_data.pop(0)
+    i = 0
+    while i < len(in_bytes):
+        ch = in_bytes[i]
         if ch < 128:
             out_data.append(ch)
-        elif len(in_data) > 0:
+            i += 1
+        elif i + 1 < len(in_bytes):
             run_length = ch & 0b01111111
-            ch = in_data.pop(0)
-            for _ in range(run_length):
-                out_data.append(ch)
+            out_data += in_bytes[i+1:i+2] * run_length
+            i += 2
+        else:
+            break
+    return bytes(out_data)
+
+
+# bzip2's zero-run coding. A run of zeros is written as its length in
+# bijective base 2, least significant digit first, with RUNA for a 1
+# digit and RUNB for a 2 digit, so a run of any length costs about
+# log2(length) symbols. Every other MTF value moves up by one to make
+# room, giving 257 symbols in all.
+RUNA = 0
+RUNB = 1
+ZERO_RUN_SYMBOL_BITS = 9
+
+
+def zero_run_encode(in_bytes):
+    symbols = []
+    i = 0
+    while i < len(in_bytes):
+        ch = in_bytes[i]
+        if ch != 0:
+            symbols.append(ch + 1)
+            i += 1
+            continue
+        j = i + 1
+        while j < len(in_bytes) and in_bytes[j] == 0:
+            j += 1
+        run_length = j - i
+        while run_length > 0:
+            if run_length & 1:
+                symbols.append(RUNA)
+                run_length = (run_length - 1) // 2
+            else:
+                symbols.append(RUNB)
+                run_length = (run_length - 2) // 2
+        i = j
+    return symbols
+
+
+def zero_run_decode(symbols):
+    out_data = bytearray()
+    run_length = 0
+    weight = 1
+    for s in symbols:
+        if s == RUNA:
+            run_length += weight
+            weight *= 2
+        elif s == RUNB:
+            run_length += 2 * weight
+            weight *= 2
+        else:
+            if run_length:
+                out_data += bytes(run_length)
+                run_length = 0
+                weight = 1
+            out_data.append(s - 1)
+    if run_length:
+        out_data += bytes(run_length)
     return bytes(out_data)
 
 
 BLOCK_SIZE_BITS = 16
+# The top bit of the old 16-bit tree length field, which was always
+# clear, says whether the block uses zero-run coding instead of RLE
+TREE_LEN_BITS = 15
 
-def encode_block(in_bytes):
+def encode_block(in_bytes, zero_runs=True, coder=DEFAULT_CODER, stats=None):
+    if stats is not None:
+        stats.count('bzip.blocks')
     if len(in_bytes) == 1:
-        block = BitArray()
-        block.append(Bits('0b1'))
-        block.append(in_bytes)
+        block = BitWriter()
+        block.write(1, 1)
+        block.write_bytes(in_bytes)
         return block.tobytes()
 
-    bw_xf, eof_idx = burrows_wheeler_transform(in_bytes)
-    front_xf = move_to_front_transform(bw_xf)
-    rle_data = run_length_encode(front_xf)
-    huff_data, huff_symbols, serialized_tree = huffman_encode(rle_data, symbol_bits=8)
+    bw_xf, eof_idx = timed(stats, 'bzip.bwt', burrows_wheeler_transform, in_bytes)
+    front_xf = timed(stats, 'bzip.mtf', move_to_front_transform, bw_xf)
+    if zero_runs:
+        rle_symbols = timed(stats, 'bzip.zero_runs', zero_run_encode, front_xf)
+        huff_data, huff_symbols, serialized_tree = entropy_encode_symbols(
+            rle_symbols, symbol_bits=ZERO_RUN_SYMBOL_BITS, coder=coder, stats=stats)
+    else:
+        rle_data = timed(stats, 'bzip.rle', run_length_encode, front_xf)
+        huff_data, huff_symbols, serialized_tree = entropy_encode(rle_data, symbol_bits=8,
+                                                                  coder=coder, stats=stats)
     huff_len = len(huff_data)
     tree_len = len(serialized_tree)
 
-    block = BitArray()
-    block.append(Bits('0b0'))
-    block.append(Bits(uint=tree_len, length=16))
-    block.append(Bits(serialized_tree))
-    block.append(Bits(uint=huff_symbols, length=16))
-    block.append(Bits(uint=huff_len, length=16))
-    block.append(Bits(huff_data))
-    block.append(Bits(uint=eof_idx, length=BLOCK_SIZE_BITS))
+    block = BitWriter()
+    block.write(0, 1)
+    block.write_bool(zero_runs)
+    block.write(tree_len, TREE_LEN_BITS)
+    block.write_bytes(serialized_tree)
+    block.write(huff_symbols, 16)
+    block.write(huff_len, 16)
+    block.write_bytes(huff_data)
+    block.write(eof_idx, BLOCK_SIZE_BITS)
 
     return block.tobytes()
 
 
-def decode_block(in_bytes):
-    in_data = ConstBitStream(in_bytes)
-    is_literal_byte = in_data.read('bool')
+def decode_block(in_bytes, stats=None):
+    if stats is not None:
+        stats.count('bzip.blocks')
+    in_data = BitReader(in_bytes)
+    is_literal_byte = in_data.read_bool()
     if is_literal_byte:
-        return in_data.read('bytes:1')
+        return in_data.read_bytes(1)
+
+    zero_runs = in_data.read_bool()
+    tree_len = in_data.read(TREE_LEN_BITS)
+    serialized_tree = in_data.read_bytes(tree_len)
+    huff_symbols = in_data.read(16)
+    huff_len = in_data.read(16)
+    huff_data = in_data.read_bytes(huff_len)
+    eof_idx = in_data.read(BLOCK_SIZE_BITS)
+
+    if zero_runs:
+        rle_symbols = entropy_decode_symbols(huff_data, huff_symbols, serialized_tree,
+                                             symbol_bits=ZERO_RUN_SYMBOL_BITS, stats=stats)
+        front_xf = timed(stats, 'bzip.zero_runs_decode', zero_run_decode, rle_symbols)
+    else:
+        rle_data = entropy_decode(huff_data, huff_symbols, serialized_tree, symbol_bits=8, stats=stats)
+        front_xf = timed(stats, 'bzip.rle_decode', run_length_decode, rle_data)
+    bw_xf = timed(stats, 'bzip.mtf_decode', move_to_front_reverse_transform, front_xf)
+    out_bytes = timed(stats, 'bzip.bwt_decode', burrows_wheeler_reverse_transform, bw_xf, eof_idx)
+
+    return out_bytes
 
-    tree_len = in_data.read('uint:16')
-    serialized_tree = in_data.read(f'bytes:{tree_len}')
-    huff_symbols = in_data.read('uint:16')
-    huff_len = in_data.read('uint:16')
-    huff_data = in_data.read(f'bytes:{huff_len}')
-    eof_idx = in_data.read(f'uint:{BLOCK_SIZE_BITS}')
 
-    rle_data = huffman_decode(huff_data, huff_symbols, serialized_tree, symbol_bits=8)
-    front_xf = run_length_decode(rle_data)
-    bw_xf = move_to_front_reverse_transform(front_xf)
-    out_bytes = burrows_wheeler_reverse_transform(bw_xf, eof_idx)
+MAX_BLOCK_LEN = 2**BLOCK_SIZE_BITS - 1
 
-    return out_bytes
 
+def write_block(out_data, block_data, zero_runs=True, coder=DEFAULT_CODER, stats=None):
+    encoded_block = encode_block(block_data, zero_runs, coder, stats)
+    write_encoded_block(out_data, encoded_block)
+
+
+def with_stats(fn, *args, **kwargs):
+    """Call fn with a fresh Stats, returning (result, stats), so that a
+    worker process can hand its stats back."""
+    stats = Stats()
+    return fn(*args, stats=stats, **kwargs), stats
 
-def bzip0_encode(in_bytes):
-    in_data = ConstBitStream(in_bytes)
-    out_data = BitArray()
-    while in_data.bitpos < in_data.length:
-        block_size = min((in_data.length - in_data.bitpos) // 8, 2**BLOCK_SIZE_BITS - 1)
-        block_data = in_data.read(f'bytes:{block_size}')
-        encoded_block = encode_block(block_data)
-        encoded_block_size = len(encoded_block)
-        out_data.append(Bits(uint=encoded_block_size, length=BLOCK_SIZE_BITS))
-        out_data.append(encoded_block)
-    return out_data.tobytes()
 
+def write_encoded_block(out_data, encoded_block):
+    encoded_block_size = len(encoded_block)
+    out_data.write(encoded_block_size, BLOCK_SIZE_BITS)
+    out_data.write_bytes(encoded_block)
 
-def bzip0_decode(in_bytes):
-    in_data = ConstBitStream(in_bytes)
-    out_data = BitArray()
-    try:
-        while True:
-            encoded_block_size = in_data.read(f'uint:{BLOCK_SIZE_BITS}')
-            encoded_block = in_data.read(f'bytes:{encoded_block_size}')
-            decoded_block = decode_block(encoded_block)
-            out_data.append(decoded_block)
-    except ReadError:
-        pass
+
+def bzip0_encode(in_bytes, workers=1, zero_runs=True, coder=DEFAULT_CODER, stats=None):
+    """Encode in_bytes, using a pool of worker processes if workers > 1.
+
+    workers=None uses one worker per CPU. The output is the same
+    whatever the number of workers. zero_runs=False uses the PCX-style
+    RLE instead of zero-run coding, and coder picks the entropy coder
+    (see entropy.py); any kind of block decodes.
+    """
+    blocks = (bytes(in_bytes[block_start:block_start + MAX_BLOCK_LEN])
+              for block_start in range(0, len(in_bytes), MAX_BLOCK_LEN))
+    out_data = BitWriter()
+    if workers == 1:
+        for block_data in blocks:
+            write_block(out_data, block_data, zero_runs, coder, stats)
+    elif stats is None:
+        encode = partial(encode_block, zero_runs=zero_runs, coder=coder)
+        for encoded_block in ordered_map(encode, blocks, workers=workers):
+            write_encoded_block(out_data, encoded_block)
+    else:
+        encode = partial(with_stats, encode_block, zero_runs=zero_runs, coder=coder)
+        for encoded_block, block_stats in ordered_map(encode, blocks, workers=workers):
+            stats.merge(block_stats)
+            write_encoded_block(out_data, encoded_block)
     return out_data.tobytes()
 
 
+def block_offsets(in_bytes):
+    """Return the (start, end) byte offsets of each encoded block.
+
+    Only the length prefixes are read, so this is cheap, and it lets the
+    blocks be handed out to be decoded independently.
+    """
+    offsets = []
+    pos = 0
+    while pos + BLOCK_SIZE_BITS // 8 <= len(in_bytes):
+        encoded_block_size = int.from_bytes(in_bytes[pos:pos + BLOCK_SIZE_BITS // 8], 'big')
+        start = pos + BLOCK_SIZE_BITS // 8
+        if start + encoded_block_size > len(in_bytes):
+            break
+        offsets.append((start, start + encoded_block_size))
+        pos = start + encoded_block_size
+    return offsets
+
+
+def bzip0_decode(in_bytes, workers=1, stats=None):
+    """Decode in_bytes, using a pool of worker processes if workers > 1."""
+    if workers == 1:
+        in_data = BitReader(in_bytes)
+        out_data = bytearray()
+        try:
+            while True:
+                encoded_block_size = in_data.read(BLOCK_SIZE_BITS)
+                encoded_block = in_data.read_bytes(encoded_block_size)
+                decoded_block = decode_block(encoded_block, stats)
+                out_data += decoded_block
+        except ReadError:
+            pass
+        return bytes(out_data)
+
+    blocks = (bytes(in_bytes[start:end]) for start, end in block_offsets(in_bytes))
+    if stats is None:
+        return b''.join(ordered_map(decode_block, blocks, workers=workers))
+    out_data = bytearray()
+    for decoded_block, block_stats in ordered_map(partial(with_stats, decode_block), blocks, workers=workers):
+        stats.merge(block_stats)
+        out_data += decoded_block
+    return bytes(out_data)
+
+
+class Bzip0Compressor:
+    """Incremental bzip0 encoder, in the style of zlib.compressobj().
+
+    Holds at most one block of input, and produces the same output as
+    bzip0_encode() on the concatenated input.
+    """
+    def __init__(self, zero_runs=True, coder=DEFAULT_CODER):
+        self.zero_runs = zero_runs
+        self.coder = coder
+        self.buffer = bytearray()
+
+    def compress(self, data):
+        self.buffer += data
+        out_data = BitWriter()
+        while len(self.buffer) >= MAX_BLOCK_LEN:
+            write_block(out_data, bytes(self.buffer[:MAX_BLOCK_LEN]), self.zero_runs, self.coder)
+            del self.buffer[:MAX_BLOCK_LEN]
+        return out_data.tobytes()
+
+    def flush(self):
+        out_data = BitWriter()
+        if self.buffer:
+            write_block(out_data, bytes(self.buffer), self.zero_runs, self.coder)
+            self.buffer.clear()
+        return out_data.tobytes()
+
+
+class Bzip0Decompressor:
+    """Incremental bzip0 decoder, in the style of zlib.decompressobj()."""
+    def __init__(self):
+        self.input = BitInputBuffer()
+
+    def decompress(self, data):
+        in_data = self.input.feed(data)
+        consumed = in_data.pos
+        out_data = bytearray()
+        try:
+            while True:
+                encoded_block_size = in_data.read(BLOCK_SIZE_BITS)
+                encoded_block = in_data.read_bytes(encoded_block_size)
+                consumed = in_data.pos
+                out_data += decode_block(encoded_block)
+        except ReadError:
+            pass
+        self.input.consume(consumed)
+        return bytes(out_data)
+
+    def flush(self):
+        return b''
+
+
 if __name__ == '__main__':
     with open('test.dat', 'rb') as f:
         input_data = f.read()
@@ -0,0 +1,122 @@
+"""Opt-in instrumentation for the codecs.
+
+Functions that support it take a stats argument, None by default. Given
+a Stats object, they record how long each stage takes and how much goes
+in and out of it, along with counters (match finder probes, LZW codes,
+dictionary resets) and histograms (Huffman code lengths). Stage names
+are prefixed with the codec, as in 'bzip.bwt' or 'huffman.emit'.
+
+Stages are timed around whole calls, never per byte, so with stats=None
+the only cost is a None check per stage.
+
+    stats = Stats()
+    bzip0_encode(data, stats=stats)
+    print(stats.report())
+"""
+
+from collections import Counter, defaultdict
+from time import perf_counter
+
+
+class Stage:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.size_in = 0
+        self.size_out = 0
+
+    def as_dict(self):
+        return {'calls': self.calls, 'seconds': self.seconds,
+                'size_in': self.size_in, 'size_out': self.size_out}
+
+
+class Stats:
+    """Per-stage timings, sizes, counters and histograms.
+
+    Sizes are in bytes, except where a stage takes or produces symbols
+    or tokens, when they're counts of those. If callback is given, it's
+    called as callback(name, seconds, size_in, size_out) at the end of
+    every stage.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = defaultdict(Stage)
+        self.counters = Counter()
+        self.histograms = defaultdict(Counter)
+
+    def record_stage(self, name, seconds, size_in, size_out):
+        stage = self.stages[name]
+        stage.calls += 1
+        stage.seconds += seconds
+        stage.size_in += size_in
+        stage.size_out += size_out
+        if self.callback is not None:
+            self.callback(name, seconds, size_in, size_out)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def add_to_histogram(self, name, key, amount=1):
+        self.histograms[name][key] += amount
+
+    def merge(self, other):
+        """Add in the figures from another Stats, such as one filled in
+        by a worker process. Callbacks aren't called again."""
+        for name, other_stage in other.stages.items():
+            stage = self.stages[name]
+            stage.calls += other_stage.calls
+            stage.seconds += other_stage.seconds
+            stage.size_in += other_stage.size_in
+            stage.size_out += other_stage.size_out
+        self.counters.update(other.counters)
+        for name, histogram in other.histograms.items():
+            self.histograms[name].update(histogram)
+
+    def __getstate__(self):
+        # Callbacks are often lambdas, which can't be sent to workers
+        state = self.__dict__.copy()
+        state['callback'] = None
+        return state
+
+    def as_dict(self):
+        return {
+            'stages': {name: stage.as_dict() for name, stage in self.stages.items()},
+            'counters': dict(self.counters),
+            'histograms': {name: dict(sorted(h.items())) for name, h in self.histograms.items()},
+        }
+
+    def report(self):
+        lines = []
+        total = sum(stage.seconds for stage in self.stages.values()) or 1.0
+        for name, stage in sorted(self.stages.items(), key=lambda item: -item[1].seconds):
+            lines.append(f'{name:<24} {stage.seconds:9.4f}s {100 * stage.seconds / total:5.1f}%  '
+                         f'{stage.calls:6} calls  {stage.size_in:>10} in  {stage.size_out:>10} out')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'{name:<24} {value}')
+        for name, histogram in sorted(self.histograms.items()):
+            buckets = ', '.join(f'{k}: {v}' for k, v in sorted(histogram.items()))
+            lines.append(f'{name:<24} {buckets}')
+        return '\n'.join(lines)
+
+
+def size_of(value):
+    """The size recorded for a stage's input or output: the length of
+    value, or of its first item if it's a tuple like (data, ...)."""
+    if isinstance(value, tuple):
+        value = value[0]
+    try:
+        return len(value)
+    except TypeError:
+        return 0
+
+
+def timed(stats, name, fn, *args, **kwargs):
+    """Call fn(*args, **kwargs), recording it as a stage if stats isn't
+    None. The stage's input size is that of the first argument."""
+    if stats is None:
+        return fn(*args, **kwargs)
+    start = perf_counter()
+    result = fn(*args, **kwargs)
+    stats.record_stage(name, perf_counter() - start,
+                       size_of(args[0]) if args else 0, size_of(result))
+    return result
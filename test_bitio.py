@@ -0,0 +1,30 @@
+import random
+
+import pytest
+
+from bitio import BitReader, BitWriter
+from shitty_bzip import bzip0_encode
+
+
+def test_round_trip():
+    fields = [(5, 3), (0, 1), (70000, 17), (1, 1), (2**40 + 3, 41)]
+    out = BitWriter()
+    for value, nbits in fields:
+        out.write(value, nbits)
+    reader = BitReader(out.tobytes())
+    assert [reader.read(nbits) for _, nbits in fields] == [value for value, _ in fields]
+
+
+@pytest.mark.parametrize('value, nbits', [(70000, 16), (2, 1), (1, 0), (-1, 8)])
+def test_write_rejects_values_that_do_not_fit(value, nbits):
+    with pytest.raises(ValueError):
+        BitWriter().write(value, nbits)
+
+
+def test_bzip_header_overflow_is_an_error():
+    # RLE makes these incompressible bytes longer, overflowing the
+    # 16-bit symbol count in the block header
+    random.seed(5)
+    data = bytes(random.randrange(127, 256) for _ in range(65535))
+    with pytest.raises(ValueError):
+        bzip0_encode(data, zero_runs=False)
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import cli
+import container
+from cli import STREAM_CODECS, main
+
+
+@pytest.fixture
+def in_path(tmp_path):
+    path = tmp_path / 'in.dat'
+    path.write_bytes(b'the quick brown fox jumps over the lazy dog. ' * 200 + bytes(range(256)))
+    return str(path)
+
+
+@pytest.mark.parametrize('codec', sorted(container.CODECS))
+def test_test_command_round_trips_every_codec(in_path, codec, capsys):
+    assert main(['test', '-a', codec, in_path]) == 0
+    assert 'Decoded data matches original: True' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('codec', sorted(set(container.CODECS) - set(STREAM_CODECS)))
+def test_codecs_without_a_stream_are_tested_as_containers(in_path, codec):
+    with open(in_path, 'rb') as f:
+        data = f.read()
+    assert cli.test_file(in_path, codec) == (True, len(data), len(container.pack(data, codec)))
+
+
+def test_corrupt_container_is_reported_and_leaves_no_output(in_path, tmp_path, capsys):
+    packed = str(tmp_path / 'in.lzss')
+    assert main(['compress', '-a', 'lzss', in_path, packed]) == 0
+    with open(packed, 'r+b') as f:
+        f.seek(60)
+        byte = f.read(1)
+        f.seek(60)
+        f.write(bytes([byte[0] ^ 0xff]))
+    out_path = tmp_path / 'out.dat'
+    with pytest.raises(SystemExit) as exit_info:
+        main(['decompress', packed, str(out_path)])
+    assert exit_info.value.code == 1
+    assert 'Block 0 is corrupt' in capsys.readouterr().err
+    assert not out_path.exists()
+
+
+def test_decompress_strips_the_containers_codec_suffix(in_path):
+    with open(in_path, 'rb') as f:
+        data = f.read()
+    assert main(['compress', '-a', 'lzss', in_path]) == 0
+    os.remove(in_path)
+    assert main(['decompress', in_path + '.lzss']) == 0
+    with open(in_path, 'rb') as f:
+        assert f.read() == data
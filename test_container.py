@@ -0,0 +1,96 @@
+import os
+import random
+
+import pytest
+
+import container
+from container import ContainerError, ContainerReader, pack, unpack
+
+
+with open(os.path.join(os.path.dirname(__file__), 'test.dat'), 'rb') as f:
+    TEXT = f.read(100000)
+
+
+def random_bytes(n, seed=1):
+    rng = random.Random(seed)
+    return bytes(rng.randrange(256) for _ in range(n))
+
+
+@pytest.mark.parametrize('codec', sorted(container.CODECS))
+def test_random_input_round_trips(codec):
+    # Over 64K, which overflows bzip's 16-bit block fields
+    data = random_bytes(70000)
+    packed = pack(data, codec)
+    assert unpack(packed) == data
+    # Incompressible blocks are stored rather than expanded
+    assert len(packed) < len(data) + 200
+
+
+def test_version_1_containers_still_read():
+    data = TEXT[:20000]
+    packed = bytearray(pack(data, 'lzss'))
+    packed[4] = 1
+    assert unpack(packed) == data
+
+
+@pytest.mark.parametrize('codec', ['huffman', 'ahuffman'])
+@pytest.mark.parametrize('symbol_bits', [12, 16])
+def test_huffman_blocks_of_part_symbols_round_trip(codec, symbol_bits):
+    data = TEXT[:20001]
+    packed = pack(data, codec, block_size=2**12 + 1, symbol_bits=symbol_bits)
+    with ContainerReader(packed) as reader:
+        # None of them are stored, which would round trip anyway
+        assert all(len(reader.block_payload(i)[0]) < reader.block_size for i in range(reader.num_blocks - 1))
+        assert reader.read() == data
+
+
+def packed_text(codec='lzss', block_size=4096):
+    return pack(TEXT[:20000], codec, block_size=block_size)
+
+
+@pytest.mark.parametrize('start, end', [(0, None), (0, 4096), (4095, 4097), (100, 12000), (8192, 8193),
+                                        (19999, 20000), (5000, 5000), (15000, 100000), (30000, 40000)])
+def test_read_ranges_across_blocks(start, end):
+    with ContainerReader(packed_text()) as reader:
+        assert reader.read(start, end) == TEXT[:20000][start:end]
+
+
+def test_flipped_payload_byte_is_caught():
+    packed = bytearray(packed_text())
+    with ContainerReader(packed_text()) as reader:
+        offset = reader.offsets[2] + container.BLOCK_HEADER.size + 10
+    packed[offset] ^= 0x01
+    with ContainerReader(packed) as reader:
+        assert reader.verify() == [2]
+        assert reader.read_block(1) == TEXT[4096:8192]
+        with pytest.raises(ContainerError, match='Block 2 is corrupt'):
+            reader.read_block(2)
+        with pytest.raises(ContainerError):
+            reader.read(9000, 9001)
+
+
+@pytest.mark.parametrize('cut', [1, container.TRAILER.size, container.TRAILER.size + 1])
+def test_truncated_index_is_an_error(cut):
+    with pytest.raises(ContainerError, match='truncated'):
+        ContainerReader(packed_text()[:-cut])
+
+
+def test_index_pointing_past_the_end_is_an_error():
+    packed = bytearray(packed_text())
+    index_offset = len(packed) - container.TRAILER.size
+    packed[-container.TRAILER.size:] = container.TRAILER.pack(index_offset, 100, container.INDEX_MAGIC)
+    with pytest.raises(ContainerError, match='Index is truncated'):
+        ContainerReader(packed)
+
+
+@pytest.mark.parametrize('data', [b'', b'FWC', b'not a container at all'])
+def test_not_a_container(data):
+    with pytest.raises(ContainerError):
+        ContainerReader(data)
+
+
+def test_empty_input_packs_to_an_empty_container():
+    with ContainerReader(pack(b'')) as reader:
+        assert len(reader) == 0
+        assert reader.num_blocks == 0
+        assert reader.read() == b''
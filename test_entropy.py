@@ -0,0 +1,13 @@
+import pytest
+
+from entropy import CODERS, entropy_decode_symbols, entropy_encode_symbols, entropy_iter_symbols
+
+
+@pytest.mark.parametrize('coder', CODERS)
+@pytest.mark.parametrize('symbols', [[], [7] * 100, list(range(300)) * 3 + [5] * 5000],
+                         ids=['empty', 'one_symbol', 'mixed'])
+def test_iter_symbols_matches_decode_symbols(coder, symbols):
+    encoded = entropy_encode_symbols(symbols, symbol_bits=9, coder=coder)
+    decoded = entropy_iter_symbols(*encoded, symbol_bits=9)
+    assert not isinstance(decoded, list)
+    assert list(decoded) == entropy_decode_symbols(*encoded, symbol_bits=9) == symbols
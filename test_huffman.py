@@ -0,0 +1,23 @@
+import random
+
+import pytest
+
+from huffman import deserialize_code_lengths, huffman_decode, huffman_encode, serialize_code_lengths
+
+
+@pytest.mark.parametrize('symbol_bits', [1, 3, 8, 9])
+def test_code_lengths_round_trip(symbol_bits):
+    rng = random.Random(symbol_bits)
+    for _ in range(50):
+        symbols = rng.sample(range(2**symbol_bits), rng.randrange(2**symbol_bits + 1))
+        lengths = {s: rng.choice([1, 2, 3, 3, 7]) for s in symbols}
+        assert deserialize_code_lengths(serialize_code_lengths(lengths, symbol_bits), symbol_bits) == lengths
+
+
+@pytest.mark.parametrize('symbol_bits', [24, 32])
+def test_wide_alphabets_only_pay_for_the_symbols_used(symbol_bits):
+    data = bytes(random.Random(1).randrange(256) for _ in range(300))
+    encoded = huffman_encode(data, symbol_bits=symbol_bits)
+    # One run per symbol and gap, not one per possible symbol
+    assert len(encoded[2]) < 1000
+    assert huffman_decode(*encoded, symbol_bits=symbol_bits) == data
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from bitio import BitWriter, ReadError
+from entropy import CODERS, entropy_encode
+from huffman import pack_symbols
+from lz77 import LEVELS, Lz77Decompressor, lz77_decode, lz77_decode_from_tokens, lz77_encode, write_tokens
+from lz77_huffman import lz77deflate_decode, lz77huff_decode, lz77huff_encode, write_deflate_blocks
+from lzss import LITERAL, REFERENCE, lzss_decode, lzss_encode, lzssb_decode, lzssb_encode
+
+
+# (distance, length, next_ch): no distance at all, and one past the start
+BAD_TOKENS = [
+    [(0, 3, 65)],
+    [(0, 0, 65), (2, 3, 66)],
+]
+
+
+@pytest.mark.parametrize('tokens', BAD_TOKENS)
+def test_lz77_rejects_bad_distances(tokens):
+    with pytest.raises(ReadError):
+        lz77_decode_from_tokens(tokens)
+    with pytest.raises(ReadError):
+        lz77_decode(write_tokens(tokens, 12))
+    with pytest.raises(ReadError):
+        Lz77Decompressor().decompress(write_tokens(tokens, 12))
+
+
+@pytest.mark.parametrize('tokens', BAD_TOKENS)
+def test_lzss_rejects_bad_distances(tokens):
+    # write_lzss_token() would send a zero distance as a literal
+    out = BitWriter()
+    for dist, length, next_ch in tokens:
+        if length:
+            out.write(REFERENCE, 1)
+            out.write(dist, 12)
+            out.write(length, 4)
+        else:
+            out.write(LITERAL, 1)
+        out.write(next_ch, 8)
+    with pytest.raises(ReadError):
+        lzss_decode(out.tobytes())
+
+
+@pytest.mark.parametrize('encoded', [bytes([0x80, 0x00, 0x05]), bytes([0x40, 65, 0x00, 0x25])])
+def test_lzssb_rejects_bad_distances(encoded):
+    with pytest.raises(ReadError):
+        lzssb_decode(encoded)
+
+
+@pytest.mark.parametrize('tokens', BAD_TOKENS)
+def test_lz77huff_rejects_bad_distances(tokens):
+    symbols = [s for t in tokens for s in t]
+    with pytest.raises(ReadError):
+        lz77huff_decode(*entropy_encode(pack_symbols(symbols, 12), symbol_bits=12))
+
+
+def test_lz77deflate_rejects_bad_distances():
+    # Distances of zero can't be written in this format
+    with pytest.raises(ReadError):
+        lz77deflate_decode(write_deflate_blocks(BAD_TOKENS[1]))
+
+
+def test_overlapping_matches_round_trip():
+    data = b'a' * 1000 + b'abcabcabcabd' * 50 + bytes(range(256))
+    assert lz77_decode(lz77_encode(data)) == data
+    assert lzss_decode(lzss_encode(data)) == data
+    assert lzssb_decode(lzssb_encode(data)) == data
+
+
+@pytest.mark.parametrize('coder', CODERS)
+def test_lz77huff_round_trips(coder):
+    data = b'abcabcabcabd' * 50 + bytes(range(256)) + b'\x00' * 3000
+    assert lz77huff_decode(*lz77huff_encode(data, coder=coder)) == data
+
+
+@pytest.mark.parametrize('encode', [lz77_encode, lzss_encode, lzssb_encode], ids=['lz77', 'lzss', 'lzssb'])
+def test_higher_levels_are_never_larger(encode):
+    with open(os.path.join(os.path.dirname(__file__), 'test.dat'), 'rb') as f:
+        data = f.read(30000)
+    sizes = [len(encode(data, level=level)) for level in LEVELS]
+    assert sizes == sorted(sizes, reverse=True)
@@ -0,0 +1,37 @@
+import os
+import random
+
+import pytest
+
+from match_finder import MATCH_FINDERS, HashChainMatchFinder, NaiveMatchFinder
+
+
+def inputs():
+    random.seed(1)
+    with open(os.path.join(os.path.dirname(__file__), 'test.dat'), 'rb') as f:
+        text = f.read(20000)
+    return [
+        text,
+        bytes(random.choice(b'ab') for _ in range(5000)),
+        b'\x00' * 5000 + b'\x01' + b'\x00' * 3000,
+        b'abc' * 2000,
+    ]
+
+
+@pytest.mark.parametrize('match_finder', sorted(MATCH_FINDERS))
+@pytest.mark.parametrize('data', inputs(), ids=['text', 'binary', 'zeros', 'period3'])
+def test_finders_agree_with_naive(match_finder, data):
+    window_bits, max_len = 10, 14
+    naive = NaiveMatchFinder(data, window_bits, max_len)
+    finder = MATCH_FINDERS[match_finder](data, window_bits, max_len)
+    for pos in range(0, len(data), 7):
+        assert finder.find(pos) == naive.find(pos), pos
+
+
+def test_runs_stop_at_the_longest_match():
+    data = b'\x00' * 20000
+    finder = HashChainMatchFinder(data, 12, 14)
+    positions = range(0, len(data) - 20, 15)
+    for pos in positions:
+        finder.find(pos)
+    assert finder.probes <= 2 * len(positions)
@@ -0,0 +1,50 @@
+import os
+import random
+
+import pytest
+
+from range_coder import MAX_SYMBOL_BITS, range_decode, range_decode_symbols, range_encode, range_encode_symbols
+
+with open(os.path.join(os.path.dirname(__file__), 'test.dat'), 'rb') as f:
+    TEXT = f.read(50000)
+
+
+def inputs():
+    rng = random.Random(1)
+    return [
+        b'',
+        b'a',
+        b'\x00' * 10000,
+        bytes(rng.randrange(256) for _ in range(20000)),
+        # A skewed source, where the rare symbols get the smallest frequencies
+        bytes(rng.choice(b'aaaaaaaaaaaaaaaaaaaaaaaaaaaaab\xff') for _ in range(20000)),
+        TEXT,
+    ]
+
+
+@pytest.mark.parametrize('adaptive', [False, True], ids=['static', 'adaptive'])
+@pytest.mark.parametrize('data', inputs(), ids=['empty', 'one', 'zeros', 'random', 'skewed', 'text'])
+def test_round_trip(data, adaptive):
+    encoded = range_encode(data, adaptive=adaptive)
+    assert encoded[1] == len(data)
+    assert range_decode(*encoded) == data
+
+
+@pytest.mark.parametrize('adaptive', [False, True], ids=['static', 'adaptive'])
+@pytest.mark.parametrize('symbol_bits', [1, 9, 12, MAX_SYMBOL_BITS])
+def test_symbol_round_trip(symbol_bits, adaptive):
+    rng = random.Random(symbol_bits)
+    symbols = [min(int(rng.expovariate(0.01)), 2**symbol_bits - 1) for _ in range(5000)]
+    encoded = range_encode_symbols(symbols, symbol_bits, adaptive=adaptive)
+    assert range_decode_symbols(*encoded, symbol_bits=symbol_bits) == symbols
+
+
+def test_compresses_text():
+    for adaptive in (False, True):
+        data, _, model = range_encode(TEXT, adaptive=adaptive)
+        assert len(data) + len(model) < 0.7 * len(TEXT)
+
+
+def test_too_wide_symbols_are_rejected():
+    with pytest.raises(ValueError):
+        range_encode_symbols([0], MAX_SYMBOL_BITS + 1)
@@ -0,0 +1,72 @@
+import os
+import random
+
+import pytest
+
+from huffman import (AdaptiveHuffmanCompressor, AdaptiveHuffmanDecompressor,
+                     HuffmanCompressor, HuffmanDecompressor)
+from lz77 import Lz77Compressor, Lz77Decompressor
+from lzss import LzssCompressor, LzssDecompressor, LzssbCompressor, LzssbDecompressor
+from lzw_fixed import LzwfCompressor, LzwfDecompressor
+from lzw_variable import LzwvCompressor, LzwvDecompressor
+from shitty_bzip import Bzip0Compressor, Bzip0Decompressor
+
+
+STREAMS = {
+    'lz77': (Lz77Compressor, Lz77Decompressor),
+    'lzss': (LzssCompressor, LzssDecompressor),
+    'lzssb': (LzssbCompressor, LzssbDecompressor),
+    'huffman': (HuffmanCompressor, HuffmanDecompressor),
+    'ahuffman': (AdaptiveHuffmanCompressor, AdaptiveHuffmanDecompressor),
+    'lzwf': (LzwfCompressor, LzwfDecompressor),
+    'lzwv': (LzwvCompressor, LzwvDecompressor),
+    'bzip': (Bzip0Compressor, Bzip0Decompressor),
+}
+
+with open(os.path.join(os.path.dirname(__file__), 'test.dat'), 'rb') as f:
+    TEXT = f.read(70000)
+
+
+def feed(codec_obj, process, data, sizes):
+    """Run data through process in pieces of the given sizes, in turn."""
+    out = bytearray()
+    pos = 0
+    for size in sizes:
+        if pos >= len(data):
+            break
+        out += process(data[pos:pos+size])
+        pos += size
+    out += process(data[pos:])
+    out += codec_obj.flush()
+    return bytes(out)
+
+
+def one_shot(codec_obj, process, data):
+    return process(data) + codec_obj.flush()
+
+
+def random_sizes(seed):
+    rng = random.Random(seed)
+    return [rng.choice([0, 1, 2, 7, 100, 4096, 30000]) for _ in range(200)]
+
+
+@pytest.mark.parametrize('codec', sorted(STREAMS))
+def test_chunked_compression_matches_one_shot(codec):
+    compressor_class, decompressor_class = STREAMS[codec]
+    compressor = compressor_class()
+    whole = one_shot(compressor, compressor.compress, TEXT)
+    for seed in range(2):
+        compressor = compressor_class()
+        assert feed(compressor, compressor.compress, TEXT, random_sizes(seed)) == whole
+    decompressor = decompressor_class()
+    assert one_shot(decompressor, decompressor.decompress, whole) == TEXT
+
+
+@pytest.mark.parametrize('codec', sorted(STREAMS))
+def test_chunked_decompression_matches_one_shot(codec):
+    compressor_class, decompressor_class = STREAMS[codec]
+    compressor = compressor_class()
+    compressed = one_shot(compressor, compressor.compress, TEXT)
+    for sizes in ([1] * 3000, random_sizes(2)):
+        decompressor = decompressor_class()
+        assert feed(decompressor, decompressor.decompress, compressed, sizes) == TEXT